@@ -2,14 +2,22 @@ from django.contrib import admin
 
 # Register your models here.
 from django.contrib import admin
-from .models import UserProfile, Movie, Watchlist, SearchHistory
+from .models import UserProfile, Movie, Watchlist, SearchHistory, SearchRollup, LLMUsage, StripeEvent
 
 @admin.register(UserProfile)
 class UserProfileAdmin(admin.ModelAdmin):
-    list_display = ['user', 'subscription_tier', 'subscription_active', 'created_at']
+    list_display = ['user', 'subscription_tier', 'monthly_price', 'watchlist_limit', 'subscription_active', 'created_at']
     list_filter = ['subscription_tier', 'subscription_active']
     search_fields = ['user__username', 'user__email']
 
+    @admin.display(description='Price')
+    def monthly_price(self, obj):
+        return f'${obj.plan.price}'
+
+    @admin.display(description='Watchlist limit')
+    def watchlist_limit(self, obj):
+        return obj.plan.max_watchlist or 'Unlimited'
+
 @admin.register(Movie)
 class MovieAdmin(admin.ModelAdmin):
     list_display = ['title', 'year', 'genre', 'rating', 'created_at']
@@ -26,4 +34,28 @@ class WatchlistAdmin(admin.ModelAdmin):
 class SearchHistoryAdmin(admin.ModelAdmin):
     list_display = ['user', 'query', 'genre', 'created_at']
     list_filter = ['genre', 'created_at']
-    search_fields = ['user__username', 'query']
\ No newline at end of file
+    search_fields = ['user__username', 'query']
+    list_select_related = ['user']
+    # Skip the unfiltered COUNT(*) over the whole table on every page
+    show_full_result_count = False
+
+@admin.register(SearchRollup)
+class SearchRollupAdmin(admin.ModelAdmin):
+    list_display = ['day', 'normalized_query', 'genre', 'count']
+    list_filter = ['genre', 'day']
+    search_fields = ['normalized_query']
+    date_hierarchy = 'day'
+
+@admin.register(LLMUsage)
+class LLMUsageAdmin(admin.ModelAdmin):
+    list_display = ['user', 'period', 'tokens', 'requests', 'updated_at']
+    list_filter = ['period']
+    search_fields = ['user__username']
+    list_select_related = ['user']
+
+@admin.register(StripeEvent)
+class StripeEventAdmin(admin.ModelAdmin):
+    list_display = ['event_id', 'type', 'customer_id', 'status', 'attempts', 'created', 'processed_at']
+    list_filter = ['status', 'type']
+    search_fields = ['event_id', 'customer_id']
+    readonly_fields = ['received_at', 'processed_at']
\ No newline at end of file
@@ -1,6 +1,17 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 
 
 class CinemaiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cinemai'
+
+    def ready(self):
+        # Connect the signal receivers that maintain taste profiles,
+        # invalidate cached entitlements and set up Postgres connections
+        from . import entitlements, taste  # noqa: F401
+        from .dbtuning import postgres  # noqa: F401
+
+        # Table rebuilds in later migrations drop the SQLite FTS triggers
+        from .search import restore_fts_triggers
+        post_migrate.connect(restore_fts_triggers, sender=self)
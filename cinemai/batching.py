@@ -0,0 +1,237 @@
+"""
+Micro-batching of concurrent calls.
+
+``MicroBatcher`` collects items submitted by many request threads for up
+to ``window`` seconds (or until ``max_size`` are waiting), hands the whole
+batch to one ``send`` call on a worker pool, and resolves each caller's
+future with its own result (an exception instance in its place fails just
+that caller). The dispatcher keeps collecting the next batch
+while earlier ones are still in flight.
+
+``AsyncMicroBatcher`` does the same for coroutines on one event loop (ASGI):
+``send`` is a coroutine function, batches are collected and dispatched as
+tasks on the callers' loop, and no thread is involved. Its collector only
+runs while items are waiting.
+"""
+import asyncio
+import logging
+import os
+import queue
+import threading
+import time
+import weakref
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class BatchMetrics:
+    """Batch fill and added latency, per process"""
+
+    def __init__(self, max_size, samples=1000):
+        self.max_size = max_size
+        self.batches = 0
+        self.items = 0
+        self.max_wait = 0.0
+        self._waits = deque(maxlen=samples)
+        self._sizes = deque(maxlen=samples)
+        self._lock = threading.Lock()
+
+    def record(self, size, waits):
+        with self._lock:
+            self.batches += 1
+            self.items += size
+            self._sizes.append(size)
+            self._waits.extend(waits)
+            self.max_wait = max(self.max_wait, *waits)
+
+    def snapshot(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            sizes = list(self._sizes)
+
+        def percentile(p):
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 2) if waits else 0.0
+
+        mean_size = sum(sizes) / len(sizes) if sizes else 0.0
+        return {
+            'batches': self.batches,
+            'items': self.items,
+            'mean_batch_size': round(mean_size, 2),
+            'mean_fill': round(mean_size / self.max_size, 3) if self.max_size else 0.0,
+            'added_latency_ms_p50': percentile(0.5),
+            'added_latency_ms_p95': percentile(0.95),
+            'added_latency_ms_max': round(self.max_wait * 1000, 2),
+        }
+
+
+class _Pending:
+    __slots__ = ('item', 'future', 'enqueued_at')
+
+    def __init__(self, item, future=None):
+        self.item = item
+        self.future = Future() if future is None else future
+        self.enqueued_at = time.monotonic()
+
+
+class MicroBatcher:
+    """Coalesces submitted items into batches for ``send(items) -> results``"""
+
+    def __init__(self, send, window, max_size, workers=4, name='micro-batcher'):
+        self.send = send
+        self.window = window
+        self.max_size = max_size
+        self.workers = workers
+        self.name = name
+        self.metrics = BatchMetrics(max_size)
+        self._queue = queue.SimpleQueue()
+        self._executor = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def submit(self, item):
+        """Queue ``item``; returns a Future for its result"""
+        self._ensure_thread()
+        pending = _Pending(item)
+        self._queue.put(pending)
+        return pending.future
+
+    def _ensure_thread(self):
+        # Workers forked from a preloaded master must start their own thread
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._queue = queue.SimpleQueue()
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix=self.name)
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _collect(self):
+        """Block for the first item, then gather more until the window closes or the batch is full"""
+        batch = [self._queue.get()]
+        deadline = batch[0].enqueued_at + self.window
+        while len(batch) < self.max_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        # Callers that gave up (cancelled futures) are left out
+        batch = [pending for pending in batch if pending.future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        dispatched_at = time.monotonic()
+        self.metrics.record(len(batch), [dispatched_at - pending.enqueued_at for pending in batch])
+        logger.debug('%s: dispatching %d/%d items', self.name, len(batch), self.max_size)
+        try:
+            results = list(self.send([pending.item for pending in batch]))
+            if len(results) != len(batch):
+                raise ValueError(f'{self.name}: expected {len(batch)} results, got {len(results)}')
+        except BaseException as exc:
+            for pending in batch:
+                pending.future.set_exception(exc)
+            return
+        for pending, result in zip(batch, results):
+            if isinstance(result, BaseException):
+                pending.future.set_exception(result)
+            else:
+                pending.future.set_result(result)
+
+
+class _LoopState:
+    __slots__ = ('queue', 'collector', 'tasks')
+
+    def __init__(self):
+        self.queue = asyncio.Queue()
+        self.collector = None
+        # Strong references to in-flight dispatches
+        self.tasks = set()
+
+
+class AsyncMicroBatcher:
+    """Coalesces awaited items into batches for ``await send(items) -> results``"""
+
+    def __init__(self, send, window, max_size, name='async-micro-batcher'):
+        self.send = send
+        self.window = window
+        self.max_size = max_size
+        self.name = name
+        self.metrics = BatchMetrics(max_size)
+        self._loops = weakref.WeakKeyDictionary()
+
+    async def submit(self, item):
+        """Queue ``item`` and wait for its result"""
+        loop = asyncio.get_running_loop()
+        state = self._loops.get(loop)
+        if state is None:
+            # Each state's collector task refers to its loop, so weak keys alone
+            # don't let closed loops go
+            for closed in [other for other in self._loops if other.is_closed()]:
+                del self._loops[closed]
+            state = self._loops[loop] = _LoopState()
+        pending = _Pending(item, loop.create_future())
+        state.queue.put_nowait(pending)
+        if state.collector is None or state.collector.done():
+            state.collector = loop.create_task(self._run(state))
+        return await pending.future
+
+    async def _collect(self, queue):
+        batch = [queue.get_nowait()]
+        deadline = batch[0].enqueued_at + self.window
+        while len(batch) < self.max_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self, state):
+        # Exits once the queue is drained; the next submit starts a new one
+        while not state.queue.empty():
+            batch = await self._collect(state.queue)
+            task = asyncio.ensure_future(self._dispatch(batch))
+            state.tasks.add(task)
+            task.add_done_callback(state.tasks.discard)
+
+    async def _dispatch(self, batch):
+        # Callers that gave up (cancelled or timed out) are left out
+        batch = [pending for pending in batch if not pending.future.done()]
+        if not batch:
+            return
+        dispatched_at = time.monotonic()
+        self.metrics.record(len(batch), [dispatched_at - pending.enqueued_at for pending in batch])
+        logger.debug('%s: dispatching %d/%d items', self.name, len(batch), self.max_size)
+        try:
+            results = list(await self.send([pending.item for pending in batch]))
+            if len(results) != len(batch):
+                raise ValueError(f'{self.name}: expected {len(batch)} results, got {len(results)}')
+        except Exception as exc:
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(exc)
+            return
+        for pending, result in zip(batch, results):
+            if pending.future.done():
+                continue
+            if isinstance(result, BaseException):
+                pending.future.set_exception(result)
+            else:
+                pending.future.set_result(result)
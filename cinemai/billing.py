@@ -0,0 +1,172 @@
+"""
+Stripe billing: prices per tier and checkout sessions.
+
+* Stripe is called through one pooled, keep-alive ``requests`` session per
+  worker process, with explicit connect/read timeouts and Stripe's own
+  network retries (which reuse an idempotency key).
+* Every plan in ``cinemai.tiers`` has a recurring Stripe Price, found by its
+  ``lookup_key`` (created with its Product the first time). Ids come from
+  ``STRIPE_PRICE_IDS`` when set -- ``manage.py sync_stripe_prices`` prints
+  them -- and are otherwise looked up once per process and cached.
+* Checkout sessions are reused per user and tier: the session's
+  idempotency key and expiry are derived from a time window, so a
+  double-click, a retry or another worker within the window gets the same
+  open session back from Stripe instead of a new one, and this process
+  doesn't even ask again until it expires.
+
+``cinemai.fake_stripe`` serves the few endpoints used here for tests.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+import requests
+import stripe
+from django.conf import settings
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+
+from . import tiers
+
+logger = logging.getLogger(__name__)
+
+# Stripe won't let a checkout session expire sooner than this after creation
+MIN_SESSION_LIFETIME = 30 * 60
+
+_configured_pid = None
+_config_lock = threading.Lock()
+_price_ids = {}
+
+
+def configure():
+    """Point the stripe library at a pooled HTTP client (once per process)"""
+    global _configured_pid
+    if _configured_pid == os.getpid():
+        return
+    with _config_lock:
+        if _configured_pid == os.getpid():
+            return
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=settings.STRIPE_POOL_SIZE)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        stripe.api_key = settings.STRIPE_SECRET_KEY
+        if settings.STRIPE_API_BASE:
+            stripe.api_base = settings.STRIPE_API_BASE
+        stripe.max_network_retries = settings.STRIPE_MAX_NETWORK_RETRIES
+        stripe.default_http_client = stripe.http_client.RequestsClient(
+            timeout=(settings.STRIPE_CONNECT_TIMEOUT, settings.STRIPE_READ_TIMEOUT),
+            session=session,
+        )
+        _configured_pid = os.getpid()
+
+
+def lookup_key(plan):
+    # Includes the amount, so a price change gets a new Price
+    return f'cinemai_{plan.code.lower()}_monthly_{plan.price_cents}'
+
+
+def sync_prices():
+    """Find (or create) the Price of every tier in Stripe; returns {tier: price id}"""
+    configure()
+    keys = {lookup_key(plan): plan.code for plan in tiers.PLANS.values()}
+    found = {
+        keys[price['lookup_key']]: price['id']
+        for price in stripe.Price.list(lookup_keys=list(keys), active=True, limit=len(keys)).data
+    }
+    for plan in tiers.PLANS.values():
+        if plan.code in found:
+            continue
+        price = stripe.Price.create(
+            unit_amount=plan.price_cents,
+            currency=settings.STRIPE_CURRENCY,
+            recurring={'interval': 'month'},
+            product_data={'name': f'CinemAI {plan.name} Subscription'},
+            lookup_key=lookup_key(plan),
+            metadata={'tier': plan.code},
+            idempotency_key=f'price-{lookup_key(plan)}',
+        )
+        logger.info('Created Stripe price %s for %s', price['id'], plan.code)
+        found[plan.code] = price['id']
+    return found
+
+
+def price_id(tier):
+    """The Stripe Price id of a tier: settings, then this process, then Stripe"""
+    configured = settings.STRIPE_PRICE_IDS.get(tier)
+    if configured:
+        return configured
+    if tier not in _price_ids:
+        with _config_lock:
+            if tier not in _price_ids:
+                _price_ids.update(sync_prices())
+    return _price_ids[tier]
+
+
+def tier_for_price(price):
+    """The tier a Stripe Price id belongs to, if it is one of ours"""
+    for tier in tiers.PLANS:
+        if settings.STRIPE_PRICE_IDS.get(tier) == price or _price_ids.get(tier) == price:
+            return tier
+    return None
+
+
+@dataclass(frozen=True)
+class Checkout:
+    id: str
+    url: str
+    expires_at: int
+
+
+def _window(now):
+    """Start of the current reuse window and the expiry of sessions created in it"""
+    lifetime = max(settings.STRIPE_CHECKOUT_SESSION_TTL, 2 * MIN_SESSION_LIFETIME)
+    # Sessions created anywhere in the window still live >= MIN_SESSION_LIFETIME
+    length = lifetime - MIN_SESSION_LIFETIME
+    start = int(now // length * length)
+    return start, start + lifetime
+
+
+def checkout_session(user, tier, success_url, cancel_url):
+    """An open subscription checkout session for ``user`` and ``tier``, reused while it lasts"""
+    key = f'checkout:{user.pk}:{tier}'
+    checkout = cache.get(key)
+    if checkout is not None:
+        return checkout
+
+    configure()
+    now = time.time()
+    window_start, expires_at = _window(now)
+    # Parameters that must match for Stripe to replay a session; the
+    # subscription id changes once a checkout completes
+    profile = getattr(user, 'profile', None)
+    variant = hashlib.sha1(
+        f'{success_url}|{cancel_url}|{getattr(profile, "stripe_subscription_id", "")}'.encode('utf-8')
+    ).hexdigest()[:12]
+    session = stripe.checkout.Session.create(
+        mode='subscription',
+        line_items=[{'price': price_id(tier), 'quantity': 1}],
+        success_url=success_url,
+        cancel_url=cancel_url,
+        client_reference_id=str(user.pk),
+        metadata={'tier': tier},
+        # user_id lets subscription events that beat checkout.session.completed find the profile
+        subscription_data={'metadata': {'tier': tier, 'user_id': str(user.pk)}},
+        expires_at=expires_at,
+        # Same user, tier and window: Stripe returns the session it already made
+        idempotency_key=f'checkout-{user.pk}-{tier}-{window_start}-{variant}',
+    )
+    checkout = Checkout(session['id'], session.get('url') or '', session.get('expires_at') or expires_at)
+    # Stop handing it out a little before it expires
+    timeout = int(checkout.expires_at - now) - 60
+    if timeout > 0:
+        cache.set(key, checkout, timeout)
+    return checkout
+
+
+def forget_checkout(user_id, tier):
+    """Drop a finished session so the next checkout starts a new one"""
+    cache.delete(f'checkout:{user_id}:{tier}')
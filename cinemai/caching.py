@@ -0,0 +1,137 @@
+"""
+Cache namespaces: key versions, TTLs and hit rates.
+
+Each namespace lives in one cache alias and takes its version and timeout
+from ``CACHE_NAMESPACES``, so keys look like ``profile:v1:42`` and bumping a
+namespace's version orphans all of its entries without touching the
+others (old entries simply expire).
+
+Hits and misses are counted per process and added to shared counters in
+the default cache every ``CACHE_STATS_FLUSH_INTERVAL`` seconds;
+``manage.py cache_stats`` reports them and warms the hottest keys.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+_counts = Counter()
+_counts_lock = threading.Lock()
+_flushed_at = time.monotonic()
+
+
+class Namespace:
+    """A versioned key space with its own TTL in one cache alias"""
+
+    def __init__(self, name, alias='default'):
+        self.name = name
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @property
+    def version(self):
+        return settings.CACHE_NAMESPACES[self.name]['version']
+
+    @property
+    def timeout(self):
+        return settings.CACHE_NAMESPACES[self.name]['timeout']
+
+    def key(self, suffix):
+        return f'{self.name}:v{self.version}:{suffix}'
+
+    def get(self, suffix):
+        value = self.cache.get(self.key(suffix))
+        self.record(value is not None)
+        return value
+
+    def get_many(self, suffixes):
+        """{suffix: value} for the suffixes found"""
+        keys = {self.key(suffix): suffix for suffix in suffixes}
+        found = self.cache.get_many(list(keys))
+        self.record(True, len(found))
+        self.record(False, len(keys) - len(found))
+        return {keys[key]: value for key, value in found.items()}
+
+    def set(self, suffix, value):
+        self.cache.set(self.key(suffix), value, self.timeout)
+
+    def set_many(self, values):
+        self.cache.set_many({self.key(suffix): value for suffix, value in values.items()}, self.timeout)
+
+    def delete(self, suffix):
+        self.cache.delete(self.key(suffix))
+
+    def record(self, hit, count=1):
+        """Count a lookup; flushes this process's counts now and then"""
+        global _flushed_at
+        if not count:
+            return
+        with _counts_lock:
+            _counts[self.name, 'hits' if hit else 'misses'] += count
+            due = time.monotonic() - _flushed_at >= settings.CACHE_STATS_FLUSH_INTERVAL
+            if due:
+                _flushed_at = time.monotonic()
+        if due:
+            flush_stats()
+
+
+RECOMMENDATIONS = Namespace('recommendations', 'recommendations')
+PROFILE = Namespace('profile')
+TASTE = Namespace('taste')
+MOVIE = Namespace('movie', 'template_fragments')
+
+NAMESPACES = {namespace.name: namespace for namespace in (RECOMMENDATIONS, PROFILE, TASTE, MOVIE)}
+
+
+def _stats_key(name, kind):
+    return f'cache-stats:{name}:{kind}'
+
+
+def _incr(cache, key, delta):
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        if cache.add(key, delta, None):
+            return delta
+        return cache.incr(key, delta)
+
+
+def flush_stats():
+    """Add this process's counts to the shared counters"""
+    with _counts_lock:
+        counts = dict(_counts)
+        _counts.clear()
+    cache = caches['default']
+    for (name, kind), count in counts.items():
+        try:
+            _incr(cache, _stats_key(name, kind), count)
+        except Exception:
+            # Stats are best effort; never fail a request over them
+            logger.warning('Could not update cache stats for %s', name, exc_info=True)
+
+
+def stats():
+    """{namespace: (hits, misses)} across processes (after their last flush)"""
+    flush_stats()
+    cache = caches['default']
+    keys = [_stats_key(name, kind) for name in NAMESPACES for kind in ('hits', 'misses')]
+    values = cache.get_many(keys)
+    return {
+        name: (values.get(_stats_key(name, 'hits'), 0), values.get(_stats_key(name, 'misses'), 0))
+        for name in NAMESPACES
+    }
+
+
+def reset_stats():
+    with _counts_lock:
+        _counts.clear()
+    caches['default'].delete_many([_stats_key(name, kind) for name in NAMESPACES for kind in ('hits', 'misses')])
+
@@ -0,0 +1,201 @@
+import math
+import re
+from collections import defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db.models import Count, Value
+
+from .models import Movie, MovieTrigram
+from .titles import canonical_title, similarity, trigrams
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Trigrams in more of the catalog than this are too common to narrow a fuzzy lookup
+COMMON_TRIGRAM_SHARE = 0.05
+
+
+def clean_title(title):
+    """Trim and collapse whitespace in a title"""
+    return _WHITESPACE_RE.sub(' ', title or '').strip()
+
+
+def _first_by_normalized_title(movies, years=None):
+    """
+    Map normalized title -> lowest-id Movie, so duplicates resolve
+    consistently; a row whose year matches ``years[title]`` wins over that.
+    """
+    years = years or {}
+    by_title = {}
+    for movie in sorted(movies, key=lambda m: m.pk):
+        current = by_title.get(movie.normalized_title)
+        wanted_year = years.get(movie.normalized_title)
+        if current is None or (wanted_year and movie.year == wanted_year and current.year != wanted_year):
+            by_title[movie.normalized_title] = movie
+    return by_title
+
+
+def _as_recommendation(item):
+    """(title, year, imdb_id) from a plain title or a recommendation dict"""
+    if isinstance(item, str):
+        return clean_title(item), None, None
+    return clean_title(item.get('title')), item.get('year'), item.get('imdb_id')
+
+
+def _by_imdb_id(wanted):
+    """
+    Exact ``imdb_id`` matches (one indexed query) for the wanted titles
+    that came with an id. A match is only trusted when its title is
+    similar or its year agrees with the recommendation, so a made-up id
+    can't pull in the wrong film.
+    """
+    ids = {imdb_id: normalized for normalized, (_, _, imdb_id) in wanted.items() if imdb_id}
+    if not ids:
+        return {}
+    threshold = settings.TITLE_MATCH_THRESHOLD
+    matches = {}
+    for movie in Movie.objects.filter(imdb_id__in=list(ids)):
+        normalized = ids[movie.imdb_id]
+        year = wanted[normalized][1]
+        if (year and movie.year == year) or similarity(normalized, movie.normalized_title or '') >= threshold:
+            matches[normalized] = movie
+    return matches
+
+
+def _common_trigrams(trigram_set):
+    """The trigrams in ``trigram_set`` found in more than COMMON_TRIGRAM_SHARE of the catalog"""
+    cutoff = COMMON_TRIGRAM_SHARE * Movie.objects.count()
+    frequencies = (
+        MovieTrigram.objects.filter(trigram__in=trigram_set)
+        .values_list('trigram').annotate(movies=Count('id'))
+    )
+    return {trigram: movies for trigram, movies in frequencies if movies > cutoff}
+
+
+def fuzzy_matches(titles, threshold=None, candidates=10):
+    """
+    {normalized title: best existing Movie at least ``threshold``
+    trigram-similar to it} for the titles that have one.
+
+    Since similarity is shared / union and the union is at least the
+    title's own trigram count, a match must share at least
+    ``k = threshold * len(title trigrams)`` of them. The database does the
+    counting: one UNION ALL of grouped MovieTrigram queries, one per title,
+    returns the movies sharing k or more, the best ``candidates`` of each
+    are kept, and one ``in_bulk`` loads them for exact scoring. Trigrams
+    common to much of the catalog ("  t", "the") would make those queries
+    count most of the index, so up to k - 1 of them are left out and k
+    lowered to match.
+    """
+    if threshold is None:
+        threshold = settings.TITLE_MATCH_THRESHOLD
+    wanted = {normalized: trigrams(normalized) for normalized in titles if normalized}
+    if not wanted:
+        return {}
+
+    common = _common_trigrams(set().union(*wanted.values()))
+    titles = list(wanted)
+    queries = []
+    for index, normalized in enumerate(titles):
+        query_trigrams = wanted[normalized]
+        min_shared = math.ceil(threshold * len(query_trigrams))
+        skipped = sorted(query_trigrams & common.keys(), key=common.get, reverse=True)[:max(min_shared - 1, 0)]
+        queries.append(
+            MovieTrigram.objects.filter(trigram__in=query_trigrams.difference(skipped))
+            .values('movie').annotate(shared=Count('id'), title=Value(index))
+            .filter(shared__gte=min_shared - len(skipped))
+            .order_by()
+            .values_list('title', 'movie', 'shared')
+        )
+    shared_counts = defaultdict(list)
+    for index, movie_id, shared in queries[0].union(*queries[1:], all=True):
+        shared_counts[titles[index]].append((-shared, movie_id))
+    shortlist = {
+        normalized: [movie_id for _, movie_id in sorted(counts)[:candidates]]
+        for normalized, counts in shared_counts.items()
+    }
+
+    candidate_ids = set().union(*shortlist.values())
+    if not candidate_ids:
+        return {}
+    movies = Movie.objects.in_bulk(list(candidate_ids))
+    matches = {}
+    for normalized, movie_ids in shortlist.items():
+        best, best_score = None, 0.0
+        for movie_id in sorted(movie_ids):
+            movie = movies.get(movie_id)
+            score = similarity(normalized, movie.normalized_title or '') if movie else 0.0
+            if score >= threshold and score > best_score:
+                best, best_score = movie, score
+        if best is not None:
+            matches[normalized] = best
+    return matches
+
+
+def fuzzy_match(normalized, threshold=None, candidates=10):
+    """Best existing Movie trigram-similar to one title, or None (see fuzzy_matches)"""
+    return fuzzy_matches([normalized], threshold, candidates).get(normalized)
+
+
+def resolve_movies(recommendations, genre=''):
+    """
+    Resolve recommendations to Movie rows with as few queries as possible.
+
+    ``recommendations`` holds plain titles or dicts with ``title`` and
+    optional ``year`` / ``imdb_id`` (see recommendations.Recommendation).
+    IMDb ids are tried first with one exact ``imdb_id__in`` query. Titles
+    are canonicalized so "The Matrix (1999)" finds "The Matrix", and exact
+    canonical matches are fetched with one ``normalized_title__in`` query,
+    preferring a row from the recommended year. Leftovers share one
+    trigram lookup (``fuzzy_matches``), and only titles with no close match
+    are inserted, in a single ``bulk_create`` that keeps the year. Nothing
+    stops two concurrent searches from both inserting a title;
+    ``manage.py merge_duplicate_movies`` folds such rows together, and
+    lookups meanwhile resolve to the lowest id. The result keeps the input
+    order with duplicates dropped.
+    """
+    wanted = {}
+    for item in recommendations:
+        title, year, imdb_id = _as_recommendation(item)
+        normalized = canonical_title(title)
+        if normalized and normalized not in wanted:
+            wanted[normalized] = (title, year, imdb_id)
+    if not wanted:
+        return []
+
+    by_title = _by_imdb_id(wanted)
+    remaining = [normalized for normalized in wanted if normalized not in by_title]
+    if remaining:
+        years = {normalized: wanted[normalized][1] for normalized in remaining if wanted[normalized][1]}
+        by_title.update(_first_by_normalized_title(
+            Movie.objects.filter(normalized_title__in=remaining), years
+        ))
+
+    leftovers = [normalized for normalized in remaining if normalized not in by_title]
+    by_title.update(fuzzy_matches(leftovers))
+    missing = [normalized for normalized in leftovers if normalized not in by_title]
+
+    if missing:
+        created = Movie.objects.bulk_create([
+            Movie(title=wanted[normalized][0], normalized_title=normalized, year=wanted[normalized][1], genre=genre)
+            for normalized in missing
+        ])
+        if any(movie.pk is None for movie in created):
+            # Backends that can't return ids from a bulk insert
+            created = Movie.objects.filter(normalized_title__in=missing)
+        created = _first_by_normalized_title(created)
+        MovieTrigram.index(created.values())
+        by_title.update(created)
+
+    # Different recommendations can land on the same row (id and title matches)
+    movies, seen = [], set()
+    for normalized in wanted:
+        movie = by_title.get(normalized)
+        if movie is not None and movie.pk not in seen:
+            seen.add(movie.pk)
+            movies.append(movie)
+    return movies
+
+
+# Async views run the same batch resolver on a worker thread
+aresolve_movies = sync_to_async(resolve_movies)
@@ -0,0 +1,94 @@
+"""
+Database-backed counters for the ``ratelimit`` cache alias.
+
+Without Redis the rate limit buckets and token counters still have to be
+shared by every gunicorn worker, or each one enforces the limit on its own
+and a user gets workers x the limit. ``DatabaseCounterCache`` keeps them in
+the ``RateLimitCounter`` table and implements the cache calls
+``cinemai.quotas`` makes -- ``get``, ``add``, ``incr``/``decr`` and
+``touch`` -- atomically: ``add`` relies on the unique key and ``incr`` is a
+single ``UPDATE ... SET value = value + delta``. Values must be numbers.
+
+Expired rows count as missing and are deleted now and then.
+"""
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import RateLimitCounter
+
+# Seconds between sweeps of expired rows (per process)
+CULL_INTERVAL = 300
+
+
+def _number(value):
+    return int(value) if float(value).is_integer() else value
+
+
+class DatabaseCounterCache(BaseCache):
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._culled_at = time.monotonic()
+
+    def _key(self, key, version):
+        return self.make_and_validate_key(key, version=version)
+
+    def _expires_at(self, timeout):
+        expires = self.get_backend_timeout(timeout)
+        return None if expires is None else datetime.fromtimestamp(expires, dt_timezone.utc)
+
+    def _live(self, key):
+        return RateLimitCounter.objects.filter(
+            Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()),
+            key=key,
+        )
+
+    def get(self, key, default=None, version=None):
+        value = self._live(self._key(key, version)).values_list('value', flat=True).first()
+        return default if value is None else _number(value)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        self._cull()
+        with transaction.atomic():
+            RateLimitCounter.objects.filter(key=key, expires_at__lte=timezone.now()).delete()
+            try:
+                with transaction.atomic():
+                    RateLimitCounter.objects.create(key=key, value=value, expires_at=self._expires_at(timeout))
+            except IntegrityError:
+                return False
+        return True
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        RateLimitCounter.objects.update_or_create(
+            key=self._key(key, version),
+            defaults={'value': value, 'expires_at': self._expires_at(timeout)},
+        )
+
+    def incr(self, key, delta=1, version=None):
+        key = self._key(key, version)
+        with transaction.atomic():
+            # The UPDATE locks the row until commit, so the value read back is ours
+            if not self._live(key).update(value=F('value') + delta):
+                raise ValueError(f"Key '{key}' not found")
+            return _number(RateLimitCounter.objects.values_list('value', flat=True).get(key=key))
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        return bool(self._live(self._key(key, version)).update(expires_at=self._expires_at(timeout)))
+
+    def delete(self, key, version=None):
+        deleted, _ = RateLimitCounter.objects.filter(key=self._key(key, version)).delete()
+        return bool(deleted)
+
+    def clear(self):
+        RateLimitCounter.objects.all().delete()
+
+    def _cull(self):
+        if time.monotonic() - self._culled_at < CULL_INTERVAL:
+            return
+        self._culled_at = time.monotonic()
+        RateLimitCounter.objects.filter(expires_at__lte=timezone.now()).delete()
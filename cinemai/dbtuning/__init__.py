@@ -0,0 +1,45 @@
+"""
+Database connection tuning.
+
+SQLite (``ENGINE = 'cinemai.dbtuning'``, set by settings for sqlite URLs):
+
+* every new connection runs ``SQLITE_PRAGMAS`` through ``connection_created``:
+  WAL, so readers never block the writer and commits append to the log;
+  ``synchronous=NORMAL``, which with WAL only fsyncs at checkpoints; a
+  memory-mapped file and a bigger page cache; and ``busy_timeout``, so a
+  writer waits for the lock instead of failing with "database is locked";
+* transactions start with ``BEGIN IMMEDIATE`` (see ``base``): a transaction
+  that reads and then writes takes the write lock up front and queues on
+  the busy timeout, instead of failing when another writer got in between.
+
+Postgres gets server-side cursors for ``.iterator()`` from settings, and a
+``statement_timeout`` on each new connection of web processes and worker
+commands (``DB_STATEMENT_TIMEOUT_COMMANDS``) only, so migrations and other
+one-off commands aren't cut off (see ``postgres``, connected by the app
+config whatever the engine). Persistent connections (``CONN_MAX_AGE``)
+apply to both. ``manage.py benchmark_db_writes`` compares concurrent write
+throughput against a stock SQLite connection.
+"""
+import logging
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .base import DatabaseWrapper
+
+logger = logging.getLogger(__name__)
+
+
+@receiver(connection_created, sender=DatabaseWrapper)
+def tune_sqlite(sender, connection, **kwargs):
+    with connection.cursor() as cursor:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+            if name == 'journal_mode':
+                mode = cursor.fetchone()[0]
+                # In-memory (test) databases stay in memory mode
+                if mode != str(value).lower() and not connection.is_in_memory_db():
+                    logger.warning('SQLite database %s is in %s mode, not %s',
+                                   connection.settings_dict['NAME'], mode, value)
+
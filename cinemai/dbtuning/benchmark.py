@@ -0,0 +1,149 @@
+"""
+Concurrent-write load benchmark: stock SQLite backend vs the tuned one.
+
+For each backend, ``workers`` processes (forked, like gunicorn workers)
+start together and each run ``searches`` simulated searches against a
+fresh database file. A search is what a search request writes: one
+transaction that looks up the recommended titles, inserts the Movie rows
+it doesn't have yet and adds a SearchHistory row. Failures ("database is
+locked") are counted, not retried.
+"""
+import copy
+import math
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+from dataclasses import dataclass, field
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import OperationalError, connections, transaction
+
+from ..models import Movie, SearchHistory
+from ..titles import canonical_title
+
+BACKENDS = {
+    'stock': 'django.db.backends.sqlite3',
+    'tuned': 'cinemai.dbtuning',
+}
+# Titles recommended across all searches; a small pool means searches
+# often insert or look up the same movies
+TITLE_POOL = 2000
+TITLES_PER_SEARCH = 5
+
+
+@dataclass
+class Result:
+    backend: str
+    workers: int
+    searches: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    latencies: list = field(default_factory=list)
+
+    @property
+    def throughput(self):
+        return self.searches / self.seconds if self.seconds else 0.0
+
+    def percentile(self, percent):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+def _alias(backend):
+    return f'benchmark_{backend}'
+
+
+def _add_database(backend, directory):
+    """A database alias for ``backend`` on its own file"""
+    settings_dict = copy.deepcopy(connections.settings['default'])
+    settings_dict.update(
+        ENGINE=BACKENDS[backend],
+        NAME=os.path.join(directory, f'{backend}.sqlite3'),
+        OPTIONS={},
+        CONN_MAX_AGE=None,
+    )
+    connections.settings[_alias(backend)] = settings_dict
+    return _alias(backend)
+
+
+def _search(alias, user_id, rng):
+    titles = [f'Benchmark Movie {rng.randrange(TITLE_POOL)}' for _ in range(TITLES_PER_SEARCH)]
+    wanted = {canonical_title(title): title for title in titles}
+    with transaction.atomic(using=alias):
+        existing = set(
+            Movie.objects.using(alias).filter(normalized_title__in=list(wanted))
+            .values_list('normalized_title', flat=True)
+        )
+        Movie.objects.using(alias).bulk_create([
+            Movie(title=title, normalized_title=normalized)
+            for normalized, title in wanted.items() if normalized not in existing
+        ])
+        # bulk_create, like the buffered history writer (no signals)
+        SearchHistory.objects.using(alias).bulk_create([SearchHistory(user_id=user_id, query=', '.join(titles))])
+
+
+def _worker(alias, user_id, searches, seed, start_at, queue):
+    rng = random.Random(seed)
+    done = errors = 0
+    latencies = []
+    time.sleep(max(0.0, start_at - time.time()))
+    for _ in range(searches):
+        started = time.perf_counter()
+        try:
+            _search(alias, user_id, rng)
+        except OperationalError:
+            errors += 1
+            continue
+        done += 1
+        latencies.append(time.perf_counter() - started)
+    finished_at = time.time()
+    connections[alias].close()
+    queue.put((done, errors, latencies, finished_at))
+
+
+def run_backend(backend, directory, workers, searches):
+    alias = _add_database(backend, directory)
+    call_command('migrate', database=alias, verbosity=0)
+    # No signals: they'd create the profile in the default database
+    User.objects.db_manager(alias).bulk_create([User(username='benchmark')])
+    user_id = User.objects.db_manager(alias).get(username='benchmark').pk
+    # Children must open their own connections
+    connections.close_all()
+
+    context = multiprocessing.get_context('fork')
+    queue = context.Queue()
+    start_at = time.time() + 0.5
+    processes = [
+        context.Process(target=_worker, args=(alias, user_id, searches, seed, start_at, queue))
+        for seed in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    result = Result(backend, workers)
+    finished = []
+    for _ in processes:
+        done, errors, latencies, finished_at = queue.get()
+        result.searches += done
+        result.errors += errors
+        result.latencies += latencies
+        finished.append(finished_at)
+    for process in processes:
+        process.join()
+    result.seconds = max(finished) - start_at
+    return result
+
+
+def run(workers=8, searches=200, backends=tuple(BACKENDS)):
+    """Benchmark each backend in turn on throwaway databases; returns their Results"""
+    with tempfile.TemporaryDirectory(prefix='cinemai-db-benchmark-') as directory:
+        try:
+            return [run_backend(backend, directory, workers, searches) for backend in backends]
+        finally:
+            for backend in backends:
+                if _alias(backend) in connections.settings:
+                    connections[_alias(backend)].close()
@@ -0,0 +1,33 @@
+"""
+Postgres connection setup. Imported by ``CinemaiConfig.ready()``: unlike
+the SQLite tuning, nothing else imports it when the engine is Postgres.
+"""
+import os
+import sys
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+
+def management_command():
+    """The manage.py / django-admin command this process runs, or None (e.g. under gunicorn)"""
+    if len(sys.argv) < 2:
+        return None
+    program = os.path.basename(sys.argv[0])
+    if program in ('manage.py', 'django-admin', 'django-admin.py') or (
+        program == '__main__.py' and os.path.basename(os.path.dirname(sys.argv[0])) == 'django'
+    ):
+        return sys.argv[1]
+    return None
+
+
+@receiver(connection_created)
+def set_statement_timeout(sender, connection, **kwargs):
+    if connection.vendor != 'postgresql' or not settings.DB_STATEMENT_TIMEOUT:
+        return
+    command = management_command()
+    if command is not None and command not in settings.DB_STATEMENT_TIMEOUT_COMMANDS:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('SET statement_timeout = %s', [settings.DB_STATEMENT_TIMEOUT])
@@ -0,0 +1,305 @@
+"""
+Local, LLM-free recommendation engine.
+
+Every movie becomes a signed, hashed bag-of-words vector over its title,
+plot, genre and director, weighted by inverse document frequency and
+L2-normalized. The catalog is one float32 matrix, so a query -- free text
+or "movies like X" -- is a single matrix-vector product (cosine
+similarity) plus a partial sort.
+
+``manage.py build_recommendation_index`` writes the matrix to a new
+version directory under ``RECOMMENDER_INDEX_DIR`` as ``.npy`` files and
+then swaps ``manifest.json`` to point at it. Every worker memory-maps the
+current version read-only, so they share one copy in the page cache, and
+picks up a rebuilt index within ``EngineHolder.check_interval`` seconds.
+"""
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import zlib
+
+import numpy as np
+from django.conf import settings
+
+from .models import Movie
+from .titles import canonical_title
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# A handful of very common words that only add noise to hashed features
+STOP_WORDS = frozenset(
+    'a an and are as at be by for from has he her his in is it its of on or she that the their '
+    'they this to was were will with who movie movies film films'.split()
+)
+
+# Relative weight of each field's tokens
+FIELD_WEIGHTS = {'title': 1.5, 'plot': 1.0, 'genre': 2.0, 'director': 2.0}
+
+MANIFEST = 'manifest.json'
+
+# "movies like Heat", "similar to The Thing", ...
+_LIKE_RE = re.compile(r'^\s*(?:(?:movies?|films?)\s+)?(?:like|similar\s+to)\s+(?P<title>.+?)\s*$', re.IGNORECASE)
+
+
+def _tokens(text):
+    return [token for token in _TOKEN_RE.findall((text or '').casefold()) if token not in STOP_WORDS]
+
+
+def features(title='', plot='', genre='', director=''):
+    """Weighted feature strings for one movie (or query)"""
+    weighted = []
+    for token in _tokens(title):
+        weighted.append((token, FIELD_WEIGHTS['title']))
+    for token in _tokens(plot):
+        weighted.append((token, FIELD_WEIGHTS['plot']))
+    for part in re.split(r'[,/|]', genre or ''):
+        part = part.strip().casefold()
+        if part:
+            weighted.append((f'g:{part}', FIELD_WEIGHTS['genre']))
+            weighted.extend((token, FIELD_WEIGHTS['genre'] / 2) for token in _tokens(part))
+    for name in re.split(r',', director or ''):
+        name = name.strip().casefold()
+        if name:
+            weighted.append((f'd:{name}', FIELD_WEIGHTS['director']))
+    return weighted
+
+
+def hash_features(weighted, dimensions):
+    """Signed feature hashing of (feature, weight) pairs into a dense vector"""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for feature, weight in weighted:
+        digest = zlib.crc32(feature.encode('utf-8'))
+        sign = 1.0 if digest & 0x80000000 else -1.0
+        vector[digest % dimensions] += sign * weight
+    return vector
+
+
+def _remove_old_versions(directory, keep, retain=1):
+    """Delete all but the newest ``retain`` superseded index versions"""
+    versions = sorted(
+        (name for name in os.listdir(directory)
+         if name not in keep and os.path.isdir(os.path.join(directory, name))),
+        reverse=True,
+    )
+    for name in versions[retain:]:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+
+def _normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class RecommendationEngine:
+    """Cosine-similarity search over a hashed TF-IDF movie matrix"""
+
+    def __init__(self, ids, matrix, idf):
+        self.ids = ids
+        self.matrix = matrix
+        self.idf = idf
+        self.dimensions = matrix.shape[1]
+        self.positions = {int(movie_id): position for position, movie_id in enumerate(ids)}
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, movies=None, dimensions=None):
+        """Build from (id, title, genre, director, plot) rows"""
+        dimensions = dimensions or settings.RECOMMENDER_DIMENSIONS
+        if movies is None:
+            movies = Movie.objects.values_list('id', 'title', 'genre', 'director', 'plot').iterator(chunk_size=2000)
+
+        ids, rows = [], []
+        for movie_id, title, genre, director, plot in movies:
+            ids.append(movie_id)
+            rows.append(hash_features(features(title, plot, genre, director), dimensions))
+
+        matrix = np.vstack(rows) if rows else np.zeros((0, dimensions), dtype=np.float32)
+        # Smoothed idf over hashed buckets, computed from the raw term weights
+        document_frequency = np.count_nonzero(matrix, axis=0)
+        idf = (np.log((1 + len(ids)) / (1 + document_frequency)) + 1).astype(np.float32)
+        matrix = _normalize_rows(matrix * idf).astype(np.float32)
+        return cls(np.asarray(ids, dtype=np.int64), matrix, idf)
+
+    def save(self, directory):
+        """Write a new index version and point the manifest at it"""
+        version = str(time.time_ns())
+        path = os.path.join(directory, version)
+        os.makedirs(path)
+        np.save(os.path.join(path, 'ids.npy'), self.ids)
+        np.save(os.path.join(path, 'matrix.npy'), self.matrix)
+        np.save(os.path.join(path, 'idf.npy'), self.idf)
+
+        # Swap the manifest in atomically; files of older versions are never
+        # rewritten, so workers still mapping them are unaffected
+        manifest = {'version': version, 'movies': len(self.ids), 'dimensions': self.dimensions}
+        tmp = os.path.join(directory, f'{MANIFEST}.{os.getpid()}')
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, os.path.join(directory, MANIFEST))
+        _remove_old_versions(directory, keep={version})
+        return path
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        with open(os.path.join(directory, MANIFEST)) as f:
+            path = os.path.join(directory, json.load(f)['version'])
+        mode = 'r' if mmap else None
+        return cls(
+            np.load(os.path.join(path, 'ids.npy'), mmap_mode=mode),
+            np.load(os.path.join(path, 'matrix.npy'), mmap_mode=mode),
+            np.load(os.path.join(path, 'idf.npy')),
+        )
+
+    def vectorize(self, text='', genre=''):
+        vector = hash_features(features(title=text, genre=genre), self.dimensions) * self.idf
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _top(self, scores, limit, exclude=None):
+        if exclude is not None:
+            scores[exclude] = -np.inf
+        limit = min(limit, len(scores))
+        if limit <= 0:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        min_score = settings.RECOMMENDER_MIN_SCORE
+        return [(int(self.ids[i]), float(scores[i])) for i in top if scores[i] > min_score]
+
+    def query(self, text, genre='', limit=10):
+        """(movie_id, score) pairs most similar to free text"""
+        if not len(self):
+            return []
+        return self._top(self.matrix @ self.vectorize(text, genre), limit)
+
+    def query_many(self, texts, limit=10):
+        """Batched free-text queries: one matrix product for all of them"""
+        if not len(self) or not texts:
+            return [[] for _ in texts]
+        queries = np.vstack([self.vectorize(text) for text in texts])
+        scores = queries @ self.matrix.T
+        return [self._top(row, limit) for row in scores]
+
+    def similar_to(self, movie_id, limit=10):
+        """(movie_id, score) pairs most similar to an indexed movie"""
+        position = self.positions.get(movie_id)
+        if position is None:
+            return []
+        return self._top(self.matrix @ self.matrix[position], limit, exclude=position)
+
+    def scores_for(self, movie_ids, text, genre=''):
+        """Similarity of specific movies to ``text`` (None if not indexed)"""
+        vector = self.vectorize(text, genre)
+        positions = [self.positions.get(movie_id) for movie_id in movie_ids]
+        known = [position for position in positions if position is not None]
+        scores = iter((self.matrix[known] @ vector).tolist()) if known else iter(())
+        return [next(scores) if position is not None else None for position in positions]
+
+    def rerank(self, movies, text, genre=''):
+        """Stable re-ordering of ``movies`` by similarity; unindexed ones keep their place at the end"""
+        scores = self.scores_for([movie.pk for movie in movies], text, genre)
+        order = sorted(
+            range(len(movies)),
+            key=lambda i: (scores[i] is None, -(scores[i] or 0.0), i),
+        )
+        return [movies[i] for i in order]
+
+
+def load_movies(pairs):
+    """Movie objects for (movie_id, score) pairs, in the same order"""
+    movies = Movie.objects.in_bulk([movie_id for movie_id, _ in pairs])
+    return [movies[movie_id] for movie_id, _ in pairs if movie_id in movies]
+
+
+class EngineHolder:
+    """Loads the on-disk index once per process and reloads it when rebuilt"""
+
+    check_interval = 30
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self._engine = None
+        self._manifest_mtime = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return self.directory or settings.RECOMMENDER_INDEX_DIR
+
+    def get(self):
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval:
+            return self._engine
+        with self._lock:
+            self._checked_at = now
+            try:
+                mtime = os.path.getmtime(os.path.join(self.path, MANIFEST))
+            except OSError:
+                return self._engine
+            if mtime != self._manifest_mtime:
+                self._engine = RecommendationEngine.load(self.path)
+                self._manifest_mtime = mtime
+        return self._engine
+
+
+engine_holder = EngineHolder()
+
+
+def get_engine():
+    """The shared engine, or None until an index has been built"""
+    return engine_holder.get()
+
+
+def build_index(directory=None):
+    engine = RecommendationEngine.build()
+    engine.save(directory or settings.RECOMMENDER_INDEX_DIR)
+    return engine
+
+
+def _reference_movie(query):
+    """The catalog movie a "movies like X" query refers to, if any"""
+    match = _LIKE_RE.match(query)
+    if not match:
+        return None
+    return (
+        Movie.objects
+        .filter(normalized_title=canonical_title(match.group('title')))
+        .order_by('id')
+        .values_list('id', flat=True)
+        .first()
+    )
+
+
+def recommend(query, genre='', limit=None):
+    """
+    Movies for a search query from the local index, best first.
+
+    "movies like X" queries for a movie in the catalog return its nearest
+    neighbours; anything else is matched as free text. Returns [] when no
+    index has been built or nothing is similar enough.
+    """
+    engine = get_engine()
+    if engine is None or not query.strip():
+        return []
+    limit = limit or settings.RECOMMENDER_RESULTS
+    movie_id = _reference_movie(query)
+    if movie_id is not None and movie_id in engine.positions:
+        pairs = engine.similar_to(movie_id, limit)
+    else:
+        pairs = engine.query(query, genre, limit)
+    return load_movies(pairs)
+
+
+def rerank(movies, query, genre=''):
+    """Re-order (e.g. LLM-suggested) movies by local similarity to the query"""
+    engine = get_engine()
+    if engine is None or not movies:
+        return movies
+    return engine.rerank(movies, query, genre)
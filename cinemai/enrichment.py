@@ -0,0 +1,216 @@
+"""
+Background movie metadata enrichment.
+
+LLM-created movies only have a title and genre. ``enrich_pending`` picks up
+batches of un-enriched movies, looks them up concurrently through a
+metadata provider and writes everything back with one ``bulk_update`` per
+batch. It runs from ``manage.py enrich_movies`` (cron, Heroku Scheduler or a
+``--loop`` worker dyno), never from a view.
+
+Providers are pluggable via ``MOVIE_METADATA_PROVIDER``; ``FixtureProvider``
+serves a local JSON file so tests and offline development need no network.
+"""
+import json
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal, InvalidOperation
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from .models import Movie
+from .titles import canonical_title
+
+ENRICHED_FIELDS = ['year', 'director', 'plot', 'poster_url', 'imdb_id', 'rating', 'runtime', 'enriched_at', 'version']
+
+_DIGITS_RE = re.compile(r'\d+')
+
+
+class RateLimiter:
+    """Thread-safe token bucket allowing ``rate`` calls per second"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class OMDbProvider:
+    """OMDb API client over a pooled, retrying requests.Session"""
+
+    def __init__(self, api_key=None, base_url=None, rate=None, timeout=None, pool_size=None):
+        self.api_key = api_key if api_key is not None else settings.OMDB_API_KEY
+        self.base_url = base_url or settings.OMDB_API_URL
+        self.timeout = timeout or settings.OMDB_TIMEOUT
+        self.limiter = RateLimiter(rate if rate is not None else settings.OMDB_RATE_LIMIT)
+
+        pool_size = pool_size or settings.ENRICHMENT_WORKERS
+        retry = Retry(
+            total=3,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+            respect_retry_after_header=True,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def lookup(self, movie):
+        """OMDb-shaped dict for ``movie``, or None when it is unknown"""
+        params = {'apikey': self.api_key, 'type': 'movie'}
+        if movie.imdb_id:
+            params['i'] = movie.imdb_id
+        else:
+            params['t'] = movie.title
+            if movie.year:
+                params['y'] = movie.year
+        self.limiter.acquire()
+        response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        return data if data.get('Response') == 'True' else None
+
+
+class FixtureProvider:
+    """Serves OMDb-shaped records from a JSON file keyed by title"""
+
+    def __init__(self, path=None):
+        path = path or settings.MOVIE_METADATA_FIXTURE
+        with open(path, encoding='utf-8') as fixture:
+            records = json.load(fixture)
+        if isinstance(records, dict):
+            records = list(records.values())
+        self.by_imdb_id = {record['imdbID']: record for record in records if record.get('imdbID')}
+        self.by_title = {canonical_title(record['Title']): record for record in records if record.get('Title')}
+
+    def lookup(self, movie):
+        if movie.imdb_id and movie.imdb_id in self.by_imdb_id:
+            return self.by_imdb_id[movie.imdb_id]
+        return self.by_title.get(movie.normalized_title or canonical_title(movie.title))
+
+
+def get_provider():
+    return import_string(settings.MOVIE_METADATA_PROVIDER)()
+
+
+def _value(data, key):
+    value = (data.get(key) or '').strip()
+    return '' if value == 'N/A' else value
+
+
+def _first_int(text):
+    match = _DIGITS_RE.search(text or '')
+    return int(match.group()) if match else None
+
+
+def apply_metadata(movie, data):
+    """Copy OMDb fields onto ``movie`` without overwriting existing values"""
+    if movie.year is None:
+        movie.year = _first_int(_value(data, 'Year'))
+    if movie.runtime is None:
+        movie.runtime = _first_int(_value(data, 'Runtime'))
+    if movie.rating is None and _value(data, 'imdbRating'):
+        try:
+            movie.rating = Decimal(_value(data, 'imdbRating'))
+        except InvalidOperation:
+            pass
+    movie.director = movie.director or _value(data, 'Director')[:255]
+    movie.plot = movie.plot or _value(data, 'Plot')
+    movie.poster_url = movie.poster_url or _value(data, 'Poster')[:500]
+    movie.imdb_id = movie.imdb_id or _value(data, 'imdbID')[:20] or None
+
+
+def enrich_movies(movies, provider=None, workers=None):
+    """
+    Look up ``movies`` concurrently and bulk_update the results.
+
+    Lookups that fail (network errors after retries) leave the movie
+    un-enriched so a later run retries it; unknown titles are marked enriched
+    so they are not asked about again. Returns the number of movies updated.
+    """
+    provider = provider or get_provider()
+    workers = workers or settings.ENRICHMENT_WORKERS
+
+    def lookup(movie):
+        try:
+            return movie, provider.lookup(movie), None
+        except Exception as e:
+            return movie, None, e
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(lookup, movies))
+
+    now = timezone.now()
+    updated = []
+    for movie, data, error in results:
+        if error is not None:
+            continue
+        if data:
+            apply_metadata(movie, data)
+        movie.enriched_at = now
+        # bulk_update skips save(); invalidate cached cards by hand
+        movie.version += 1
+        updated.append(movie)
+
+    # imdb_id is unique: don't claim an id another (duplicate) row already has
+    claimed = {movie.imdb_id for movie in updated if movie.imdb_id}
+    taken = set(
+        Movie.objects.filter(imdb_id__in=claimed)
+        .exclude(pk__in=[movie.pk for movie in updated])
+        .values_list('imdb_id', flat=True)
+    )
+    seen = set()
+    for movie in updated:
+        if movie.imdb_id in taken or movie.imdb_id in seen:
+            movie.imdb_id = None
+        elif movie.imdb_id:
+            seen.add(movie.imdb_id)
+
+    Movie.objects.bulk_update(updated, ENRICHED_FIELDS)
+    return len(updated)
+
+
+def pending_movies(batch_size=None):
+    batch_size = batch_size or settings.ENRICHMENT_BATCH_SIZE
+    return list(Movie.objects.filter(enriched_at__isnull=True).order_by('id')[:batch_size])
+
+
+def enrich_pending(batch_size=None, provider=None, max_batches=None):
+    """Enrich un-enriched movies batch by batch; returns the total updated"""
+    provider = provider or get_provider()
+    total = batches = 0
+    while max_batches is None or batches < max_batches:
+        movies = pending_movies(batch_size)
+        if not movies:
+            break
+        updated = enrich_movies(movies, provider)
+        total += updated
+        batches += 1
+        if not updated:
+            # Every lookup failed; stop instead of spinning on the same batch
+            break
+    return total
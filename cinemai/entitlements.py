@@ -0,0 +1,123 @@
+"""
+What a user's subscription entitles them to, without extra queries.
+
+``ProfileBackend`` loads the session user together with their profile in
+one joined query, so ``request.user.profile`` is free for the rest of the
+request. ``get_entitlement(user)`` turns that profile into a small
+immutable ``Entitlement`` snapshot (tier, active, end date), memoized on
+the user object and kept in the ``profile`` cache namespace for callers
+that only have a user id. Saving or deleting a profile invalidates the
+cached snapshot.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+from . import caching, tiers
+from .models import UserProfile
+
+
+@dataclass(frozen=True)
+class Entitlement:
+    tier: str = tiers.DEFAULT.code
+    active: bool = False
+    end_date: Optional[datetime] = None
+
+    @property
+    def plan(self):
+        """The tier's Plan: prices, limits and feature flags as attributes"""
+        return tiers.get_plan(self.tier)
+
+    @property
+    def is_active(self):
+        """Paid up: active and not past its end date"""
+        return self.active and (self.end_date is None or self.end_date > timezone.now())
+
+    @property
+    def effective_plan(self):
+        """The Plan to enforce: the tier's while paid up, else the default plan"""
+        return self.plan if self.is_active else tiers.DEFAULT
+
+    @classmethod
+    def from_profile(cls, profile):
+        if profile is None:
+            return cls()
+        return cls(profile.subscription_tier, profile.subscription_active, profile.subscription_end_date)
+
+
+DEFAULT = Entitlement()
+
+
+_FIELDS = ('subscription_tier', 'subscription_active', 'subscription_end_date')
+
+
+def entitlement_for(user_id):
+    """Entitlement by user id: the cache, else one query"""
+    entitlement = caching.PROFILE.get(user_id)
+    if entitlement is None:
+        row = UserProfile.objects.filter(user_id=user_id).values_list(*_FIELDS).first()
+        entitlement = Entitlement(*row) if row else DEFAULT
+        caching.PROFILE.set(user_id, entitlement)
+    return entitlement
+
+
+def warm_cache(limit):
+    """Cache the entitlements of the ``limit`` most recently active users"""
+    rows = (
+        UserProfile.objects.order_by(F('user__last_login').desc(nulls_last=True))
+        .values_list('user_id', *_FIELDS)[:limit]
+    )
+    entitlements = {user_id: Entitlement(*fields) for user_id, *fields in rows}
+    caching.PROFILE.set_many(entitlements)
+    return len(entitlements)
+
+
+def get_entitlement(user):
+    """A user's entitlement, memoized on the user object for the request"""
+    if not user.is_authenticated:
+        return DEFAULT
+    entitlement = getattr(user, '_entitlement', None)
+    if entitlement is None:
+        if get_user_model().profile.is_cached(user):
+            # Loaded by ProfileBackend (None if the user has no profile)
+            entitlement = Entitlement.from_profile(getattr(user, 'profile', None))
+        else:
+            entitlement = entitlement_for(user.pk)
+        user._entitlement = entitlement
+    return entitlement
+
+
+class ProfileBackend(ModelBackend):
+    """ModelBackend that loads the session user and their profile in one query"""
+
+    def get_user(self, user_id):
+        UserModel = get_user_model()
+        try:
+            user = UserModel._default_manager.select_related('profile').get(pk=user_id)
+        except UserModel.DoesNotExist:
+            return None
+        return user if self.user_can_authenticate(user) else None
+
+
+def context_processor(request):
+    """``entitlement`` for templates, resolved only when used"""
+    return {'entitlement': SimpleLazyObject(lambda: get_entitlement(request.user))}
+
+
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+def invalidate(sender, instance, **kwargs):
+    # After commit, so a concurrent read can't re-cache the old row
+    transaction.on_commit(lambda: caching.PROFILE.delete(instance.user_id))
+    user = UserProfile.user.field.get_cached_value(instance, None)
+    if user is not None:
+        user.__dict__.pop('_entitlement', None)
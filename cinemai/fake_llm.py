@@ -0,0 +1,201 @@
+"""
+A fake OpenAI-compatible chat completions server for tests and local dev.
+
+Point ``OPENAI_BASE_URL`` at it (with any non-empty ``OPENAI_API_KEY``)::
+
+    with FakeLLMServer(titles=['Heat', 'Collateral']) as server:
+        gateway = LLMGateway(api_key='test', base_url=server.url)
+        ...
+
+``failures`` is a list of HTTP status codes returned, in order, before the
+server starts answering normally, and ``delay`` slows every response down,
+which together exercise retries, timeouts and the circuit breaker. Run
+``python -m cinemai.fake_llm --port 8089`` to use it by hand.
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_TITLES = [
+    ('Heat', 1995), ('Collateral', 2004), ('The Insider', 1999), ('Thief', 1981), ('Manhunter', 1986),
+    ('Ronin', 1998), ('The Town', 2010), ('Sicario', 2015), ('Drive', 2011), ('Inside Man', 2006),
+]
+
+_NUMBERED_RE = re.compile(r'^\d+\. ', re.MULTILINE)
+
+
+class FakeLLMServer:
+    """Threaded HTTP server answering /v1/chat/completions"""
+
+    def __init__(self, titles=None, delay=0.0, failures=(), retry_after=None, responder=None,
+                 host='127.0.0.1', port=0):
+        self.titles = list(titles or DEFAULT_TITLES)
+        self.delay = delay
+        self.failures = list(failures)
+        self.retry_after = retry_after
+        # Optional callable(request_json) -> completion text
+        self.responder = responder
+        self.requests = []
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _movies(self):
+        movies = []
+        for entry in self.titles:
+            title, year = entry if isinstance(entry, tuple) else (entry, None)
+            movies.append({'title': title, 'year': year})
+        return movies
+
+    def content_for(self, body):
+        """Mimic the shapes the app asks for: JSON lines when streaming, a JSON object in JSON mode"""
+        if self.responder is not None:
+            return self.responder(body)
+        if body.get('stream'):
+            return '\n'.join(json.dumps(movie) for movie in self._movies())
+        if (body.get('response_format') or {}).get('type') == 'json_object':
+            prompt = body['messages'][-1]['content'] if body.get('messages') else ''
+            requests = len(_NUMBERED_RE.findall(prompt))
+            if requests:
+                return json.dumps({str(number): self._movies() for number in range(1, requests + 1)})
+            return json.dumps({'movies': self._movies()})
+        return '\n'.join(f'{number}. {movie["title"]}' for number, movie in enumerate(self._movies(), 1))
+
+    def _next_failure(self, body):
+        with self._lock:
+            self.requests.append(body)
+            return self.failures.pop(0) if self.failures else None
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send_json(self, status, payload, headers=()):
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in headers:
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'{}')
+                if not self.path.rstrip('/').endswith('/chat/completions'):
+                    self._send_json(404, {'error': {'message': 'not found'}})
+                    return
+
+                failure = server._next_failure(body)
+                if server.delay:
+                    time.sleep(server.delay)
+                if failure is not None:
+                    headers = [('Retry-After', str(server.retry_after))] if server.retry_after is not None else []
+                    self._send_json(failure, {'error': {'message': f'fake failure {failure}', 'type': 'fake'}}, headers)
+                    return
+
+                content = server.content_for(body)
+                if body.get('stream'):
+                    self._stream(body, content)
+                else:
+                    self._send_json(200, completion(body, content))
+
+            def _stream(self, body, content):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                for piece in content.splitlines(keepends=True):
+                    self.wfile.write(f'data: {json.dumps(chunk(body, piece))}\n\n'.encode('utf-8'))
+                    self.wfile.flush()
+                if (body.get('stream_options') or {}).get('include_usage'):
+                    final = dict(chunk(body, ''), choices=[], usage=_usage(body, content))
+                    self.wfile.write(f'data: {json.dumps(final)}\n\n'.encode('utf-8'))
+                self.wfile.write(b'data: [DONE]\n\n')
+                self.close_connection = True
+
+        return Handler
+
+
+def _usage(body, content):
+    prompt_tokens = sum(len(str(message.get('content', '')).split()) for message in body.get('messages', []))
+    completion_tokens = len(content.split())
+    return {
+        'prompt_tokens': prompt_tokens,
+        'completion_tokens': completion_tokens,
+        'total_tokens': prompt_tokens + completion_tokens,
+    }
+
+
+def completion(body, content):
+    return {
+        'id': 'chatcmpl-fake',
+        'object': 'chat.completion',
+        'created': int(time.time()),
+        'model': body.get('model', 'fake'),
+        'choices': [{
+            'index': 0,
+            'message': {'role': 'assistant', 'content': content},
+            'finish_reason': 'stop',
+        }],
+        'usage': _usage(body, content),
+    }
+
+
+def chunk(body, piece):
+    return {
+        'id': 'chatcmpl-fake',
+        'object': 'chat.completion.chunk',
+        'created': int(time.time()),
+        'model': body.get('model', 'fake'),
+        'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--delay', type=float, default=0.0, help='Seconds to wait before each response')
+    args = parser.parse_args()
+
+    server = FakeLLMServer(delay=args.delay, host=args.host, port=args.port)
+    print(f'Fake LLM listening on {server.url}')
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""
+A fake Stripe API for tests and local dev.
+
+Serves just what ``cinemai.billing`` uses -- listing and creating Prices
+(with their Product) and creating / retrieving Checkout Sessions -- and
+honours ``Idempotency-Key`` the way Stripe does, replaying the first
+response for a repeated key. Point ``STRIPE_API_BASE`` at it::
+
+    with FakeStripeServer() as server:
+        with override_settings(STRIPE_API_BASE=server.url, STRIPE_SECRET_KEY='sk_test_fake'):
+            ...
+
+``delay`` slows every response down. Run ``python -m cinemai.fake_stripe``
+to use it by hand.
+"""
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+_KEY_RE = re.compile(r'[\[\]]+')
+
+
+def _id(prefix):
+    return f'{prefix}_{uuid.uuid4().hex[:24]}'
+
+
+def parse_form(body):
+    """Stripe's form encoding (``a[b][0][c]=d``) back into nested dicts and lists"""
+    data = {}
+    for key, value in parse_qsl(body, keep_blank_values=True):
+        parts = [part for part in _KEY_RE.split(key) if part]
+        target = data
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return _listify(data)
+
+
+def _listify(value):
+    if not isinstance(value, dict):
+        return value
+    if value and all(key.isdigit() for key in value):
+        return [_listify(value[key]) for key in sorted(value, key=int)]
+    return {key: _listify(item) for key, item in value.items()}
+
+
+class FakeStripeServer:
+    """Threaded HTTP server answering a subset of the Stripe API under /v1"""
+
+    def __init__(self, delay=0.0, host='127.0.0.1', port=0):
+        self.delay = delay
+        self.prices = {}
+        self.products = {}
+        self.sessions = {}
+        self.requests = []
+        self._idempotent = {}
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def list_prices(self, query):
+        keys = query.get('lookup_keys') or []
+        prices = [price for price in self.prices.values() if not keys or price['lookup_key'] in keys]
+        if 'active' in query:
+            prices = [price for price in prices if price['active'] == (query['active'].lower() == 'true')]
+        return 200, {'object': 'list', 'url': '/v1/prices', 'has_more': False, 'data': prices}
+
+    def create_price(self, params):
+        if params.get('lookup_key'):
+            for price in self.prices.values():
+                if price['lookup_key'] == params['lookup_key']:
+                    return 400, {'error': {'type': 'invalid_request_error',
+                                           'message': 'A price with this lookup_key already exists.'}}
+        product = {'id': _id('prod'), 'object': 'product', 'active': True,
+                   'name': (params.get('product_data') or {}).get('name', '')}
+        self.products[product['id']] = product
+        price = {
+            'id': _id('price'),
+            'object': 'price',
+            'active': True,
+            'currency': params.get('currency', 'usd'),
+            'unit_amount': int(params.get('unit_amount', 0)),
+            'recurring': {'interval': (params.get('recurring') or {}).get('interval', 'month')},
+            'lookup_key': params.get('lookup_key'),
+            'metadata': params.get('metadata') or {},
+            'product': params.get('product') or product['id'],
+            'type': 'recurring',
+        }
+        self.prices[price['id']] = price
+        return 200, price
+
+    def create_session(self, params):
+        for item in params.get('line_items') or []:
+            if item.get('price') not in self.prices:
+                return 400, {'error': {'type': 'invalid_request_error',
+                                       'message': f"No such price: '{item.get('price')}'"}}
+        session_id = _id('cs_test')
+        session = {
+            'id': session_id,
+            'object': 'checkout.session',
+            'mode': params.get('mode'),
+            'status': 'open',
+            'url': f'{self.url}/pay/{session_id}',
+            'client_reference_id': params.get('client_reference_id'),
+            'metadata': params.get('metadata') or {},
+            'expires_at': int(params.get('expires_at') or time.time() + 86400),
+            'success_url': params.get('success_url'),
+            'cancel_url': params.get('cancel_url'),
+        }
+        self.sessions[session_id] = session
+        return 200, session
+
+    def route(self, method, path, params):
+        if method == 'GET' and path == '/v1/prices':
+            return self.list_prices(params)
+        if method == 'POST' and path == '/v1/prices':
+            return self.create_price(params)
+        if method == 'POST' and path == '/v1/checkout/sessions':
+            return self.create_session(params)
+        match = re.fullmatch(r'/v1/checkout/sessions/([\w-]+)', path)
+        if method == 'GET' and match and match.group(1) in self.sessions:
+            return 200, self.sessions[match.group(1)]
+        return 404, {'error': {'type': 'invalid_request_error', 'message': f'Unrecognized request URL ({path})'}}
+
+    def handle(self, method, path, params, idempotency_key):
+        with self._lock:
+            self.requests.append((method, path, params))
+            if idempotency_key:
+                replay = self._idempotent.get(idempotency_key)
+                if replay is not None:
+                    return replay[0], replay[1], True
+            status, payload = self.route(method, path, params)
+            if idempotency_key and method == 'POST':
+                self._idempotent[idempotency_key] = (status, payload)
+            return status, payload, False
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _respond(self, method):
+                url = urlsplit(self.path)
+                if method == 'POST':
+                    length = int(self.headers.get('Content-Length') or 0)
+                    params = parse_form(self.rfile.read(length).decode('utf-8'))
+                else:
+                    params = parse_form(url.query)
+                if server.delay:
+                    time.sleep(server.delay)
+                status, payload, replayed = server.handle(
+                    method, url.path, params, self.headers.get('Idempotency-Key'),
+                )
+                data = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.send_header('Request-Id', _id('req'))
+                if replayed:
+                    self.send_header('Idempotent-Replayed', 'true')
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._respond('GET')
+
+            def do_POST(self):
+                self._respond('POST')
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=12111)
+    parser.add_argument('--delay', type=float, default=0.0, help='Seconds to wait before each response')
+    args = parser.parse_args()
+
+    server = FakeStripeServer(delay=args.delay, host=args.host, port=args.port)
+    print(f'Fake Stripe API listening on {server.url}')
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Search history recording.
+
+Search events are analytics, so by default they are not written on the
+request path: ``record_search`` appends to an in-process buffer that a
+background thread flushes with ``bulk_create`` once it holds
+``SEARCH_HISTORY_BATCH_SIZE`` events or every
+``SEARCH_HISTORY_FLUSH_INTERVAL`` seconds, and once more at interpreter
+exit (gunicorn's graceful worker shutdown). Events still buffered when a
+worker is killed outright are lost; set ``SEARCH_HISTORY_MODE = 'sync'`` to
+write each search immediately instead.
+"""
+import atexit
+import logging
+import os
+import threading
+from collections import deque
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+from . import suggestions, taste
+from .models import SearchHistory
+
+logger = logging.getLogger(__name__)
+
+SYNC = 'sync'
+BUFFERED = 'buffered'
+
+
+class SearchHistoryWriter:
+    """Buffers SearchHistory rows and writes them in batches"""
+
+    def __init__(self, mode=None, batch_size=None, flush_interval=None):
+        self.mode = mode or settings.SEARCH_HISTORY_MODE
+        self.batch_size = batch_size or settings.SEARCH_HISTORY_BATCH_SIZE
+        self.flush_interval = flush_interval or settings.SEARCH_HISTORY_FLUSH_INTERVAL
+        self._buffer = deque()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def record(self, user, query, genre=''):
+        event = SearchHistory(
+            user_id=user.pk,
+            query=query[:255],
+            genre=genre[:100],
+            created_at=timezone.now(),
+        )
+        if self.mode == SYNC:
+            self.write([event])
+            return
+        self._ensure_thread()
+        self._buffer.append(event)
+        if len(self._buffer) >= self.batch_size:
+            self._wakeup.set()
+
+    def write(self, events):
+        with transaction.atomic():
+            SearchHistory.objects.bulk_create(events, batch_size=self.batch_size)
+            # Derived counters; a failure there must not cost the raw rows
+            for derive in (suggestions.record_searches, taste.record_searches):
+                try:
+                    with transaction.atomic():
+                        derive(events)
+                except Exception:
+                    logger.exception('%s.%s failed for %d search events', derive.__module__, derive.__name__, len(events))
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of rows"""
+        with self._flush_lock:
+            events = []
+            while self._buffer:
+                events.append(self._buffer.popleft())
+            if not events:
+                return 0
+            try:
+                self.write(events)
+            except Exception:
+                logger.exception('Dropped %d search history events', len(events))
+                return 0
+            return len(events)
+
+    def _ensure_thread(self):
+        # Workers forked from a preloaded master must start their own thread
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._flush_lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._buffer.clear()
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='search-history-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            close_old_connections()
+            self.flush()
+
+
+writer = SearchHistoryWriter()
+atexit.register(writer.flush)
+
+
+def record_search(user, query, genre=''):
+    """Record a search without (in buffered mode) touching the database"""
+    writer.record(user, query, genre)
+
+
+async def arecord_search(user, query, genre=''):
+    """Async variant of record_search; only sync mode needs a worker thread"""
+    if writer.mode == SYNC:
+        await sync_to_async(writer.record)(user, query, genre)
+    else:
+        writer.record(user, query, genre)
@@ -0,0 +1,326 @@
+"""
+Gateway to the LLM provider.
+
+All chat completions go through ``gateway`` so every call gets:
+
+* explicit connect / read timeouts and a bounded, keep-alive connection
+  pool (one per worker process);
+* up to ``LLM_MAX_RETRIES`` retries on connection errors, timeouts, 429 and
+  5xx, with full-jitter exponential backoff (honouring ``Retry-After``)
+  inside an overall ``LLM_TOTAL_TIMEOUT`` budget;
+* a circuit breaker that opens when the recent error rate passes
+  ``LLM_BREAKER_ERROR_RATE`` and fails fast for ``LLM_BREAKER_COOLDOWN``
+  seconds before letting a single probe through;
+* a per-worker concurrency limit, so a slow upstream ties up at most
+  ``LLM_MAX_CONCURRENCY`` threads instead of the whole worker.
+
+Whenever the LLM can't be used the gateway raises ``LLMUnavailable`` and
+callers fall back to local search. ``cinemai.fake_llm`` provides an
+OpenAI-compatible server to point ``OPENAI_BASE_URL`` at in tests.
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+
+import httpx
+import openai
+from django.conf import settings
+from openai import AsyncOpenAI, OpenAI
+
+logger = logging.getLogger(__name__)
+
+# Worth retrying: the request may well succeed a moment later
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+
+class LLMUnavailable(Exception):
+    """The LLM can't serve this request; use the local fallback instead"""
+
+
+class CircuitBreaker:
+    """Error-rate circuit breaker over a sliding time window"""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, error_rate=None, min_requests=None, window=None, cooldown=None):
+        self.error_rate = error_rate if error_rate is not None else settings.LLM_BREAKER_ERROR_RATE
+        self.min_requests = min_requests if min_requests is not None else settings.LLM_BREAKER_MIN_REQUESTS
+        self.window = window if window is not None else settings.LLM_BREAKER_WINDOW
+        self.cooldown = cooldown if cooldown is not None else settings.LLM_BREAKER_COOLDOWN
+        self._outcomes = deque()
+        self._failures = 0
+        self._opened_at = None
+        self._probe_started = None
+        self._lock = threading.Lock()
+
+    def _trim(self, now):
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            _, ok = self._outcomes.popleft()
+            self._failures -= not ok
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return self.CLOSED
+            if time.monotonic() - self._opened_at < self.cooldown:
+                return self.OPEN
+            return self.HALF_OPEN
+
+    def allow(self):
+        """Whether a request may go upstream now"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self._opened_at < self.cooldown:
+                return False
+            # Half-open: let one probe through (another if it never reports back)
+            if self._probe_started is not None and now - self._probe_started < self.cooldown:
+                return False
+            self._probe_started = now
+            return True
+
+    def record(self, ok):
+        with self._lock:
+            now = time.monotonic()
+            if self._opened_at is not None:
+                if self._probe_started is not None:
+                    self._probe_started = None
+                    if ok:
+                        self._opened_at = None
+                        self._outcomes.clear()
+                        self._failures = 0
+                    else:
+                        self._opened_at = now
+                return
+
+            self._outcomes.append((now, ok))
+            self._failures += not ok
+            self._trim(now)
+            total = len(self._outcomes)
+            if total >= self.min_requests and self._failures / total >= self.error_rate:
+                logger.warning('LLM circuit opened: %d of %d recent requests failed', self._failures, total)
+                self._opened_at = now
+
+
+def _retry_after(error):
+    response = getattr(error, 'response', None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get('retry-after'))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMGateway:
+    """Timeouts, pooling, retries, circuit breaking and concurrency limits for LLM calls"""
+
+    def __init__(self, api_key=None, base_url=None, breaker=None):
+        self.api_key = api_key if api_key is not None else settings.OPENAI_API_KEY
+        self.base_url = base_url if base_url is not None else settings.OPENAI_BASE_URL
+        self.max_retries = settings.LLM_MAX_RETRIES
+        self.total_timeout = settings.LLM_TOTAL_TIMEOUT
+        self.breaker = breaker or CircuitBreaker()
+        self._limiter = threading.BoundedSemaphore(settings.LLM_MAX_CONCURRENCY)
+        self._async_limiters = weakref.WeakKeyDictionary()
+        self._client = self._async_client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.api_key)
+
+    @property
+    def available(self):
+        """Configured and not currently failing fast"""
+        return self.enabled and self.breaker.state != CircuitBreaker.OPEN
+
+    def _timeout(self):
+        return httpx.Timeout(
+            settings.LLM_READ_TIMEOUT,
+            connect=settings.LLM_CONNECT_TIMEOUT,
+            pool=settings.LLM_QUEUE_TIMEOUT,
+        )
+
+    def _limits(self):
+        return httpx.Limits(
+            max_connections=settings.LLM_MAX_CONCURRENCY,
+            max_keepalive_connections=settings.LLM_MAX_CONCURRENCY,
+            keepalive_expiry=settings.LLM_KEEPALIVE_EXPIRY,
+        )
+
+    def _client_kwargs(self, http_client):
+        return {
+            'api_key': self.api_key,
+            'base_url': self.base_url or None,
+            'timeout': self._timeout(),
+            'max_retries': 0,  # retried here, with jitter and the breaker
+            'http_client': http_client,
+        }
+
+    def _ensure_clients(self):
+        # Connections must not be shared with a parent process after fork
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._client = OpenAI(**self._client_kwargs(
+                httpx.Client(timeout=self._timeout(), limits=self._limits())
+            ))
+            self._async_client = AsyncOpenAI(**self._client_kwargs(
+                httpx.AsyncClient(timeout=self._timeout(), limits=self._limits())
+            ))
+            self._async_limiters = weakref.WeakKeyDictionary()
+            self._pid = os.getpid()
+
+    @property
+    def client(self):
+        self._ensure_clients()
+        return self._client
+
+    @property
+    def async_client(self):
+        self._ensure_clients()
+        return self._async_client
+
+    @contextmanager
+    def _slot(self):
+        """Hold one of this worker's LLM concurrency slots"""
+        if not self.enabled:
+            raise LLMUnavailable('no LLM API key configured')
+        if not self._limiter.acquire(timeout=settings.LLM_QUEUE_TIMEOUT):
+            raise LLMUnavailable('too many concurrent LLM requests')
+        try:
+            if not self.breaker.allow():
+                raise LLMUnavailable('LLM circuit is open')
+            yield
+        finally:
+            self._limiter.release()
+
+    def _backoff(self, attempt, error, deadline):
+        """Seconds to wait before retry ``attempt``, or None to give up"""
+        if attempt >= self.max_retries or not isinstance(error, RETRYABLE_ERRORS):
+            return None
+        delay = random.uniform(0, min(settings.LLM_RETRY_MAX_DELAY, settings.LLM_RETRY_BASE_DELAY * 2 ** attempt))
+        retry_after = _retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+    def _failed(self, error):
+        # Only upstream trouble counts against the breaker, not bad requests
+        self.breaker.record(not isinstance(error, RETRYABLE_ERRORS))
+        raise LLMUnavailable(str(error)) from error
+
+    def _call(self, create):
+        with self._slot():
+            deadline = time.monotonic() + self.total_timeout
+            attempt = 0
+            while True:
+                try:
+                    response = create()
+                except openai.APIError as error:
+                    delay = self._backoff(attempt, error, deadline)
+                    if delay is None:
+                        self._failed(error)
+                    logger.info('Retrying LLM request in %.2fs: %s', delay, error)
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                self.breaker.record(True)
+                return response
+
+    def chat(self, messages, **kwargs):
+        """One chat completion"""
+        kwargs.setdefault('model', settings.LLM_MODEL)
+        return self._call(lambda: self.client.chat.completions.create(messages=messages, **kwargs))
+
+    def stream_chat(self, messages, **kwargs):
+        """
+        Yield streamed completion chunks. Opening the stream is retried; an
+        error once chunks are flowing ends it with LLMUnavailable.
+        """
+        kwargs.setdefault('model', settings.LLM_MODEL)
+        with self._slot():
+            deadline = time.monotonic() + self.total_timeout
+            attempt = 0
+            while True:
+                try:
+                    stream = self.client.chat.completions.create(messages=messages, stream=True, **kwargs)
+                    break
+                except openai.APIError as error:
+                    delay = self._backoff(attempt, error, deadline)
+                    if delay is None:
+                        self._failed(error)
+                    time.sleep(delay)
+                    attempt += 1
+            # The upstream answered; a later mid-stream error counts separately
+            self.breaker.record(True)
+            try:
+                yield from stream
+            except openai.APIError as error:
+                self._failed(error)
+
+    def _async_limiter(self):
+        loop = asyncio.get_running_loop()
+        limiter = self._async_limiters.get(loop)
+        if limiter is None:
+            # A semaphore that had waiters refers to its loop, so weak keys alone
+            # don't let closed loops go
+            for closed in [other for other in self._async_limiters if other.is_closed()]:
+                del self._async_limiters[closed]
+            limiter = self._async_limiters[loop] = asyncio.Semaphore(settings.LLM_MAX_CONCURRENCY)
+        return limiter
+
+    @asynccontextmanager
+    async def _aslot(self):
+        if not self.enabled:
+            raise LLMUnavailable('no LLM API key configured')
+        limiter = self._async_limiter()
+        try:
+            await asyncio.wait_for(limiter.acquire(), settings.LLM_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise LLMUnavailable('too many concurrent LLM requests')
+        try:
+            if not self.breaker.allow():
+                raise LLMUnavailable('LLM circuit is open')
+            yield
+        finally:
+            limiter.release()
+
+    async def achat(self, messages, **kwargs):
+        """Async variant of chat"""
+        kwargs.setdefault('model', settings.LLM_MODEL)
+        async with self._aslot():
+            client = self.async_client
+            deadline = time.monotonic() + self.total_timeout
+            attempt = 0
+            while True:
+                try:
+                    response = await client.chat.completions.create(messages=messages, **kwargs)
+                except openai.APIError as error:
+                    delay = self._backoff(attempt, error, deadline)
+                    if delay is None:
+                        self._failed(error)
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+                self.breaker.record(True)
+                return response
+
+
+gateway = LLMGateway()
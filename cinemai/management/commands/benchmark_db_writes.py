@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from cinemai.dbtuning.benchmark import BACKENDS, run
+
+
+class Command(BaseCommand):
+    help = 'Compare concurrent search-write throughput of the stock and tuned SQLite backends'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8, help='Concurrent worker processes')
+        parser.add_argument('--searches', type=int, default=200, help='Searches per worker')
+        parser.add_argument('--backend', choices=list(BACKENDS), action='append',
+                            help='Only benchmark this backend (repeatable)')
+
+    def handle(self, *args, **options):
+        results = run(options['workers'], options['searches'], tuple(options['backend'] or BACKENDS))
+        self.stdout.write(f'{"backend":<8} {"workers":>7} {"searches":>9} {"errors":>7} '
+                          f'{"seconds":>8} {"per sec":>8} {"p50 ms":>7} {"p95 ms":>7}')
+        for result in results:
+            self.stdout.write(
+                f'{result.backend:<8} {result.workers:>7} {result.searches:>9} {result.errors:>7} '
+                f'{result.seconds:>8.2f} {result.throughput:>8.1f} '
+                f'{result.percentile(50) * 1000:>7.1f} {result.percentile(95) * 1000:>7.1f}'
+            )
+        if len(results) > 1 and results[0].throughput:
+            self.stdout.write(self.style.SUCCESS(
+                f'{results[-1].backend}: {results[-1].throughput / results[0].throughput:.1f}x '
+                f'the throughput of {results[0].backend}'
+            ))
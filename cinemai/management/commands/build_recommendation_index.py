@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cinemai.engine import build_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the local recommendation index from the movie catalog'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--directory', help='Write the index here instead of RECOMMENDER_INDEX_DIR')
+        parser.add_argument('--loop', action='store_true', help='Keep running, rebuilding periodically')
+        parser.add_argument('--interval', type=float, default=3600, help='Seconds between rebuilds with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            engine = build_index(options['directory'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Indexed {len(engine)} movies in {time.monotonic() - started:.2f}s'
+            ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from cinemai import caching, entitlements, recommendations, taste
+from cinemai.templatetags import movie_cache
+
+WARMERS = {
+    'profile': entitlements.warm_cache,
+    'taste': taste.warm_cache,
+    'movie': movie_cache.warm_cache,
+    # Calls the LLM for every popular query it doesn't have
+    'recommendations': recommendations.warm_cache,
+}
+
+
+class Command(BaseCommand):
+    help = 'Report hit rates per cache namespace and warm the hottest keys'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--warm', nargs='*', metavar='NAMESPACE',
+                            help='Warm these namespaces (all but recommendations when none are given)')
+        parser.add_argument('--limit', type=int, default=500, help='Keys to warm per namespace')
+        parser.add_argument('--reset', action='store_true', help='Zero the hit/miss counters after reporting')
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"namespace":<16} {"version":>7} {"ttl":>7} {"hits":>10} {"misses":>10} {"hit rate":>9}')
+        for name, (hits, misses) in caching.stats().items():
+            namespace = settings.CACHE_NAMESPACES[name]
+            lookups = hits + misses
+            rate = f'{hits / lookups:.1%}' if lookups else '-'
+            self.stdout.write(
+                f'{name:<16} {namespace["version"]:>7} {namespace["timeout"]:>7} {hits:>10} {misses:>10} {rate:>9}'
+            )
+        if options['reset']:
+            caching.reset_stats()
+            self.stdout.write('Counters reset')
+
+        if options['warm'] is None:
+            return
+        names = options['warm'] or [name for name in WARMERS if name != 'recommendations']
+        unknown = set(names) - set(WARMERS)
+        if unknown:
+            raise CommandError(f'Unknown namespace(s): {", ".join(sorted(unknown))}')
+        for name in names:
+            warmed = WARMERS[name](options['limit'])
+            self.stdout.write(f'Warmed {warmed} {name} keys')
+        self.stdout.write(self.style.SUCCESS('Cache warm-up complete'))
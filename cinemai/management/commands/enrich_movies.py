@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cinemai.enrichment import FixtureProvider, enrich_pending, get_provider
+
+
+class Command(BaseCommand):
+    help = 'Fill in year, poster, IMDb id, rating and runtime for un-enriched movies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Movies looked up per bulk_update')
+        parser.add_argument('--max-batches', type=int, help='Stop after this many batches')
+        parser.add_argument('--fixture', help='Serve metadata from this JSON file instead of the configured provider')
+        parser.add_argument('--loop', action='store_true', help='Keep running, polling for new movies')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        provider = FixtureProvider(options['fixture']) if options['fixture'] else get_provider()
+
+        while True:
+            updated = enrich_pending(
+                batch_size=options['batch_size'],
+                provider=provider,
+                max_batches=options['max_batches'],
+            )
+            self.stdout.write(self.style.SUCCESS(f'Enriched {updated} movies'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,101 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from cinemai.models import Movie, MovieTrigram, Watchlist
+from cinemai.titles import canonical_title
+
+# Metadata copied onto the survivor when it is missing there
+MERGE_FIELDS = ['year', 'genre', 'director', 'plot', 'poster_url', 'rating', 'runtime']
+
+
+def _completeness(movie):
+    return (
+        bool(movie.imdb_id),
+        sum(1 for field in MERGE_FIELDS if getattr(movie, field) not in (None, '')),
+        -movie.pk,
+    )
+
+
+class Command(BaseCommand):
+    help = 'Merge Movie rows that share a canonical title and repoint watchlists to the survivor'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report duplicates without changing anything')
+        parser.add_argument('--renormalize', action='store_true',
+                            help='Recompute normalized titles (and trigrams) before merging')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+
+        if options['renormalize'] and not dry_run:
+            self.renormalize()
+
+        groups = (
+            Movie.objects
+            .exclude(normalized_title__isnull=True)
+            .exclude(normalized_title='')
+            .values('normalized_title')
+            .annotate(rows=Count('id'))
+            .filter(rows__gt=1)
+            .values_list('normalized_title', flat=True)
+        )
+
+        merged = 0
+        for normalized in list(groups):
+            movies = sorted(Movie.objects.filter(normalized_title=normalized), key=_completeness, reverse=True)
+            survivor, duplicates = movies[0], movies[1:]
+            self.stdout.write(
+                f'{survivor.title!r} (id {survivor.pk}) <- '
+                + ', '.join(f'{movie.title!r} (id {movie.pk})' for movie in duplicates)
+            )
+            if not dry_run:
+                self.merge(survivor, duplicates)
+            merged += len(duplicates)
+
+        verb = 'Would merge' if dry_run else 'Merged'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {merged} duplicate movies'))
+
+    def renormalize(self):
+        movies = []
+        for movie in Movie.objects.only('id', 'title', 'normalized_title').iterator(chunk_size=500):
+            normalized = canonical_title(movie.title)
+            if normalized != movie.normalized_title:
+                movie.normalized_title = normalized
+                movies.append(movie)
+        Movie.objects.bulk_update(movies, ['normalized_title'], batch_size=500)
+        MovieTrigram.index(movies)
+        self.stdout.write(f'Renormalized {len(movies)} titles')
+
+    @transaction.atomic
+    def merge(self, survivor, duplicates):
+        duplicate_ids = [movie.pk for movie in duplicates]
+
+        # Repoint watchlist rows; where the user already has the survivor,
+        # fold the duplicate's watched flag and notes into that row instead
+        kept = {item.user_id: item for item in Watchlist.objects.filter(movie=survivor)}
+        for item in Watchlist.objects.filter(movie_id__in=duplicate_ids).order_by('added_at'):
+            existing = kept.get(item.user_id)
+            if existing is None:
+                item.movie = survivor
+                item.save(update_fields=['movie'])
+                kept[item.user_id] = item
+                continue
+            existing.watched = existing.watched or item.watched
+            if item.notes and item.notes not in existing.notes:
+                existing.notes = '\n'.join(filter(None, [existing.notes, item.notes]))
+            existing.save(update_fields=['watched', 'notes'])
+            item.delete()
+
+        imdb_id = survivor.imdb_id or next((movie.imdb_id for movie in duplicates if movie.imdb_id), None)
+        for field in MERGE_FIELDS:
+            if getattr(survivor, field) in (None, ''):
+                for movie in duplicates:
+                    if getattr(movie, field) not in (None, ''):
+                        setattr(survivor, field, getattr(movie, field))
+                        break
+
+        # Delete first so a duplicate's imdb_id is free to move to the survivor
+        Movie.objects.filter(pk__in=duplicate_ids).delete()
+        survivor.imdb_id = imdb_id
+        survivor.save(update_fields=MERGE_FIELDS + ['imdb_id'])
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cinemai.webhooks import drain
+
+
+class Command(BaseCommand):
+    help = 'Apply stored Stripe webhook events, in order per customer'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, help='Customers processed concurrently (default STRIPE_WEBHOOK_WORKERS)')
+        parser.add_argument('--loop', action='store_true', help='Keep running, polling for new events')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds between polls with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            applied = drain(options['workers'])
+            if applied or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f'Applied {applied} Stripe events in {time.monotonic() - started:.2f}s'
+                ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from cinemai.retention import prune_search_history, rollup_search_history
+
+
+class Command(BaseCommand):
+    help = 'Roll SearchHistory up into daily aggregates and prune raw rows past the retention window'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Keep raw rows for this many days')
+        parser.add_argument('--batch-size', type=int, help='Rows read or deleted per transaction')
+        parser.add_argument('--max-batches', type=int, help='Stop each phase after this many batches')
+        parser.add_argument('--rollup-only', action='store_true', help='Update the aggregates without pruning')
+        parser.add_argument('--loop', action='store_true', help='Keep running on a fixed interval')
+        parser.add_argument('--interval', type=float, default=3600, help='Seconds between runs with --loop')
+
+    def handle(self, *args, **options):
+        while True:
+            rolled = rollup_search_history(options['batch_size'], options['max_batches'])
+            self.stdout.write(f'Rolled up {rolled} search history rows')
+            if not options['rollup_only']:
+                pruned = prune_search_history(options['days'], options['batch_size'], options['max_batches'])
+                self.stdout.write(f'Pruned {pruned} search history rows')
+            self.stdout.write(self.style.SUCCESS('Search history retention complete'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from cinemai.billing import sync_prices
+
+
+class Command(BaseCommand):
+    help = 'Find or create the Stripe Price (and Product) of every subscription tier'
+
+    def handle(self, *args, **options):
+        prices = sync_prices()
+        self.stdout.write(self.style.SUCCESS('Stripe prices are in place; to skip the lookup at runtime set:'))
+        for tier, price in prices.items():
+            self.stdout.write(f'STRIPE_PRICE_{tier}={price}')
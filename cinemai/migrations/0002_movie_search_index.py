@@ -0,0 +1,80 @@
+from django.db import migrations
+
+FTS_TABLE = 'cinemai_movie_fts'
+
+# Must match cinemai.search.PG_DOCUMENT for the planner to use the index
+PG_DOCUMENT = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(director, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(genre, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(plot, '')), 'C')"
+)
+
+SQLITE_FORWARD = [
+    f"""CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(
+        title, director, genre, plot,
+        content='cinemai_movie', content_rowid='id'
+    )""",
+    f"""CREATE TRIGGER cinemai_movie_fts_ai AFTER INSERT ON cinemai_movie BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, director, genre, plot)
+        VALUES (new.id, new.title, new.director, new.genre, new.plot);
+    END""",
+    f"""CREATE TRIGGER cinemai_movie_fts_ad AFTER DELETE ON cinemai_movie BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, director, genre, plot)
+        VALUES ('delete', old.id, old.title, old.director, old.genre, old.plot);
+    END""",
+    f"""CREATE TRIGGER cinemai_movie_fts_au AFTER UPDATE ON cinemai_movie BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, director, genre, plot)
+        VALUES ('delete', old.id, old.title, old.director, old.genre, old.plot);
+        INSERT INTO {FTS_TABLE}(rowid, title, director, genre, plot)
+        VALUES (new.id, new.title, new.director, new.genre, new.plot);
+    END""",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+SQLITE_REVERSE = [
+    'DROP TRIGGER IF EXISTS cinemai_movie_fts_au',
+    'DROP TRIGGER IF EXISTS cinemai_movie_fts_ad',
+    'DROP TRIGGER IF EXISTS cinemai_movie_fts_ai',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+POSTGRES_FORWARD = [
+    f'CREATE INDEX cinemai_movie_search_gin ON cinemai_movie USING GIN (({PG_DOCUMENT}))',
+]
+
+POSTGRES_REVERSE = [
+    'DROP INDEX IF EXISTS cinemai_movie_search_gin',
+]
+
+
+def _run(schema_editor, statements):
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        _run(schema_editor, SQLITE_FORWARD)
+    elif vendor == 'postgresql':
+        _run(schema_editor, POSTGRES_FORWARD)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        _run(schema_editor, SQLITE_REVERSE)
+    elif vendor == 'postgresql':
+        _run(schema_editor, POSTGRES_REVERSE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinemai', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.28 on 2026-10-17 23:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from cinemai.titles import canonical_title, trigrams
+
+
+def backfill_normalized_titles(apps, schema_editor):
+    Movie = apps.get_model('cinemai', 'Movie')
+    MovieTrigram = apps.get_model('cinemai', 'MovieTrigram')
+    db = schema_editor.connection.alias
+    batch = []
+    for movie in Movie.objects.using(db).only('id', 'title').iterator(chunk_size=500):
+        movie.normalized_title = canonical_title(movie.title)
+        batch.append(movie)
+        if len(batch) >= 500:
+            _save_batch(Movie, MovieTrigram, batch, db)
+            batch = []
+    _save_batch(Movie, MovieTrigram, batch, db)
+
+
+def _save_batch(Movie, MovieTrigram, movies, db):
+    Movie.objects.using(db).bulk_update(movies, ['normalized_title'])
+    MovieTrigram.objects.using(db).bulk_create([
+        MovieTrigram(movie_id=movie.id, trigram=trigram)
+        for movie in movies
+        for trigram in trigrams(movie.normalized_title)
+    ], ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinemai', '0002_movie_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='normalized_title',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=255, null=True),
+        ),
+        migrations.CreateModel(
+            name='MovieTrigram',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trigram', models.CharField(db_index=True, max_length=3)),
+                ('movie', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trigrams', to='cinemai.movie')),
+            ],
+            options={
+                'unique_together': {('movie', 'trigram')},
+            },
+        ),
+        migrations.RunPython(backfill_normalized_titles, migrations.RunPython.noop),
+    ]
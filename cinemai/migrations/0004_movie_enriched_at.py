@@ -0,0 +1,18 @@
+# Generated by Django 4.2.28 on 2026-10-17 23:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinemai', '0003_movie_normalized_title'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='enriched_at',
+            field=models.DateTimeField(blank=True, db_index=True, editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.28 on 2026-10-17 23:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinemai', '0004_movie_enriched_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='watchlist',
+            index=models.Index(fields=['user', 'added_at', 'id'], name='watchlist_user_added_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='watchlist',
+            index=models.Index(fields=['user', 'watched', 'added_at', 'id'], name='watchlist_user_watched_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.28 on 2026-10-17 23:59
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinemai', '0005_watchlist_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='searchhistory',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
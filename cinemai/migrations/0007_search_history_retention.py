@@ -0,0 +1,55 @@
+# Generated by Django 4.2.28 on 2026-10-18 00:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinemai', '0006_searchhistory_created_at_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RetentionCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SearchRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('genre', models.CharField(blank=True, max_length=100)),
+                ('normalized_query', models.CharField(max_length=255)),
+                ('count', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'ordering': ['-day', '-count'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='searchhistory',
+            index=models.Index(fields=['created_at'], name='searchhistory_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchhistory',
+            index=models.Index(fields=['genre', 'created_at'], name='searchhistory_genre_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchrollup',
+            index=models.Index(fields=['genre', 'day'], name='searchrollup_genre_day_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='searchrollup',
+            index=models.Index(fields=['normalized_query', 'day'], name='searchrollup_query_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='searchrollup',
+            constraint=models.UniqueConstraint(fields=('day', 'genre', 'normalized_query'), name='searchrollup_unique_key'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.2.28 on 2026-10-18 00:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinemai', '0007_search_history_retention'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QueryPopularity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('normalized_query', models.CharField(max_length=255)),
+                ('genre', models.CharField(blank=True, max_length=100)),
+                ('score', models.FloatField(default=0)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('last_searched_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'Query popularity',
+                'indexes': [models.Index(fields=['-score'], name='querypopularity_score_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='querypopularity',
+            constraint=models.UniqueConstraint(fields=('normalized_query', 'genre'), name='querypopularity_unique_key'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.28 on 2026-10-18 00:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('cinemai', '0009_taste_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMUsage',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField()),
+                ('tokens', models.BigIntegerField(default=0)),
+                ('requests', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='llm_usage', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'LLM usage',
+                'ordering': ['-period'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='llmusage',
+            constraint=models.UniqueConstraint(fields=('user', 'period'), name='llmusage_unique_user_period'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.28 on 2026-10-18 16:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinemai', '0011_stripe_event'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movie',
+            name='version',
+            field=models.PositiveIntegerField(default=1, editable=False),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.2.28 on 2026-10-18 19:10
+
+from django.db import migrations
+
+FTS_TABLE = 'cinemai_movie_fts'
+
+# 0012 rebuilt cinemai_movie on SQLite (new column with a default), which
+# dropped the FTS sync triggers 0002 created; recreate them and reindex
+# whatever was written without them
+SQLITE_FORWARD = [
+    'DROP TRIGGER IF EXISTS cinemai_movie_fts_ai',
+    'DROP TRIGGER IF EXISTS cinemai_movie_fts_ad',
+    'DROP TRIGGER IF EXISTS cinemai_movie_fts_au',
+    f"""CREATE TRIGGER cinemai_movie_fts_ai AFTER INSERT ON cinemai_movie BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, director, genre, plot)
+        VALUES (new.id, new.title, new.director, new.genre, new.plot);
+    END""",
+    f"""CREATE TRIGGER cinemai_movie_fts_ad AFTER DELETE ON cinemai_movie BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, director, genre, plot)
+        VALUES ('delete', old.id, old.title, old.director, old.genre, old.plot);
+    END""",
+    f"""CREATE TRIGGER cinemai_movie_fts_au AFTER UPDATE ON cinemai_movie BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, director, genre, plot)
+        VALUES ('delete', old.id, old.title, old.director, old.genre, old.plot);
+        INSERT INTO {FTS_TABLE}(rowid, title, director, genre, plot)
+        VALUES (new.id, new.title, new.director, new.genre, new.plot);
+    END""",
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+]
+
+
+def restore_fts_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in SQLITE_FORWARD:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinemai', '0012_movie_version'),
+    ]
+
+    operations = [
+        migrations.RunPython(restore_fts_triggers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.28 on 2026-10-18 19:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinemai', '0013_restore_movie_fts_triggers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RateLimitCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=255, unique=True)),
+                ('value', models.FloatField(default=0)),
+                ('expires_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 4.2.28 on 2026-10-18 20:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinemai', '0014_rate_limit_counter'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DecayLandmark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, unique=True)),
+                ('at', models.DateTimeField()),
+            ],
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.28 on 2026-10-18 20:50
+
+from django.db import migrations, models
+
+
+def checkpoint_by_created_at(apps, schema_editor):
+    # The rollup used to walk by id alone; carry each checkpoint over as the
+    # newest row it had covered. Stragglers that committed behind the old id
+    # checkpoint but are older than that row stay uncounted, as they were
+    RetentionCheckpoint = apps.get_model('cinemai', 'RetentionCheckpoint')
+    SearchHistory = apps.get_model('cinemai', 'SearchHistory')
+    db_alias = schema_editor.connection.alias
+    for checkpoint in RetentionCheckpoint.objects.using(db_alias).filter(last_id__gt=0):
+        last = (
+            SearchHistory.objects.using(db_alias)
+            .filter(id__lte=checkpoint.last_id)
+            .order_by('-created_at', '-id')
+            .values_list('id', 'created_at')
+            .first()
+        )
+        if last is not None:
+            checkpoint.last_id, checkpoint.last_created_at = last
+            checkpoint.save(update_fields=['last_id', 'last_created_at'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cinemai', '0015_decay_landmark'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='retentioncheckpoint',
+            name='last_created_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(checkpoint_by_created_at, migrations.RunPython.noop),
+    ]
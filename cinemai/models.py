@@ -3,13 +3,19 @@ from django.db import models
 # Create your models here.
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db.models.signals import post_init, post_save
 from django.dispatch import receiver
+from django.utils import timezone
+
+from . import tiers
+from .titles import canonical_title, trigrams
+
 
 class SubscriptionTier(models.TextChoices):
-    BASIC = 'BASIC', 'Basic - $9.99/month'
-    STANDARD = 'STANDARD', 'Standard - $14.99/month'
-    PRO = 'PRO', 'Pro - $19.99/month'
+    BASIC = 'BASIC', tiers.BASIC.label
+    STANDARD = 'STANDARD', tiers.STANDARD.label
+    PRO = 'PRO', tiers.PRO.label
+
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
@@ -28,27 +34,49 @@ class UserProfile(models.Model):
     def __str__(self):
         return f"{self.user.username} - {self.subscription_tier}"
 
+    def _tracked_values(self):
+        return {field.attname: self.__dict__.get(field.attname) for field in self._meta.concrete_fields}
+
+    def has_changes(self):
+        """Whether any field differs from what was loaded or last saved"""
+        return self._tracked_values() != self._saved_values
+
+    @property
+    def plan(self):
+        return tiers.get_plan(self.subscription_tier)
+
     @property
     def tier_price(self):
-        prices = {
-            'BASIC': 9.99,
-            'STANDARD': 14.99,
-            'PRO': 19.99
-        }
-        return prices.get(self.subscription_tier, 0)
+        return self.plan.price
+
+
+@receiver(post_init, sender=UserProfile)
+@receiver(post_save, sender=UserProfile)
+def remember_profile_values(sender, instance, **kwargs):
+    instance._saved_values = instance._tracked_values()
+
 
 @receiver(post_save, sender=User)
 def create_user_profile(sender, instance, created, **kwargs):
     if created:
         UserProfile.objects.create(user=instance)
 
+
 @receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    instance.profile.save()
+def save_user_profile(sender, instance, created, **kwargs):
+    # Only a profile loaded through user.profile and changed since needs
+    # writing; plain user saves (e.g. last_login on login) cost nothing
+    if created or not User.profile.is_cached(instance):
+        return
+    profile = getattr(instance, 'profile', None)
+    if profile is not None and profile.has_changes():
+        profile.save()
 
 
 class Movie(models.Model):
     title = models.CharField(max_length=255)
+    # Canonical lookup form of the title, see cinemai.titles.canonical_title
+    normalized_title = models.CharField(max_length=255, null=True, blank=True, db_index=True, editable=False)
     year = models.IntegerField(null=True, blank=True)
     genre = models.CharField(max_length=100, blank=True)
     director = models.CharField(max_length=255, blank=True)
@@ -57,15 +85,59 @@ class Movie(models.Model):
     imdb_id = models.CharField(max_length=20, unique=True, null=True, blank=True)
     rating = models.DecimalField(max_digits=3, decimal_places=1, null=True, blank=True)
     runtime = models.IntegerField(null=True, blank=True)  # in minutes
+    # Set once the metadata provider has been asked about this movie
+    enriched_at = models.DateTimeField(null=True, blank=True, db_index=True, editable=False)
+    # Bumped on every save; part of the cache key of rendered movie cards
+    version = models.PositiveIntegerField(default=1, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return f"{self.title} ({self.year})"
 
+    def save(self, *args, **kwargs):
+        self.normalized_title = canonical_title(self.title)
+        if self.pk is not None:
+            self.version += 1
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'version'}
+            if 'title' in update_fields:
+                kwargs['update_fields'].add('normalized_title')
+        super().save(*args, **kwargs)
+
     class Meta:
         ordering = ['-created_at']
 
 
+class MovieTrigram(models.Model):
+    """Trigram index over Movie.normalized_title for fuzzy title lookups"""
+    movie = models.ForeignKey(Movie, on_delete=models.CASCADE, related_name='trigrams')
+    trigram = models.CharField(max_length=3, db_index=True)
+
+    class Meta:
+        unique_together = ('movie', 'trigram')
+
+    def __str__(self):
+        return f"{self.movie_id} - {self.trigram!r}"
+
+    @classmethod
+    def index(cls, movies):
+        """(Re)build the trigram rows for the given movies"""
+        movies = [movie for movie in movies if movie.pk]
+        cls.objects.filter(movie__in=movies).delete()
+        cls.objects.bulk_create([
+            cls(movie=movie, trigram=trigram)
+            for movie in movies
+            for trigram in trigrams(movie.normalized_title or '')
+        ], ignore_conflicts=True)
+
+
+@receiver(post_save, sender=Movie)
+def index_movie_trigrams(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is None or 'title' in update_fields:
+        MovieTrigram.index([instance])
+
+
 class Watchlist(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='watchlist')
     movie = models.ForeignKey(Movie, on_delete=models.CASCADE)
@@ -76,6 +148,11 @@ class Watchlist(models.Model):
     class Meta:
         unique_together = ('user', 'movie')
         ordering = ['-added_at']
+        indexes = [
+            # Keyset pagination walks (added_at, id) per user, optionally by watched
+            models.Index(fields=['user', 'added_at', 'id'], name='watchlist_user_added_idx'),
+            models.Index(fields=['user', 'watched', 'added_at', 'id'], name='watchlist_user_watched_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.movie.title}"
@@ -85,11 +162,163 @@ class SearchHistory(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='search_history')
     query = models.CharField(max_length=255)
     genre = models.CharField(max_length=100, blank=True)
-    created_at = models.DateTimeField(auto_now_add=True)
+    # Not auto_now_add: buffered writes keep the time of the search itself
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         ordering = ['-created_at']
         verbose_name_plural = 'Search histories'
+        indexes = [
+            # Admin ordering/date filter and retention pruning by age
+            models.Index(fields=['created_at'], name='searchhistory_created_idx'),
+            models.Index(fields=['genre', 'created_at'], name='searchhistory_genre_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} - {self.query}"
+
+
+class SearchRollup(models.Model):
+    """Daily search counts per genre and normalized query, kept after raw rows are pruned"""
+    day = models.DateField()
+    genre = models.CharField(max_length=100, blank=True)
+    normalized_query = models.CharField(max_length=255)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['-day', '-count']
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'genre', 'normalized_query'], name='searchrollup_unique_key'),
+        ]
+        indexes = [
+            models.Index(fields=['genre', 'day'], name='searchrollup_genre_day_idx'),
+            models.Index(fields=['normalized_query', 'day'], name='searchrollup_query_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.day} - {self.normalized_query} ({self.count})"
+
+
+class RetentionCheckpoint(models.Model):
+    """Last raw row, in (created_at, id) order, already folded into the rollups, per job"""
+    name = models.CharField(max_length=50, unique=True)
+    last_created_at = models.DateTimeField(null=True, blank=True)
+    last_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.last_created_at} #{self.last_id}"
+
+
+class QueryPopularity(models.Model):
+    """
+    Exponentially decayed search counter per normalized query and genre.
+
+    ``score`` uses forward decay: each search adds ``2 ** (age / half-life)``
+    measured from a landmark time (``DecayLandmark``), so newer searches
+    weigh more and rows only need rewriting when the landmark moves forward
+    to keep the weights finite. See cinemai.suggestions.
+    """
+    normalized_query = models.CharField(max_length=255)
+    genre = models.CharField(max_length=100, blank=True)
+    score = models.FloatField(default=0)
+    count = models.PositiveIntegerField(default=0)
+    last_searched_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['normalized_query', 'genre'], name='querypopularity_unique_key'),
+        ]
+        indexes = [
+            models.Index(fields=['-score'], name='querypopularity_score_idx'),
+        ]
+        verbose_name_plural = 'Query popularity'
+
+    def __str__(self):
+        return f"{self.normalized_query} ({self.count})"
+
+
+class DecayLandmark(models.Model):
+    """Time that a set of forward-decayed scores is currently measured from"""
+    name = models.CharField(max_length=50, unique=True)
+    at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.name} @ {self.at:%Y-%m-%d %H:%M}"
+
+
+class TasteProfile(models.Model):
+    """
+    Per-user genre/director affinities, maintained incrementally as the
+    watchlist and search history change. See cinemai.taste.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='taste_profile')
+    # Feature ('g:<genre>' / 'd:<director>') -> accumulated weight
+    weights = models.JSONField(default=dict)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.user.username} - {len(self.weights)} features"
+
+
+class LLMUsage(models.Model):
+    """LLM tokens used per user and billing period (the durable side of cinemai.quotas)"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='llm_usage')
+    # First day of the billing period
+    period = models.DateField()
+    tokens = models.BigIntegerField(default=0)
+    requests = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['-period']
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'period'], name='llmusage_unique_user_period'),
+        ]
+        verbose_name_plural = 'LLM usage'
+
+    def __str__(self):
+        return f"{self.user.username} - {self.period:%Y-%m}: {self.tokens} tokens"
+
+
+class RateLimitCounter(models.Model):
+    """Shared rate limit and quota counter, used when there is no Redis (see cinemai.counters)"""
+    key = models.CharField(max_length=255, unique=True)
+    value = models.FloatField(default=0)
+    # Null never expires
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.key} = {self.value:g}"
+
+
+class StripeEventStatus(models.TextChoices):
+    PENDING = 'pending', 'Pending'
+    PROCESSED = 'processed', 'Processed'
+    SKIPPED = 'skipped', 'Skipped'
+    FAILED = 'failed', 'Failed'
+
+
+class StripeEvent(models.Model):
+    """A received Stripe webhook event, applied asynchronously by cinemai.webhooks"""
+    event_id = models.CharField(max_length=255, unique=True)
+    type = models.CharField(max_length=100)
+    # Events for one customer are applied in order, one at a time
+    customer_id = models.CharField(max_length=255, blank=True, default='')
+    # When Stripe created the event (not when we received it)
+    created = models.DateTimeField()
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=StripeEventStatus.choices, default=StripeEventStatus.PENDING)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['created', 'id']
+        indexes = [
+            models.Index(fields=['status', 'customer_id', 'created'], name='stripeevent_queue_idx'),
+        ]
 
     def __str__(self):
-        return f"{self.user.username} - {self.query}"
\ No newline at end of file
+        return f"{self.event_id} ({self.type}) - {self.status}"
\ No newline at end of file
@@ -0,0 +1,183 @@
+"""
+Per-user, tier-aware LLM rate limits and token quotas.
+
+Every search that would reach the LLM first calls ``check(user)``:
+
+* a token bucket per user and tier (the plan's ``llm_searches_per_minute``
+  refill rate and ``llm_burst`` size) limits how often, and
+* the tokens already used this billing period (``llm_tokens_per_month``)
+  limit how much,
+
+and a refusal comes back with a Retry-After before anything is sent
+upstream. Both live in the ``ratelimit`` cache alias and are updated with
+atomic ``incr`` calls only, and that alias is shared (Redis, or the
+``RateLimitCounter`` table without it), so the limits hold across all
+gunicorn workers.
+
+The bucket stores two keys: when it started draining and how many tokens
+it has handed out since. Tokens refill continuously at ``rate``, and both
+keys expire at the moment the bucket would be full again, which resets it.
+Token usage is taken from each completion's ``usage`` and also written to
+``LLMUsage`` so quotas survive cache evictions.
+"""
+import math
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import date, datetime, time as dt_time, timezone as dt_timezone
+
+from django.core.cache import caches
+from django.db.models import F
+
+from .entitlements import get_entitlement
+from .models import LLMUsage
+
+# The user LLM tokens are charged to while a search runs
+_billed_user = ContextVar('llm_billed_user', default=None)
+
+
+@dataclass(frozen=True)
+class Decision:
+    allowed: bool
+    retry_after: int = 0
+    reason: str = ''
+
+
+ALLOWED = Decision(True)
+
+
+def _cache():
+    return caches['ratelimit']
+
+
+def _incr(cache, key, delta, timeout):
+    """Atomic increment that creates the key when it is missing"""
+    try:
+        return cache.incr(key, delta)
+    except ValueError:
+        if cache.add(key, delta, timeout):
+            return delta
+        return cache.incr(key, delta)
+
+
+def take_token(user_id, plan, now=None):
+    """Take one token from the user's bucket, or say when to retry"""
+    rate, burst = plan.llm_searches_per_minute / 60.0, plan.llm_burst
+    if rate <= 0:
+        return ALLOWED
+    cache = _cache()
+    now = time.time() if now is None else now
+    start_key, taken_key = f'rl:{user_id}:{plan.code}:start', f'rl:{user_id}:{plan.code}:taken'
+    refill_time = math.ceil(burst / rate) + 1
+
+    cache.add(start_key, now, refill_time)
+    start = cache.get(start_key, now)
+    taken = _incr(cache, taken_key, 1, refill_time)
+
+    # Tokens still missing from the bucket after refilling since ``start``
+    debt = taken - rate * (now - start)
+    if debt > burst:
+        cache.decr(taken_key)
+        return Decision(False, max(1, math.ceil((debt - burst) / rate)), 'rate')
+
+    # Both keys expire once the debt has been paid back, i.e. the bucket is full
+    expires_in = max(1, math.ceil(debt / rate) + 1)
+    cache.touch(start_key, expires_in)
+    cache.touch(taken_key, expires_in)
+    return ALLOWED
+
+
+def billing_period(today=None):
+    """First day of the current billing period (calendar month, UTC)"""
+    today = today or datetime.now(dt_timezone.utc).date()
+    return today.replace(day=1)
+
+
+def _period_end(period):
+    next_month = date(period.year + period.month // 12, period.month % 12 + 1, 1)
+    return datetime.combine(next_month, dt_time.min, tzinfo=dt_timezone.utc)
+
+
+def _usage_key(user_id, period):
+    return f'llmq:{user_id}:{period:%Y%m}'
+
+
+def tokens_used(user_id, period=None):
+    """Tokens used this period: the cached counter, seeded from LLMUsage on a miss"""
+    period = period or billing_period()
+    cache = _cache()
+    key = _usage_key(user_id, period)
+    used = cache.get(key)
+    if used is None:
+        used = LLMUsage.objects.filter(user_id=user_id, period=period).values_list('tokens', flat=True).first() or 0
+        timeout = max(60, int((_period_end(period) - datetime.now(dt_timezone.utc)).total_seconds()) + 86400)
+        cache.add(key, used, timeout)
+        used = cache.get(key, used)
+    return used
+
+
+def check(user):
+    """Rate limit and quota check to run before an LLM call"""
+    if not user.is_authenticated:
+        return ALLOWED
+    plan = get_entitlement(user).effective_plan
+    if tokens_used(user.pk) >= plan.llm_tokens_per_month:
+        retry_after = (_period_end(billing_period()) - datetime.now(dt_timezone.utc)).total_seconds()
+        return Decision(False, max(1, math.ceil(retry_after)), 'quota')
+    return take_token(user.pk, plan)
+
+
+@contextmanager
+def billing(user_id):
+    """Charge LLM usage inside this block to the user with ``user_id``"""
+    token = _billed_user.set(user_id)
+    try:
+        yield
+    finally:
+        _billed_user.reset(token)
+
+
+def billed_user_id():
+    return _billed_user.get()
+
+
+def _total_tokens(usage):
+    if usage is None:
+        return 0
+    if isinstance(usage, dict):
+        return int(usage.get('total_tokens') or 0)
+    return int(getattr(usage, 'total_tokens', 0) or 0)
+
+
+def record_usage(usage, user_id=None, share=1.0):
+    """
+    Charge ``share`` of a completion's ``usage`` (or a token count) to a
+    user: the cache counter for quota checks and LLMUsage for the record.
+    """
+    user_id = user_id if user_id is not None else billed_user_id()
+    tokens = usage if isinstance(usage, int) else _total_tokens(usage)
+    tokens = math.ceil(tokens * share)
+    if user_id is None or tokens <= 0:
+        return 0
+
+    period = billing_period()
+    tokens_used(user_id, period)  # make sure the counter is seeded first
+    _incr(_cache(), _usage_key(user_id, period), tokens, None)
+
+    updated = LLMUsage.objects.filter(user_id=user_id, period=period).update(
+        tokens=F('tokens') + tokens,
+        requests=F('requests') + 1,
+    )
+    if not updated:
+        LLMUsage.objects.bulk_create([LLMUsage(user_id=user_id, period=period)], ignore_conflicts=True)
+        LLMUsage.objects.filter(user_id=user_id, period=period).update(
+            tokens=F('tokens') + tokens,
+            requests=F('requests') + 1,
+        )
+    return tokens
+
+
+def estimate_tokens(*texts):
+    """Rough token count (~4 characters each) for when no ``usage`` is reported"""
+    return math.ceil(sum(len(text or '') for text in texts) / 4)
@@ -0,0 +1,588 @@
+import asyncio
+import concurrent.futures
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+from pydantic import BaseModel, Field, ValidationError, field_validator
+
+from . import caching, quotas
+from .batching import AsyncMicroBatcher, MicroBatcher
+from .llm import LLMUnavailable, gateway
+from .models import QueryPopularity
+
+_PUNCTUATION_RE = re.compile(r'[^\w\s]+')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+MIN_YEAR, MAX_YEAR = 1870, 2100
+_IMDB_ID_RE = re.compile(r'^tt\d{7,10}$')
+# List markers only: "1. ", "2) ", "- " -- never digits that belong to the title
+_LIST_MARKER_RE = re.compile(r'^\s*(?:\d+[.)]|[-*\u2022])\s+')
+
+
+def normalize_query(text):
+    """Case-fold a query and collapse punctuation and whitespace"""
+    text = _PUNCTUATION_RE.sub(' ', (text or '').casefold())
+    return _WHITESPACE_RE.sub(' ', text).strip()
+
+
+def cache_key(query, genre=''):
+    """Cache key for a normalized query + genre pair"""
+    raw = f'{normalize_query(query)}|{normalize_query(genre)}'
+    return caching.RECOMMENDATIONS.key(hashlib.sha1(raw.encode('utf-8')).hexdigest())
+
+
+class Recommendation(BaseModel):
+    """One recommended movie as returned by the LLM"""
+    title: str = Field(min_length=1, max_length=255)
+    year: Optional[int] = None
+    imdb_id: Optional[str] = None
+
+    @field_validator('title')
+    @classmethod
+    def _strip_title(cls, value):
+        value = value.strip()
+        if not value:
+            raise ValueError('empty title')
+        return value
+
+    @field_validator('year', mode='before')
+    @classmethod
+    def _plausible_year(cls, value):
+        # A bad optional field shouldn't cost us the whole recommendation
+        try:
+            value = int(value)
+        except (TypeError, ValueError):
+            return None
+        return value if MIN_YEAR <= value <= MAX_YEAR else None
+
+    @field_validator('imdb_id', mode='before')
+    @classmethod
+    def _valid_imdb_id(cls, value):
+        value = value.strip() if isinstance(value, str) else ''
+        return value if _IMDB_ID_RE.match(value) else None
+
+
+RESPONSE_FORMAT = (
+    '{"movies": [{"title": "Movie title", "year": 1999, "imdb_id": "tt0133093"}, ...]}'
+)
+ITEM_FORMAT = '{"title": "Movie title", "year": 1999, "imdb_id": "tt0133093"}'
+
+
+def build_prompt(query, genre=''):
+    """Build the recommendation prompt sent to the LLM"""
+    prompt = f"Recommend 10 movies based on: {query}"
+    if genre:
+        prompt += f" in the {genre} genre"
+    prompt += (
+        f". Respond with a JSON object of the form {RESPONSE_FORMAT}. "
+        "Include the release year, and the IMDb id only when you are certain of it."
+    )
+    return prompt
+
+
+def build_stream_prompt(query, genre=''):
+    """Like build_prompt, but one JSON object per line so results can be parsed as they stream"""
+    prompt = f"Recommend 10 movies based on: {query}"
+    if genre:
+        prompt += f" in the {genre} genre"
+    prompt += (
+        f". Output exactly one JSON object per line, each of the form {ITEM_FORMAT}, and nothing else. "
+        "Include the release year, and the IMDb id only when you are certain of it."
+    )
+    return prompt
+
+
+def _validate(items):
+    """Recommendation dicts for the valid entries of a decoded JSON list"""
+    if not isinstance(items, list):
+        return None
+    recommendations = []
+    for item in items:
+        if isinstance(item, str):
+            item = {'title': item}
+        try:
+            recommendations.append(Recommendation.model_validate(item).model_dump())
+        except ValidationError:
+            continue
+    return recommendations
+
+
+def parse_title_line(line):
+    """A plain "1. Title" line as a recommendation dict, or None"""
+    title = _LIST_MARKER_RE.sub('', line).strip()
+    return {'title': title, 'year': None, 'imdb_id': None} if title else None
+
+
+def parse_recommendation_line(line):
+    """One streamed line: a JSON object, or a plain title line as a fallback"""
+    line = line.strip().rstrip(',')
+    if not line or line in ('[', ']', '```', '```json'):
+        return None
+    if line.startswith('{'):
+        try:
+            recommendations = _validate([json.loads(line)])
+        except ValueError:
+            recommendations = None
+        return recommendations[0] if recommendations else None
+    return parse_title_line(line)
+
+
+def parse_recommendations(content):
+    """
+    Validated recommendation dicts (title, year, imdb_id) from a completion.
+
+    Expects ``{"movies": [...]}``; a bare JSON list is accepted too, and
+    anything that isn't JSON is read as one title per line.
+    """
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return [rec for rec in map(parse_title_line, (content or '').splitlines()) if rec]
+    if isinstance(data, dict):
+        data = data.get('movies')
+    return _validate(data) or []
+
+
+def build_messages(query, genre='', stream=False):
+    """Chat messages for a recommendation request"""
+    prompt = build_stream_prompt(query, genre) if stream else build_prompt(query, genre)
+    return [
+        {"role": "system", "content": "You are a movie recommendation assistant. You reply with JSON only."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def build_batch_messages(queries):
+    """Chat messages asking for recommendations for several (query, genre) pairs at once"""
+    lines = []
+    for number, (query, genre) in enumerate(queries, 1):
+        lines.append(f'{number}. {query}' + (f' (genre: {genre})' if genre else ''))
+    prompt = (
+        "Recommend 10 movies for each of the following numbered requests.\n"
+        + '\n'.join(lines)
+        + '\n\nRespond with a JSON object mapping each request number (as a string) '
+        f'to a list of movies, for example {{"1": [{ITEM_FORMAT}, ...], "2": [...]}}. '
+        'Include the release year, and the IMDb id only when you are certain of it.'
+    )
+    return [
+        {"role": "system", "content": "You are a movie recommendation assistant. You reply with JSON only."},
+        {"role": "user", "content": prompt}
+    ]
+
+
+def parse_batch(content, count):
+    """Recommendation lists for requests 1..count from a batch completion (None where missing or malformed)"""
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return [None] * count
+    if not isinstance(data, dict):
+        return [None] * count
+    return [_validate(data.get(str(number))) for number in range(1, count + 1)]
+
+
+def _usable(recommendations):
+    """The parsed recommendations; an empty or garbled reply counts as the LLM being unavailable"""
+    if not recommendations:
+        raise LLMUnavailable('LLM reply had no usable recommendations')
+    return recommendations
+
+
+def request_recommendations(query, genre=''):
+    """Ask the LLM for movie recommendations (uncached)"""
+    response = gateway.chat(build_messages(query, genre), response_format={'type': 'json_object'})
+    quotas.record_usage(response.usage)
+    return _usable(parse_recommendations(response.choices[0].message.content))
+
+
+def stream_recommendations(query, genre='', user_id=None):
+    """
+    Yield recommendation dicts as the completion streams in, one per
+    finished line.
+
+    Cached results are replayed immediately; a fresh stream stores the full
+    list in the recommendation cache once it completes, and charges its
+    tokens to ``user_id``.
+    """
+    key = cache_key(query, genre)
+    cached = recommendation_cache.get(key)
+    recommendation_cache.namespace.record(cached is not None)
+    if cached is not None:
+        yield from cached
+        return
+
+    messages = build_messages(query, genre, stream=True)
+    recommendations = []
+    content = ''
+    usage = None
+    buffer = ''
+    stream = gateway.stream_chat(messages, extra_body={'stream_options': {'include_usage': True}})
+    for chunk in stream:
+        # With include_usage the last chunk has no choices, only the usage
+        usage = getattr(chunk, 'usage', None) or usage
+        if not chunk.choices:
+            continue
+        piece = chunk.choices[0].delta.content or ''
+        content += piece
+        buffer += piece
+        *lines, buffer = buffer.split('\n')
+        for line in lines:
+            recommendation = parse_recommendation_line(line)
+            if recommendation:
+                recommendations.append(recommendation)
+                yield recommendation
+    recommendation = parse_recommendation_line(buffer)
+    if recommendation:
+        recommendations.append(recommendation)
+        yield recommendation
+
+    if usage is None:
+        # Providers that ignore stream_options: charge an estimate instead
+        usage = quotas.estimate_tokens(*(message['content'] for message in messages), content)
+    quotas.record_usage(usage, user_id)
+    # Never cache an empty reply; the caller falls back to local search
+    _usable(recommendations)
+    recommendation_cache.set(key, recommendations)
+
+
+def _request_for(user_id, query, genre):
+    with quotas.billing(user_id):
+        return request_recommendations(query, genre)
+
+
+def _retry_for(user_id, query, genre):
+    """A left-out batch request asked on its own; its failure goes to that caller only"""
+    try:
+        return _request_for(user_id, query, genre)
+    except LLMUnavailable as exc:
+        return exc
+
+
+def _record_batch_usage(usage, items):
+    for _, _, user_id in items:
+        quotas.record_usage(usage, user_id, share=1 / len(items))
+
+
+def request_recommendations_batch(items):
+    """
+    Recommendations for several (query, genre, user_id) requests from one
+    completion, whose tokens are split evenly between the users. Requests
+    the model left out or garbled are asked for individually, and those
+    that still get nothing usable come back as LLMUnavailable instances.
+    """
+    try:
+        if len(items) == 1:
+            query, genre, user_id = items[0]
+            return [_request_for(user_id, query, genre)]
+        queries = [(query, genre) for query, genre, _ in items]
+        response = gateway.chat(build_batch_messages(queries), response_format={'type': 'json_object'})
+        _record_batch_usage(response.usage, items)
+        results = parse_batch(response.choices[0].message.content, len(items))
+        return [
+            recommendations if recommendations else _retry_for(user_id, query, genre)
+            for recommendations, (query, genre, user_id) in zip(results, items)
+        ]
+    finally:
+        # Runs on a batcher worker thread, outside any request cycle
+        close_old_connections()
+
+
+async def _arequest_for(user_id, query, genre):
+    with quotas.billing(user_id):
+        return await arequest_recommendations(query, genre)
+
+
+async def arequest_recommendations_batch(items):
+    """Async variant of request_recommendations_batch, on the async client"""
+    if len(items) == 1:
+        query, genre, user_id = items[0]
+        return [await _arequest_for(user_id, query, genre)]
+    queries = [(query, genre) for query, genre, _ in items]
+    response = await gateway.achat(build_batch_messages(queries), response_format={'type': 'json_object'})
+    await sync_to_async(_record_batch_usage)(response.usage, items)
+    results = parse_batch(response.choices[0].message.content, len(items))
+    retries = {
+        index: _arequest_for(user_id, query, genre)
+        for index, (recommendations, (query, genre, user_id)) in enumerate(zip(results, items))
+        if not recommendations
+    }
+    retried = await asyncio.gather(*retries.values(), return_exceptions=True)
+    for index, recommendations in zip(retries, retried):
+        results[index] = recommendations
+    return results
+
+
+# Sync views batch across request threads through the sync client; the
+# async search view (ASYNC_SEARCH, under ASGI) batches on its event loop
+# through the async client
+batcher = MicroBatcher(
+    request_recommendations_batch,
+    window=settings.LLM_BATCH_WINDOW,
+    max_size=settings.LLM_BATCH_MAX_SIZE,
+    workers=settings.LLM_MAX_CONCURRENCY,
+    name='llm-batcher',
+)
+async_batcher = AsyncMicroBatcher(
+    arequest_recommendations_batch,
+    window=settings.LLM_BATCH_WINDOW,
+    max_size=settings.LLM_BATCH_MAX_SIZE,
+    name='llm-async-batcher',
+)
+
+
+def _batch_timeout():
+    return settings.LLM_BATCH_WINDOW + settings.LLM_TOTAL_TIMEOUT * 2
+
+
+def batched_request_recommendations(query, genre=''):
+    """request_recommendations through the micro-batcher (or directly when batching is off)"""
+    if settings.LLM_BATCH_WINDOW <= 0 or settings.LLM_BATCH_MAX_SIZE <= 1:
+        return request_recommendations(query, genre)
+    future = batcher.submit((query, genre, quotas.billed_user_id()))
+    try:
+        return future.result(timeout=_batch_timeout())
+    except concurrent.futures.TimeoutError:
+        # Still queued: don't let the batcher send (and bill) it after all
+        future.cancel()
+        raise LLMUnavailable('timed out waiting for a batched LLM request')
+
+
+async def abatched_request_recommendations(query, genre=''):
+    """Async variant of batched_request_recommendations, batching on the running event loop"""
+    if settings.LLM_BATCH_WINDOW <= 0 or settings.LLM_BATCH_MAX_SIZE <= 1:
+        return await arequest_recommendations(query, genre)
+    try:
+        return await asyncio.wait_for(
+            async_batcher.submit((query, genre, quotas.billed_user_id())), _batch_timeout(),
+        )
+    except asyncio.TimeoutError:
+        raise LLMUnavailable('timed out waiting for a batched LLM request')
+
+
+async def arequest_recommendations(query, genre=''):
+    """Async variant of request_recommendations"""
+    response = await gateway.achat(build_messages(query, genre), response_format={'type': 'json_object'})
+    await sync_to_async(quotas.record_usage)(response.usage)
+    return _usable(parse_recommendations(response.choices[0].message.content))
+
+
+class RecommendationCache:
+    """
+    Two-tier cache of LLM recommendations.
+
+    A small in-process LRU sits in front of a shared Django cache alias
+    (the ``recommendations`` namespace, which sets the TTL) so
+    hot queries never leave the worker, while every gunicorn worker still
+    sees results computed by the others. Misses are single-flighted: within
+    a process through a per-key lock, across processes through a short-lived
+    ``cache.add`` lock that other workers wait on instead of calling the LLM.
+    """
+
+    def __init__(self, namespace=caching.RECOMMENDATIONS, timeout=None, max_entries=None,
+                 lock_timeout=None):
+        self.namespace = namespace
+        self.alias = namespace.alias
+        self.timeout = timeout if timeout is not None else namespace.timeout
+        self.max_entries = max_entries if max_entries is not None else settings.RECOMMENDATION_CACHE_LOCAL_ENTRIES
+        self.lock_timeout = lock_timeout if lock_timeout is not None else settings.RECOMMENDATION_CACHE_LOCK_TIMEOUT
+        self._local = OrderedDict()
+        self._local_lock = threading.Lock()
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._ainflight = {}
+
+    @property
+    def shared(self):
+        return caches[self.alias]
+
+    def _get_local(self, key):
+        with self._local_lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return value
+
+    def _set_local(self, key, value):
+        with self._local_lock:
+            self._local[key] = (time.monotonic() + self.timeout, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self.max_entries:
+                self._local.popitem(last=False)
+
+    def get(self, key):
+        value = self._get_local(key)
+        if value is None:
+            value = self.shared.get(key)
+            if value is not None:
+                self._set_local(key, value)
+        return value
+
+    def set(self, key, value):
+        self.shared.set(key, value, self.timeout)
+        self._set_local(key, value)
+
+    def clear(self):
+        with self._local_lock:
+            self._local.clear()
+        self.shared.clear()
+
+    def _wait_for_peer(self, key):
+        """Poll the shared cache while another worker computes ``key``"""
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            value = self.shared.get(key)
+            if value is not None:
+                return value
+            time.sleep(0.05)
+        return None
+
+    def get_or_compute(self, key, compute):
+        value = self.get(key)
+        self.namespace.record(value is not None)
+        if value is not None:
+            return value
+
+        with self._inflight_lock:
+            key_lock = self._inflight.setdefault(key, threading.Lock())
+
+        with key_lock:
+            # Another thread may have filled the cache while we waited
+            value = self.get(key)
+            if value is not None:
+                return value
+
+            lock_key = f'{key}:lock'
+            if not self.shared.add(lock_key, 1, self.lock_timeout):
+                value = self._wait_for_peer(key)
+                if value is not None:
+                    self._set_local(key, value)
+                    return value
+            try:
+                value = compute()
+                # Empty results are not cached, so the next search asks again
+                if value:
+                    self.set(key, value)
+                return value
+            finally:
+                self.shared.delete(lock_key)
+                with self._inflight_lock:
+                    self._inflight.pop(key, None)
+
+    async def aget(self, key):
+        value = self._get_local(key)
+        if value is None:
+            value = await self.shared.aget(key)
+            if value is not None:
+                self._set_local(key, value)
+        return value
+
+    async def aset(self, key, value):
+        await self.shared.aset(key, value, self.timeout)
+        self._set_local(key, value)
+
+    async def _await_peer(self, key):
+        deadline = time.monotonic() + self.lock_timeout
+        while time.monotonic() < deadline:
+            value = await self.shared.aget(key)
+            if value is not None:
+                return value
+            await asyncio.sleep(0.05)
+        return None
+
+    async def _acompute(self, key, compute):
+        lock_key = f'{key}:lock'
+        if not await self.shared.aadd(lock_key, 1, self.lock_timeout):
+            value = await self._await_peer(key)
+            if value is not None:
+                self._set_local(key, value)
+                return value
+        try:
+            value = await compute()
+            if value:
+                await self.aset(key, value)
+            return value
+        finally:
+            await self.shared.adelete(lock_key)
+
+    async def aget_or_compute(self, key, compute):
+        """
+        Async counterpart of get_or_compute. Coroutines in the same event
+        loop share one in-flight future per key instead of a thread lock.
+        """
+        value = await self.aget(key)
+        self.namespace.record(value is not None)
+        if value is not None:
+            return value
+
+        inflight_key = (id(asyncio.get_running_loop()), key)
+        future = self._ainflight.get(inflight_key)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._ainflight[inflight_key] = future
+        try:
+            value = await self._acompute(key, compute)
+            future.set_result(value)
+            return value
+        except BaseException as exc:
+            future.set_exception(exc)
+            future.exception()  # waiters re-raise it; don't log it as unretrieved
+            raise
+        finally:
+            self._ainflight.pop(inflight_key, None)
+
+
+recommendation_cache = RecommendationCache()
+
+
+def is_cached(query, genre=''):
+    """Whether recommendations for this query can be served without calling the LLM"""
+    return recommendation_cache.get(cache_key(query, genre)) is not None
+
+
+def get_recommendations(query, genre=''):
+    """Return LLM recommendations (title, year, imdb_id dicts), served from cache when possible"""
+    return recommendation_cache.get_or_compute(
+        cache_key(query, genre),
+        lambda: batched_request_recommendations(query, genre),
+    )
+
+
+async def aget_recommendations(query, genre=''):
+    """Async variant of get_recommendations"""
+    return await recommendation_cache.aget_or_compute(
+        cache_key(query, genre),
+        lambda: abatched_request_recommendations(query, genre),
+    )
+
+
+def warm_cache(limit):
+    """Fetch recommendations for the ``limit`` most popular queries not in the cache"""
+    if not gateway.available:
+        return 0
+    warmed = 0
+    popular = QueryPopularity.objects.order_by('-score').values_list('normalized_query', 'genre')[:limit]
+    for query, genre in popular:
+        if is_cached(query, genre):
+            continue
+        try:
+            get_recommendations(query, genre)
+        except LLMUnavailable:
+            break
+        warmed += 1
+    return warmed
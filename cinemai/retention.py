@@ -0,0 +1,125 @@
+"""
+SearchHistory rollups and retention.
+
+``rollup_search_history`` folds raw rows into ``SearchRollup`` (one row per
+day, genre and normalized query), walking the table in ``(created_at, id)``
+order from a stored checkpoint so every raw row is counted exactly once.
+Ids and creation times don't follow commit order -- a buffered flush that
+is still open commits rows older (and, on Postgres, with lower ids) than
+ones already visible -- so the walk stops at rows
+``SEARCH_HISTORY_ROLLUP_LAG`` seconds old, by which time every write with
+an earlier ``created_at`` has committed.
+``prune_search_history`` then deletes raw rows older than the retention
+window, but only ones the rollup has already covered. Both work in bounded
+batches so neither holds long locks; run them from
+``manage.py prune_search_history`` on a schedule.
+"""
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import RetentionCheckpoint, SearchHistory, SearchRollup
+from .recommendations import normalize_query
+
+CHECKPOINT = 'search_rollup'
+
+
+def _checkpoint(lock=False):
+    checkpoint, _ = RetentionCheckpoint.objects.get_or_create(name=CHECKPOINT)
+    if lock:
+        checkpoint = RetentionCheckpoint.objects.select_for_update().get(pk=checkpoint.pk)
+    return checkpoint
+
+
+def _covered(checkpoint):
+    """Raw rows at or before the checkpoint in (created_at, id) order"""
+    if checkpoint.last_created_at is None:
+        return Q(pk__in=[])
+    return Q(created_at__lt=checkpoint.last_created_at) | Q(
+        created_at=checkpoint.last_created_at, id__lte=checkpoint.last_id,
+    )
+
+
+def _rollup_batch(batch_size, until):
+    """Fold the next batch of raw rows created before ``until`` into the rollups; returns rows read"""
+    with transaction.atomic():
+        checkpoint = _checkpoint(lock=True)
+        rows = list(
+            SearchHistory.objects
+            .filter(created_at__lt=until)
+            .exclude(_covered(checkpoint))
+            .order_by('created_at', 'id')
+            .values_list('id', 'created_at', 'genre', 'query')[:batch_size]
+        )
+        if not rows:
+            return 0
+
+        counts = Counter(
+            (timezone.localdate(created_at), genre, normalize_query(query)[:255])
+            for _, created_at, genre, query in rows
+        )
+        days = {day for day, _, _ in counts}
+        existing = {
+            (rollup.day, rollup.genre, rollup.normalized_query): rollup
+            for rollup in SearchRollup.objects.filter(
+                day__in=days,
+                normalized_query__in={query for _, _, query in counts},
+            )
+        }
+
+        to_update, to_create = [], []
+        for key, count in counts.items():
+            rollup = existing.get(key)
+            if rollup is not None:
+                rollup.count += count
+                to_update.append(rollup)
+            else:
+                day, genre, query = key
+                to_create.append(SearchRollup(day=day, genre=genre, normalized_query=query, count=count))
+        SearchRollup.objects.bulk_update(to_update, ['count'])
+        SearchRollup.objects.bulk_create(to_create)
+
+        checkpoint.last_id, checkpoint.last_created_at = rows[-1][:2]
+        checkpoint.save(update_fields=['last_created_at', 'last_id', 'updated_at'])
+        return len(rows)
+
+
+def rollup_search_history(batch_size=None, max_batches=None):
+    """Roll up the raw rows added since the last run, up to the lag; returns rows read"""
+    batch_size = batch_size or settings.SEARCH_HISTORY_RETENTION_BATCH_SIZE
+    until = timezone.now() - timedelta(seconds=settings.SEARCH_HISTORY_ROLLUP_LAG)
+    total = batches = 0
+    while max_batches is None or batches < max_batches:
+        rows = _rollup_batch(batch_size, until)
+        if not rows:
+            break
+        total += rows
+        batches += 1
+    return total
+
+
+def prune_search_history(days=None, batch_size=None, max_batches=None):
+    """Delete rolled-up raw rows older than ``days``; returns rows deleted"""
+    days = days if days is not None else settings.SEARCH_HISTORY_RETENTION_DAYS
+    batch_size = batch_size or settings.SEARCH_HISTORY_RETENTION_BATCH_SIZE
+    cutoff = timezone.now() - timedelta(days=days)
+    covered = _covered(_checkpoint())
+
+    total = batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = list(
+            SearchHistory.objects
+            .filter(covered, created_at__lt=cutoff)
+            .order_by('created_at')
+            .values_list('id', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        deleted, _ = SearchHistory.objects.filter(id__in=ids).delete()
+        total += deleted
+        batches += 1
+    return total
@@ -0,0 +1,194 @@
+"""
+Full-text movie search.
+
+Each backend returns a lazy, ranked result set that supports ``count()`` and
+slicing, so it can be handed straight to Django's ``Paginator``. The index
+itself lives in the database (see migration 0002) and is maintained there:
+SQLite uses an FTS5 external-content table kept current by triggers, and
+Postgres uses a GIN expression index over the weighted ``tsvector`` below.
+
+SQLite drops a table's triggers whenever a migration rebuilds it, as any
+AlterField or defaulted AddField on Movie does, so ``restore_fts_triggers``
+puts missing ones back after every ``migrate``.
+"""
+import re
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections
+from django.utils.module_loading import import_string
+
+from .models import Movie
+
+FTS_TABLE = 'cinemai_movie_fts'
+
+# Weighted document for Postgres; must match the GIN index in migration 0002
+PG_DOCUMENT = (
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(director, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(genre, '')), 'B') || "
+    "setweight(to_tsvector('english', coalesce(plot, '')), 'C')"
+)
+
+# Triggers that keep the FTS5 table in sync with cinemai_movie (as in migration 0002)
+SQLITE_TRIGGERS = {
+    'cinemai_movie_fts_ai': f"""CREATE TRIGGER cinemai_movie_fts_ai AFTER INSERT ON cinemai_movie BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, title, director, genre, plot)
+        VALUES (new.id, new.title, new.director, new.genre, new.plot);
+    END""",
+    'cinemai_movie_fts_ad': f"""CREATE TRIGGER cinemai_movie_fts_ad AFTER DELETE ON cinemai_movie BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, director, genre, plot)
+        VALUES ('delete', old.id, old.title, old.director, old.genre, old.plot);
+    END""",
+    'cinemai_movie_fts_au': f"""CREATE TRIGGER cinemai_movie_fts_au AFTER UPDATE ON cinemai_movie BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, director, genre, plot)
+        VALUES ('delete', old.id, old.title, old.director, old.genre, old.plot);
+        INSERT INTO {FTS_TABLE}(rowid, title, director, genre, plot)
+        VALUES (new.id, new.title, new.director, new.genre, new.plot);
+    END""",
+}
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    """Split user input into plain word tokens (drops query syntax)"""
+    return _TOKEN_RE.findall((text or '').lower())
+
+
+class RankedResults:
+    """Lazy ranked id query that loads Movie rows one page at a time"""
+
+    def __init__(self, count_sql, count_params, ids_sql, ids_params):
+        self.count_sql = count_sql
+        self.count_params = count_params
+        self.ids_sql = ids_sql
+        self.ids_params = ids_params
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            with connection.cursor() as cursor:
+                cursor.execute(self.count_sql, self.count_params)
+                self._count = cursor.fetchone()[0]
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self[key:key + 1][0]
+        start = key.start or 0
+        stop = key.stop if key.stop is not None else self.count()
+        if stop <= start:
+            return []
+        with connection.cursor() as cursor:
+            cursor.execute(self.ids_sql + ' LIMIT %s OFFSET %s', [*self.ids_params, stop - start, start])
+            ids = [row[0] for row in cursor.fetchall()]
+        movies = Movie.objects.in_bulk(ids)
+        return [movies[pk] for pk in ids if pk in movies]
+
+    def __iter__(self):
+        return iter(self[:])
+
+
+class IContainsSearchBackend:
+    """Unindexed LIKE search; used when no full-text index is available"""
+
+    def search(self, query, genre=''):
+        movies = Movie.objects.filter(title__icontains=query)
+        if genre:
+            movies = movies.filter(genre__icontains=genre)
+        return movies
+
+
+class SQLiteFTSSearchBackend:
+    """SQLite FTS5 search ranked with bm25 (title weighted highest)"""
+
+    # bm25 column weights: title, director, genre, plot
+    weights = (10.0, 4.0, 4.0, 1.0)
+
+    def match_expression(self, query, genre=''):
+        terms = [f'"{token}"*' for token in tokenize(query)]
+        terms += [f'genre : "{token}"*' for token in tokenize(genre)]
+        return ' AND '.join(terms)
+
+    def search(self, query, genre=''):
+        expression = self.match_expression(query, genre)
+        if not expression:
+            return Movie.objects.all()
+        weights = ', '.join(str(weight) for weight in self.weights)
+        return RankedResults(
+            f'SELECT COUNT(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+            [expression],
+            f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s '
+            f'ORDER BY bm25({FTS_TABLE}, {weights}), rowid DESC',
+            [expression],
+        )
+
+
+class PostgresSearchBackend:
+    """Postgres tsvector search served by the GIN expression index"""
+
+    def tsquery(self, query):
+        return ' & '.join(f'{token}:*' for token in tokenize(query))
+
+    def search(self, query, genre=''):
+        tsquery = self.tsquery(query)
+        if not tsquery:
+            movies = Movie.objects.all()
+            return movies.filter(genre__icontains=genre) if genre else movies
+        where = f"({PG_DOCUMENT}) @@ to_tsquery('english', %s)"
+        params = [tsquery]
+        if genre:
+            where += ' AND genre ILIKE %s'
+            params.append(f'%{genre}%')
+        return RankedResults(
+            f'SELECT COUNT(*) FROM cinemai_movie WHERE {where}',
+            params,
+            f"SELECT id FROM cinemai_movie WHERE {where} "
+            f"ORDER BY ts_rank({PG_DOCUMENT}, to_tsquery('english', %s)) DESC, id DESC",
+            params + [tsquery],
+        )
+
+
+def get_search_backend():
+    """Return the configured backend, or the best one for the database"""
+    if settings.MOVIE_SEARCH_BACKEND:
+        return import_string(settings.MOVIE_SEARCH_BACKEND)()
+    if connection.vendor == 'sqlite':
+        return SQLiteFTSSearchBackend()
+    if connection.vendor == 'postgresql':
+        return PostgresSearchBackend()
+    return IContainsSearchBackend()
+
+
+def search_movies(query, genre=''):
+    """Ranked full-text search over title, director, genre and plot"""
+    return get_search_backend().search(query, genre)
+
+
+def restore_fts_triggers(using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    post_migrate receiver: recreate the SQLite FTS triggers a table rebuild
+    dropped and reindex what was written without them. Returns the names
+    of the triggers it created.
+    """
+    db = connections[using]
+    if db.vendor != 'sqlite':
+        return []
+    with db.cursor() as cursor:
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger') AND tbl_name IN (%s, %s)",
+            [FTS_TABLE, Movie._meta.db_table],
+        )
+        existing = {name for (name,) in cursor.fetchall()}
+        if FTS_TABLE not in existing:
+            # Migrated back to before the index existed
+            return []
+        missing = [name for name in SQLITE_TRIGGERS if name not in existing]
+        for name in missing:
+            cursor.execute(SQLITE_TRIGGERS[name])
+        if missing:
+            cursor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    return missing
@@ -0,0 +1,163 @@
+"""
+Locally generated Stripe webhook events for tests and local dev.
+
+Builds event payloads shaped like Stripe's (only the fields we read) and
+signs them the way Stripe does, so they pass ``stripe.Webhook``
+verification with ``STRIPE_WEBHOOK_SECRET``::
+
+    event = subscription_updated('cus_123', 'sub_123', tier='PRO')
+    payload, signature = sign(event, settings.STRIPE_WEBHOOK_SECRET)
+    client.post('/webhook/stripe/', payload, content_type='application/json',
+                HTTP_STRIPE_SIGNATURE=signature)
+
+``python -m cinemai.stripe_fixtures --url ... --secret ...`` posts a burst
+of events (with redeliveries, out of order) to a running server.
+"""
+import argparse
+import hashlib
+import hmac
+import json
+import random
+import time
+import uuid
+
+import requests
+
+
+def _id(prefix):
+    return f'{prefix}_{uuid.uuid4().hex[:24]}'
+
+
+def event(type, obj, created=None, event_id=None):
+    """A Stripe event envelope around ``obj``"""
+    return {
+        'id': event_id or _id('evt'),
+        'object': 'event',
+        'api_version': '2023-10-16',
+        'created': int(created if created is not None else time.time()),
+        'type': type,
+        'livemode': False,
+        'pending_webhooks': 1,
+        'data': {'object': obj},
+    }
+
+
+def checkout_completed(user_id, tier='BASIC', customer=None, subscription=None, created=None):
+    return event('checkout.session.completed', {
+        'id': _id('cs_test'),
+        'object': 'checkout.session',
+        'mode': 'subscription',
+        'status': 'complete',
+        'client_reference_id': str(user_id),
+        'customer': customer or _id('cus'),
+        'subscription': subscription or _id('sub'),
+        'metadata': {'tier': tier},
+    }, created)
+
+
+def subscription(customer, subscription_id=None, status='active', tier=None, period_end=None,
+                 cancel_at=None, canceled_at=None, ended_at=None, user_id=None):
+    now = int(time.time())
+    return {
+        'id': subscription_id or _id('sub'),
+        'object': 'subscription',
+        'customer': customer,
+        'status': status,
+        'current_period_start': now,
+        'current_period_end': period_end or now + 30 * 86400,
+        'cancel_at': cancel_at,
+        'canceled_at': canceled_at,
+        'ended_at': ended_at,
+        'metadata': {
+            **({'tier': tier} if tier else {}),
+            **({'user_id': str(user_id)} if user_id is not None else {}),
+        },
+        'items': {'object': 'list', 'data': []},
+    }
+
+
+def subscription_created(customer, subscription_id=None, status='active', tier=None, created=None, **fields):
+    return event('customer.subscription.created',
+                 subscription(customer, subscription_id, status, tier, **fields), created)
+
+
+def subscription_updated(customer, subscription_id=None, status='active', tier=None, created=None, **fields):
+    return event('customer.subscription.updated',
+                 subscription(customer, subscription_id, status, tier, **fields), created)
+
+
+def subscription_deleted(customer, subscription_id=None, created=None, **fields):
+    fields.setdefault('ended_at', int(created if created is not None else time.time()))
+    return event('customer.subscription.deleted',
+                 subscription(customer, subscription_id, 'canceled', **fields), created)
+
+
+def invoice_paid(customer, subscription_id=None, created=None):
+    """An event we store but don't act on"""
+    return event('invoice.paid', {
+        'id': _id('in'),
+        'object': 'invoice',
+        'customer': customer,
+        'subscription': subscription_id,
+        'status': 'paid',
+    }, created)
+
+
+def sign(event, secret, timestamp=None):
+    """(payload bytes, Stripe-Signature header) for ``event``"""
+    payload = json.dumps(event).encode('utf-8')
+    timestamp = int(timestamp if timestamp is not None else time.time())
+    signature = hmac.new(secret.encode('utf-8'), f'{timestamp}.'.encode('utf-8') + payload, hashlib.sha256).hexdigest()
+    return payload, f't={timestamp},v1={signature}'
+
+
+def lifecycle(user_id, customer=None, subscription_id=None, start=None):
+    """
+    Subscription creation, checkout, a renewal, an upgrade and a
+    cancellation for one user, oldest first. As with Stripe, the
+    subscription is created before checkout completes.
+    """
+    customer = customer or _id('cus')
+    subscription_id = subscription_id or _id('sub')
+    start = int(start if start is not None else time.time()) - 3600
+    return [
+        subscription_created(customer, subscription_id, tier='BASIC', user_id=user_id, created=start - 1),
+        checkout_completed(user_id, 'BASIC', customer, subscription_id, created=start),
+        invoice_paid(customer, subscription_id, created=start + 1),
+        subscription_updated(customer, subscription_id, tier='BASIC', user_id=user_id, created=start + 60),
+        subscription_updated(customer, subscription_id, tier='PRO', user_id=user_id, created=start + 120),
+        subscription_deleted(customer, subscription_id, user_id=user_id, created=start + 180),
+    ]
+
+
+def burst(user_ids, redeliveries=0.3, shuffle=True, seed=None):
+    """Lifecycle events for several users, partly redelivered and out of order"""
+    rng = random.Random(seed)
+    events = [item for user_id in user_ids for item in lifecycle(user_id)]
+    events += [item for item in events if rng.random() < redeliveries]
+    if shuffle:
+        rng.shuffle(events)
+    return events
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--url', default='http://127.0.0.1:8000/webhook/stripe/')
+    parser.add_argument('--secret', required=True, help='STRIPE_WEBHOOK_SECRET of the server')
+    parser.add_argument('--users', type=int, nargs='+', required=True, help='User ids to generate events for')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+
+    with requests.Session() as session:
+        for item in burst(args.users, seed=args.seed):
+            payload, signature = sign(item, args.secret)
+            started = time.monotonic()
+            response = session.post(args.url, data=payload, timeout=10, headers={
+                'Content-Type': 'application/json',
+                'Stripe-Signature': signature,
+            })
+            print(f'{item["type"]:<32} {response.status_code} {(time.monotonic() - started) * 1000:.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
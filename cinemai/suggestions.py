@@ -0,0 +1,200 @@
+"""
+Popular searches and typeahead suggestions.
+
+``record_searches`` folds a batch of search events into ``QueryPopularity``
+with forward-decayed scores; the history writer calls it on every flush, so
+the raw SearchHistory table is never scanned. Weights are measured from a
+stored landmark, and once searches get ``RESCALE_AFTER`` half-lives past it
+every score is scaled down and the landmark moves forward, so weights stay
+finite however long the counters run. Each worker keeps a
+``SuggestionIndex`` -- a prefix trie whose nodes hold their precomputed
+top-k completions -- built from the highest-scoring rows and rebuilt in the
+background every ``SUGGESTIONS_REFRESH_INTERVAL`` seconds, so a lookup is a
+walk of ``len(prefix)`` dict hops.
+"""
+import heapq
+import math
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import DecayLandmark, QueryPopularity
+from .recommendations import normalize_query
+
+# Initial landmark for forward decay
+DECAY_EPOCH = datetime(2026, 1, 1, tzinfo=dt_timezone.utc)
+LANDMARK = 'query_popularity'
+# Half-lives past the landmark before scores are rescaled; keeps each
+# weight below 2 ** 64, far from float overflow
+RESCALE_AFTER = 64
+
+
+def _half_life():
+    return settings.POPULARITY_HALF_LIFE_HOURS * 3600
+
+
+def decay_weight(when, landmark=DECAY_EPOCH):
+    """Weight of one search at ``when``: doubles every half-life after ``landmark``"""
+    return math.pow(2.0, (when - landmark).total_seconds() / _half_life())
+
+
+def _landmark(newest):
+    """
+    Lock and return the landmark, first moving it to ``newest`` (and
+    scaling every score down to match) when ``newest`` is too far past it.
+    """
+    landmark, _ = DecayLandmark.objects.get_or_create(name=LANDMARK, defaults={'at': DECAY_EPOCH})
+    landmark = DecayLandmark.objects.select_for_update().get(pk=landmark.pk)
+    half_lives = (newest - landmark.at).total_seconds() / _half_life()
+    if half_lives > RESCALE_AFTER:
+        QueryPopularity.objects.update(score=F('score') * math.pow(2.0, -half_lives))
+        landmark.at = newest
+        landmark.save(update_fields=['at'])
+    return landmark.at
+
+
+def record_searches(events):
+    """Add SearchHistory-like events (query, genre, created_at) to the counters"""
+    searched_at = defaultdict(list)
+    for event in events:
+        query = normalize_query(event.query)[:255]
+        if query:
+            searched_at[query, event.genre].append(event.created_at)
+    if not searched_at:
+        return
+
+    with transaction.atomic():
+        # Held until commit, so scores can't be rescaled under these weights
+        landmark = _landmark(max(max(times) for times in searched_at.values()))
+        weights = {
+            key: sum(decay_weight(when, landmark) for when in times)
+            for key, times in searched_at.items()
+        }
+
+        # Make sure every key has a row, then increment atomically in the database
+        QueryPopularity.objects.bulk_create(
+            [QueryPopularity(normalized_query=query, genre=genre) for query, genre in weights],
+            ignore_conflicts=True,
+        )
+        rows = QueryPopularity.objects.filter(
+            normalized_query__in={query for query, _ in weights},
+            genre__in={genre for _, genre in weights},
+        ).only('id', 'normalized_query', 'genre')
+        updated = []
+        for row in rows:
+            key = (row.normalized_query, row.genre)
+            if key not in weights:
+                continue
+            row.score = F('score') + weights[key]
+            row.count = F('count') + len(searched_at[key])
+            row.last_searched_at = max(searched_at[key])
+            updated.append(row)
+        QueryPopularity.objects.bulk_update(updated, ['score', 'count', 'last_searched_at'])
+
+
+class SuggestionIndex:
+    """Prefix trie with the top-k completions stored on every node"""
+
+    def __init__(self, entries, k=None):
+        self.k = k or settings.SUGGESTIONS_LIMIT
+        self.root = {}
+        self.popular = []
+        self.popular_by_genre = {}
+        self._build(entries)
+
+    def _build(self, entries):
+        by_query = defaultdict(float)
+        by_genre = defaultdict(list)
+        for query, genre, score in entries:
+            by_query[query] += score
+            if genre:
+                by_genre[genre.casefold()].append((score, query))
+
+        ranked = sorted(by_query.items(), key=lambda item: (-item[1], item[0]))
+        self.popular = [query for query, _ in ranked[:self.k]]
+        self.popular_by_genre = {
+            genre: [query for _, query in heapq.nlargest(self.k, items)]
+            for genre, items in by_genre.items()
+        }
+
+        # Inserting in rank order means each node's list fills best-first
+        for query, _ in ranked:
+            node = self.root
+            for char in query:
+                node = node.setdefault(char, {})
+                top = node.setdefault(None, [])
+                if len(top) < self.k:
+                    top.append(query)
+
+    def complete(self, prefix, limit=None):
+        node = self.root
+        for char in normalize_query(prefix):
+            node = node.get(char)
+            if node is None:
+                return []
+        return node.get(None, [])[:limit or self.k]
+
+    def top(self, genre='', limit=None):
+        if genre:
+            return self.popular_by_genre.get(genre.casefold(), [])[:limit or self.k]
+        return self.popular[:limit or self.k]
+
+
+class SuggestionService:
+    """Per-process holder that swaps in a freshly built index periodically"""
+
+    def __init__(self, refresh_interval=None, size=None):
+        self.refresh_interval = refresh_interval or settings.SUGGESTIONS_REFRESH_INTERVAL
+        self.size = size or settings.SUGGESTIONS_INDEX_SIZE
+        self._index = None
+        self._built_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def build(self):
+        entries = (
+            QueryPopularity.objects
+            .order_by('-score')
+            .values_list('normalized_query', 'genre', 'score')[:self.size]
+        )
+        index = SuggestionIndex(list(entries))
+        self._index, self._built_at = index, time.monotonic()
+        return index
+
+    def _refresh_in_background(self):
+        try:
+            close_old_connections()
+            self.build()
+        finally:
+            self._refreshing = False
+            close_old_connections()
+
+    @property
+    def index(self):
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    return self.build()
+        elif time.monotonic() - self._built_at > self.refresh_interval and not self._refreshing:
+            with self._lock:
+                if not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh_in_background, daemon=True).start()
+        return self._index
+
+
+suggestion_service = SuggestionService()
+
+
+def suggest(prefix, limit=None):
+    return suggestion_service.index.complete(prefix, limit)
+
+
+def popular_searches(genre='', limit=None):
+    return suggestion_service.index.top(genre, limit)
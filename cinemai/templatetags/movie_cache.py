@@ -0,0 +1,54 @@
+"""
+``{% moviecache <fragment> <movie> %}...{% endmoviecache %}``: a rendered
+fragment cached per movie in the ``movie`` cache namespace.
+
+The key holds the fragment name, the movie id and ``Movie.version`` (bumped
+on every save), so a changed movie is simply rendered again. Keep anything
+user-specific -- CSRF tokens, watchlist notes -- outside the block.
+"""
+from django import template
+from django.db.models import Count
+from django.template.loader import render_to_string
+
+from cinemai import caching
+from cinemai.models import Movie
+
+register = template.Library()
+
+# Templates holding a moviecache block for ``movie``, warmed by warm_cache
+CARD_TEMPLATES = ['cinemai/movie_card.html', 'cinemai/watchlist_movie.html']
+
+
+class MovieCacheNode(template.Node):
+    def __init__(self, nodelist, fragment, movie):
+        self.nodelist = nodelist
+        self.fragment = fragment
+        self.movie = movie
+
+    def render(self, context):
+        movie = self.movie.resolve(context)
+        suffix = f'{self.fragment}:{movie.pk}:{movie.version}'
+        value = caching.MOVIE.get(suffix)
+        if value is None:
+            value = self.nodelist.render(context)
+            caching.MOVIE.set(suffix, value)
+        return value
+
+
+@register.tag('moviecache')
+def do_moviecache(parser, token):
+    bits = token.split_contents()
+    if len(bits) != 3:
+        raise template.TemplateSyntaxError(f"'{bits[0]}' takes a fragment name and a movie")
+    nodelist = parser.parse(('endmoviecache',))
+    parser.delete_first_token()
+    return MovieCacheNode(nodelist, bits[1], parser.compile_filter(bits[2]))
+
+
+def warm_cache(limit):
+    """Render the cards of the ``limit`` movies on the most watchlists"""
+    movies = Movie.objects.annotate(watchers=Count('watchlist')).order_by('-watchers', '-id')[:limit]
+    for movie in movies:
+        for name in CARD_TEMPLATES:
+            render_to_string(name, {'movie': movie})
+    return len(movies) * len(CARD_TEMPLATES)
@@ -0,0 +1,98 @@
+"""
+Subscription tiers: the single definition of what each plan costs and
+includes.
+
+``PLANS`` is built once at import; ``get_plan(code)`` is a dict lookup, and
+everything a plan grants -- price, LLM limits, watchlist size, feature
+flags -- is a plain attribute on the frozen ``Plan``. ``SubscriptionTier``
+labels, checkout prices, rate limits and quotas, watchlist limits, the
+subscription page and the admin all read from here.
+"""
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class Plan:
+    code: str
+    name: str
+    # Monthly price in cents
+    price_cents: int
+    # LLM searches: token bucket refill per minute and burst, and tokens per billing month
+    llm_searches_per_minute: float
+    llm_burst: int
+    llm_tokens_per_month: int
+    # None means unlimited
+    max_watchlist: Optional[int]
+    # Feature flags
+    advanced_filters: bool = False
+    priority_support: bool = False
+    custom_models: bool = False
+    analytics: bool = False
+    early_access: bool = False
+    # Subscription page; the limits are listed after these, see ``highlights``
+    features: tuple = ()
+    popular: bool = False
+
+    @property
+    def price(self):
+        return Decimal(self.price_cents) / 100
+
+    @property
+    def label(self):
+        return f'{self.name} - ${self.price}/month'
+
+    @property
+    def highlights(self):
+        """Subscription page lines: the features, then the limits as enforced"""
+        watchlist = f'Watchlist of up to {self.max_watchlist:,} movies' if self.max_watchlist else 'Unlimited watchlist'
+        return (
+            *self.features,
+            f'{self.llm_searches_per_minute:g} AI searches per minute',
+            f'{_compact(self.llm_tokens_per_month)} AI tokens per month',
+            watchlist,
+        )
+
+    def watchlist_full(self, size):
+        return self.max_watchlist is not None and size >= self.max_watchlist
+
+
+def _compact(number):
+    """2000000 -> '2M', 500000 -> '500k'"""
+    for size, suffix in ((1_000_000, 'M'), (1_000, 'k')):
+        if number >= size:
+            return f'{number / size:g}{suffix}'
+    return str(number)
+
+
+BASIC = Plan(
+    code='BASIC', name='Basic', price_cents=999,
+    llm_searches_per_minute=5, llm_burst=5, llm_tokens_per_month=100_000,
+    max_watchlist=500,
+    features=('AI Movie Recommendations', 'Personal Watchlist', 'Search History'),
+)
+STANDARD = Plan(
+    code='STANDARD', name='Standard', price_cents=1499,
+    llm_searches_per_minute=15, llm_burst=10, llm_tokens_per_month=500_000,
+    max_watchlist=2000,
+    advanced_filters=True, priority_support=True,
+    features=('All Basic Features', 'Advanced Filters', 'Priority Support'),
+    popular=True,
+)
+PRO = Plan(
+    code='PRO', name='Pro', price_cents=1999,
+    llm_searches_per_minute=60, llm_burst=20, llm_tokens_per_month=2_000_000,
+    max_watchlist=None,
+    advanced_filters=True, priority_support=True, custom_models=True, analytics=True, early_access=True,
+    features=('All Standard Features', 'Custom AI Models', 'Detailed Analytics', 'Early Access to New Features'),
+)
+
+# In display order
+PLANS = {plan.code: plan for plan in (BASIC, STANDARD, PRO)}
+DEFAULT = BASIC
+
+
+def get_plan(code):
+    """The plan for a tier code (the default plan for unknown codes)"""
+    return PLANS.get(code, DEFAULT)
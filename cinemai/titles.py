@@ -0,0 +1,46 @@
+import re
+import unicodedata
+
+_YEAR_SUFFIX_RE = re.compile(r'\s*[\(\[]\s*(?:18|19|20)\d{2}\s*[\)\]]\s*$')
+_TRAILING_ARTICLE_RE = re.compile(r'^(.*),\s*(the|a|an)$')
+_LEADING_ARTICLE_RE = re.compile(r'^(the|a|an)\s+')
+_NON_WORD_RE = re.compile(r'[^\w\s]+')
+_WHITESPACE_RE = re.compile(r'\s+')
+_NUMBER_RE = re.compile(r'\d+')
+
+
+def canonical_title(title):
+    """
+    Canonical lookup form of a title.
+
+    "The Matrix", "The Matrix (1999)" and "Matrix, The" all become "matrix":
+    accents, a trailing year, punctuation and articles are stripped.
+    """
+    text = unicodedata.normalize('NFKD', title or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    text = _YEAR_SUFFIX_RE.sub('', text.casefold().strip())
+    text = _TRAILING_ARTICLE_RE.sub(r'\2 \1', text)
+    text = _NON_WORD_RE.sub(' ', text.replace('&', ' and '))
+    text = _WHITESPACE_RE.sub(' ', text).strip()
+    return _LEADING_ARTICLE_RE.sub('', text)
+
+
+def trigrams(text):
+    """pg_trgm-style trigrams of an already canonical title"""
+    padded = f'  {text} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    """
+    Trigram similarity of two canonical titles, 0.0 - 1.0.
+
+    Titles whose numbers differ ("Toy Story 2" / "Toy Story 3") never match,
+    since sequels are otherwise only a trigram or two apart.
+    """
+    if _NUMBER_RE.findall(a) != _NUMBER_RE.findall(b):
+        return 0.0
+    ta, tb = trigrams(a), trigrams(b)
+    if not ta or not tb:
+        return 0.0
+    return len(ta & tb) / len(ta | tb)
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path
 from django.contrib.auth import views as auth_views
 from . import views
@@ -29,11 +30,18 @@ urlpatterns = [
     path('account/', views.account_view, name='account'),
     path('account/delete/', views.delete_account, name='delete_account'),
     
-    # Movie Search
-    path('search/', views.search_movies, name='search'),
+    # Movie Search (async under ASGI servers such as uvicorn/daphne)
+    path('search/',
+         views.search_movies_async if settings.ASYNC_SEARCH else views.search_movies,
+         name='search'),
+    path('search/stream/', views.search_stream, name='search_stream'),
+    path('search/suggestions/', views.search_suggestions, name='search_suggestions'),
+    path('metrics/llm/', views.llm_metrics, name='llm_metrics'),
     
     # Watchlist
     path('watchlist/', views.watchlist_view, name='watchlist'),
+    path('watchlist/api/', views.watchlist_api, name='watchlist_api'),
+    path('watchlist/bulk/', views.watchlist_bulk, name='watchlist_bulk'),
     path('watchlist/add/<int:movie_id>/', views.add_to_watchlist, name='add_to_watchlist'),
     path('watchlist/remove/<int:watchlist_id>/', views.remove_from_watchlist, name='remove_from_watchlist'),
     path('watchlist/update/<int:watchlist_id>/', views.update_watchlist_item, name='update_watchlist'),
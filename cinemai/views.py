@@ -2,29 +2,58 @@ from django.shortcuts import render
 
 # Create your views here.
 from django.shortcuts import render, redirect, get_object_or_404
-from django.contrib.auth import login, logout, authenticate
+from django.contrib.auth import login, logout
 from django.contrib.auth.decorators import login_required
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib import messages
-from django.contrib.auth.views import PasswordResetView, PasswordResetConfirmView
+from django.contrib.auth.views import PasswordResetView, PasswordResetConfirmView, redirect_to_login
 from django.urls import reverse_lazy
-from django.http import JsonResponse
+from django.core.paginator import Paginator
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.template.loader import render_to_string
 from django.views.decorators.csrf import csrf_exempt
 from django.conf import settings
+from asgiref.sync import sync_to_async
+from functools import wraps
 import stripe
 import json
+import os
 import requests
-from openai import OpenAI
 
-from .models import UserProfile, Movie, Watchlist, SearchHistory
+from . import billing, catalog, engine, history, llm, quotas, recommendations, search, suggestions, taste, tiers, webhooks
+from .watchlist import (
+    InvalidCursor, InvalidLimit, InvalidOperations, apply_bulk_operations, parse_limit, parse_watched, watchlist_counts,
+    watchlist_page,
+)
+from .entitlements import get_entitlement
+from .models import UserProfile, Movie, Watchlist
 from .forms import SignUpForm, LoginForm, UserUpdateForm, ProfileUpdateForm, WatchlistForm
 
-# Configure Stripe
-stripe.api_key = settings.STRIPE_SECRET_KEY
-
-# Configure OpenAI
-client = OpenAI(api_key=settings.OPENAI_API_KEY) if settings.OPENAI_API_KEY else None
-
-
+# Configure Stripe (pooled client with timeouts)
+billing.configure()
+
+
+def cache_page_for_anonymous(view_func):
+    """Serve a GET view from the cache to anonymous visitors with no pending messages"""
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        timeout = settings.ANONYMOUS_PAGE_CACHE_TIMEOUT
+        if (request.method not in ('GET', 'HEAD') or not timeout or request.user.is_authenticated
+                or len(messages.get_messages(request))):
+            return view_func(request, *args, **kwargs)
+        key = f'page:anonymous:{request.get_full_path()}'
+        content = cache.get(key)
+        if content is not None:
+            return HttpResponse(content)
+        response = view_func(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            cache.set(key, response.content, timeout)
+        return response
+    return wrapper
+
+
+@cache_page_for_anonymous
 def home(request):
     """Home page view"""
     context = {
@@ -60,8 +89,8 @@ def login_view(request):
         form = LoginForm(request, data=request.POST)
         if form.is_valid():
             username = form.cleaned_data.get('username')
-            password = form.cleaned_data.get('password')
-            user = authenticate(username=username, password=password)
+            # Already authenticated by the form; don't hash the password twice
+            user = form.get_user()
             if user is not None:
                 login(request, user)
                 messages.success(request, f'Welcome back, {username}!')
@@ -116,83 +145,360 @@ def delete_account(request):
     return render(request, 'cinemai/delete_account.html')
 
 
+def _local_first():
+    """Whether the local index should be tried before the LLM"""
+    return settings.RECOMMENDER_MODE == 'local' or not llm.gateway.available
+
+
+def _search_page(search_query, genre, page_number):
+    """One page of full-text search results"""
+    paginator = Paginator(search.search_movies(search_query, genre), settings.SEARCH_RESULTS_PER_PAGE)
+    return paginator.get_page(page_number)
+
+
+def _llm_decision(user, search_query, genre):
+    """Rate limit / quota check for an LLM search; cached results are free"""
+    if recommendations.is_cached(search_query, genre):
+        return quotas.ALLOWED
+    return quotas.check(user)
+
+
+def _limit_message(decision):
+    if decision.reason == 'quota':
+        return "You've used this month's AI search allowance for your plan."
+    return f'Too many AI searches; please wait {decision.retry_after}s and try again.'
+
+
+def _rate_limited(request, decision, context):
+    """The search page as a 429, before anything is sent to the LLM"""
+    messages.error(request, _limit_message(decision))
+    response = render(request, 'cinemai/search.html', context, status=429)
+    response['Retry-After'] = str(decision.retry_after)
+    return response
+
+
+def _fallback_results(search_query, genre, page_number, local_tried=False):
+    """Local index results, else one page of full-text search; returns (movies, page_obj)"""
+    if search_query and not local_tried:
+        movies = engine.recommend(search_query, genre)
+        if movies:
+            return movies, None
+    page_obj = _search_page(search_query, genre, page_number)
+    return list(page_obj.object_list), page_obj
+
+
 @login_required
 def search_movies(request):
     """AI-powered movie search view"""
     movies = []
     search_query = ''
+    genre = ''
+    page_obj = None
     
     if request.method == 'POST':
         search_query = request.POST.get('search_query', '')
         genre = request.POST.get('genre', '')
         
-        # Save search history
-        SearchHistory.objects.create(
-            user=request.user,
-            query=search_query,
-            genre=genre
-        )
+        # Save search history (buffered, written off the request path)
+        history.record_search(request.user, search_query, genre)
         
-        # Use OpenAI to get movie recommendations
-        if client and search_query:
+        # Local vector index first when configured, or when the LLM is unavailable
+        local_first = bool(search_query) and _local_first()
+        if local_first:
+            movies = engine.recommend(search_query, genre)
+        
+        # Use OpenAI to get movie recommendations (cached per normalized query)
+        use_llm = not movies and bool(search_query) and llm.gateway.available
+        if use_llm:
+            decision = _llm_decision(request.user, search_query, genre)
+            if not decision.allowed:
+                return _rate_limited(request, decision, {'movies': [], 'search_query': search_query, 'genre': genre})
             try:
-                prompt = f"Recommend 10 movies based on: {search_query}"
-                if genre:
-                    prompt += f" in the {genre} genre"
-                prompt += ". Return only movie titles, one per line."
-                
-                response = client.chat.completions.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": "You are a movie recommendation assistant."},
-                        {"role": "user", "content": prompt}
-                    ]
-                )
-                
-                movie_titles = response.choices[0].message.content.strip().split('\n')
+                with quotas.billing(request.user.pk):
+                    recommended = recommendations.get_recommendations(search_query, genre)
                 
-                # Fetch movie details from OMDB or store as basic entries
-                for title in movie_titles:
-                    title = title.strip('0123456789. ')
-                    if title:
-                        # Try to get or create movie
-                        movie, created = Movie.objects.get_or_create(
-                            title=title,
-                            defaults={'genre': genre}
-                        )
-                        movies.append(movie)
+                # Resolve all recommendations (IMDb id, then title) to Movie rows in one batch
+                movies = catalog.resolve_movies(recommended, genre)
+                if settings.RECOMMENDER_MODE == 'rerank':
+                    movies = engine.rerank(movies, search_query, genre)
                         
+            except llm.LLMUnavailable:
+                # Upstream slow, failing or saturated: fall back to local search
+                use_llm = False
             except Exception as e:
                 messages.error(request, f'Error getting recommendations: {str(e)}')
-        else:
-            # Fallback: search existing movies
-            movies = Movie.objects.filter(title__icontains=search_query)
-            if genre:
-                movies = movies.filter(genre__icontains=genre)
+        
+        if not movies and not use_llm:
+            # Fallback: local index, then ranked full-text search
+            movies, page_obj = _fallback_results(search_query, genre, request.POST.get('page'), local_first)
+        
+        if page_obj is None:
+            # Nudge recommendations towards the user's genres and directors
+            movies = taste.personalize(request.user, movies)
     
     context = {
         'movies': movies,
         'search_query': search_query,
+        'genre': genre,
+        'page_obj': page_obj,
     }
     return render(request, 'cinemai/search.html', context)
 
 
+def _ndjson(event):
+    return json.dumps(event) + '\n'
+
+
+def _movie_event(movie):
+    return _ndjson({
+        'type': 'movie',
+        'id': movie.pk,
+        'title': movie.title,
+        'html': render_to_string('cinemai/movie_card.html', {'movie': movie}),
+    })
+
+
+def _stream_search_events(user, search_query, genre, checked=False):
+    """
+    Yield NDJSON events, one rendered movie card per resolved title.
+    ``checked`` means the view already applied the LLM rate limit.
+    """
+    try:
+        local_first = bool(search_query) and _local_first()
+        movies = taste.personalize(user, engine.recommend(search_query, genre)) if local_first else []
+        
+        seen = set()
+        use_llm = not movies and bool(search_query) and llm.gateway.available
+        if use_llm and not checked:
+            # Too late for a 429 once streaming: say so and search locally
+            decision = _llm_decision(user, search_query, genre)
+            if not decision.allowed:
+                yield _ndjson({'type': 'error', 'message': _limit_message(decision),
+                               'retry_after': decision.retry_after})
+                use_llm = False
+        if use_llm:
+            try:
+                for recommended in recommendations.stream_recommendations(search_query, genre, user.pk):
+                    for movie in catalog.resolve_movies([recommended], genre):
+                        if movie.pk in seen:
+                            continue
+                        seen.add(movie.pk)
+                        yield _movie_event(movie)
+            except llm.LLMUnavailable:
+                # Fall back to local search, keeping any cards already sent
+                use_llm = False
+        
+        if not movies and not use_llm:
+            movies, page_obj = _fallback_results(search_query, genre, 1, local_first)
+            if page_obj is None:
+                movies = taste.personalize(user, movies)
+        for movie in movies:
+            if movie.pk not in seen:
+                yield _movie_event(movie)
+    except Exception as e:
+        yield _ndjson({'type': 'error', 'message': f'Error getting recommendations: {str(e)}'})
+    yield _ndjson({'type': 'done'})
+
+
+@login_required
+def search_stream(request):
+    """Stream search results as NDJSON so cards render as titles arrive"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    
+    search_query = request.POST.get('search_query', '')
+    genre = request.POST.get('genre', '')
+    
+    # Save search history (buffered, written off the request path)
+    history.record_search(request.user, search_query, genre)
+    
+    # Unless the local index answers first, the LLM is next: limit it up front
+    checked = bool(search_query) and not _local_first()
+    if checked:
+        decision = _llm_decision(request.user, search_query, genre)
+        if not decision.allowed:
+            response = JsonResponse({'error': _limit_message(decision), 'retry_after': decision.retry_after},
+                                    status=429)
+            response['Retry-After'] = str(decision.retry_after)
+            return response
+    
+    response = StreamingHttpResponse(
+        _stream_search_events(request.user, search_query, genre, checked),
+        content_type='application/x-ndjson'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@login_required
+def search_suggestions(request):
+    """Typeahead completions, or popular searches when no prefix is given"""
+    prefix = request.GET.get('q', '')
+    if prefix.strip():
+        results = suggestions.suggest(prefix)
+    else:
+        results = suggestions.popular_searches(request.GET.get('genre', ''))
+    return JsonResponse({'suggestions': results})
+
+
+@staff_member_required
+def llm_metrics(request):
+    """This worker's LLM circuit state and micro-batching stats"""
+    return JsonResponse({
+        'pid': os.getpid(),
+        'circuit': llm.gateway.breaker.state,
+        'batching': recommendations.batcher.metrics.snapshot(),
+        'async_batching': recommendations.async_batcher.metrics.snapshot(),
+    })
+
+
+def async_login_required(view_func):
+    """login_required for async views (Django 4.2's decorator is sync-only)"""
+    @wraps(view_func)
+    async def wrapper(request, *args, **kwargs):
+        is_authenticated = await sync_to_async(lambda: request.user.is_authenticated)()
+        if not is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await view_func(request, *args, **kwargs)
+    return wrapper
+
+
+@async_login_required
+async def search_movies_async(request):
+    """AI-powered movie search view for ASGI deployments"""
+    movies = []
+    search_query = ''
+    genre = ''
+    page_obj = None
+    
+    if request.method == 'POST':
+        search_query = request.POST.get('search_query', '')
+        genre = request.POST.get('genre', '')
+        
+        # Save search history (buffered, written off the request path)
+        await history.arecord_search(request.user, search_query, genre)
+        
+        # Local vector index first when configured, or when the LLM is unavailable
+        local_first = bool(search_query) and _local_first()
+        if local_first:
+            movies = await sync_to_async(engine.recommend)(search_query, genre)
+        
+        # Await the LLM instead of holding a worker thread for the round trip
+        use_llm = not movies and bool(search_query) and llm.gateway.available
+        if use_llm:
+            decision = await sync_to_async(_llm_decision)(request.user, search_query, genre)
+            if not decision.allowed:
+                context = {'movies': [], 'search_query': search_query, 'genre': genre}
+                return await sync_to_async(_rate_limited)(request, decision, context)
+            try:
+                with quotas.billing(request.user.pk):
+                    recommended = await recommendations.aget_recommendations(search_query, genre)
+                movies = await catalog.aresolve_movies(recommended, genre)
+                if settings.RECOMMENDER_MODE == 'rerank':
+                    movies = await sync_to_async(engine.rerank)(movies, search_query, genre)
+            except llm.LLMUnavailable:
+                # Upstream slow, failing or saturated: fall back to local search
+                use_llm = False
+            except Exception as e:
+                messages.error(request, f'Error getting recommendations: {str(e)}')
+        
+        if not movies and not use_llm:
+            # Fallback: local index, then ranked full-text search
+            movies, page_obj = await sync_to_async(_fallback_results)(
+                search_query, genre, request.POST.get('page'), local_first
+            )
+        
+        if page_obj is None:
+            # Nudge recommendations towards the user's genres and directors
+            movies = await sync_to_async(taste.personalize)(request.user, movies)
+    
+    context = {
+        'movies': movies,
+        'search_query': search_query,
+        'genre': genre,
+        'page_obj': page_obj,
+    }
+    # Template context processors touch the session and user synchronously
+    return await sync_to_async(render)(request, 'cinemai/search.html', context)
+
+
 @login_required
 def watchlist_view(request):
-    """User's watchlist view"""
-    watchlist_items = Watchlist.objects.filter(user=request.user).select_related('movie')
+    """User's watchlist view (keyset paginated)"""
+    watched = parse_watched(request.GET.get('watched'))
+    try:
+        watchlist_items, next_cursor = watchlist_page(request.user, request.GET.get('cursor'), watched)
+    except InvalidCursor:
+        return redirect('watchlist')
     
     context = {
         'watchlist_items': watchlist_items,
+        'next_cursor': next_cursor,
+        'watched': watched,
+        'counts': watchlist_counts(request.user),
     }
     return render(request, 'cinemai/watchlist.html', context)
 
 
+@login_required
+def watchlist_api(request):
+    """JSON page of the user's watchlist for infinite scroll"""
+    watched = parse_watched(request.GET.get('watched'))
+    try:
+        limit = parse_limit(request.GET.get('limit'))
+    except InvalidLimit:
+        return JsonResponse({'error': 'Invalid limit: must be an integer'}, status=400)
+    try:
+        items, next_cursor = watchlist_page(request.user, request.GET.get('cursor'), watched, limit)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    
+    return JsonResponse({
+        'items': [
+            {
+                'id': item.id,
+                'movie_id': item.movie_id,
+                'title': item.movie.title,
+                'year': item.movie.year,
+                'genre': item.movie.genre,
+                'rating': str(item.movie.rating) if item.movie.rating is not None else None,
+                'poster_url': item.movie.poster_url,
+                'watched': item.watched,
+                'notes': item.notes,
+                'added_at': item.added_at.isoformat(),
+                'html': render_to_string('cinemai/watchlist_card.html', {'item': item}, request),
+            }
+            for item in items
+        ],
+        'next_cursor': next_cursor,
+    })
+
+
+@login_required
+def watchlist_bulk(request):
+    """Apply a batch of add/remove/update operations to the watchlist"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Invalid request'}, status=400)
+    
+    try:
+        results = apply_bulk_operations(request.user, json.loads(request.body))
+    except (ValueError, InvalidOperations) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    
+    return JsonResponse({'results': results, 'counts': watchlist_counts(request.user)})
+
+
 @login_required
 def add_to_watchlist(request, movie_id):
     """Add a movie to user's watchlist"""
     movie = get_object_or_404(Movie, id=movie_id)
     
+    plan = get_entitlement(request.user).effective_plan
+    if plan.max_watchlist is not None and plan.watchlist_full(Watchlist.objects.filter(user=request.user).count()):
+        messages.error(request, f'Your {plan.name} plan holds up to {plan.max_watchlist} movies. Upgrade to add more.')
+        return redirect(request.META.get('HTTP_REFERER', 'watchlist'))
+    
     watchlist_item, created = Watchlist.objects.get_or_create(
         user=request.user,
         movie=movie
@@ -243,53 +549,31 @@ def subscription_view(request):
     """Subscription management and Stripe checkout"""
     context = {
         'stripe_public_key': settings.STRIPE_PUBLIC_KEY,
-        'basic_price': 999,  # in cents
-        'standard_price': 1499,
-        'pro_price': 1999,
+        'plans': tiers.PLANS.values(),
     }
-    return render(request, 'cinemaisubscription.html', context)
+    return render(request, 'cinemai/subscription.html', context)
 
 
 @login_required
 def create_checkout_session(request):
-    """Create Stripe checkout session"""
+    """Create Stripe checkout session (or reuse the user's open one for this tier)"""
     if request.method == 'POST':
-        data = json.loads(request.body)
-        tier = data.get('tier')
-        
-        price_map = {
-            'BASIC': 999,
-            'STANDARD': 1499,
-            'PRO': 1999,
-        }
+        try:
+            tier = json.loads(request.body).get('tier')
+        except (ValueError, AttributeError):
+            tier = None
+        if tier not in tiers.PLANS:
+            return JsonResponse({'error': 'Invalid tier'}, status=400)
         
         try:
-            checkout_session = stripe.checkout.Session.create(
-                payment_method_types=['card'],
-                line_items=[{
-                    'price_data': {
-                        'currency': 'usd',
-                        'product_data': {
-                            'name': f'CinemAI {tier.capitalize()} Subscription',
-                        },
-                        'unit_amount': price_map.get(tier, 999),
-                        'recurring': {
-                            'interval': 'month',
-                        },
-                    },
-                    'quantity': 1,
-                }],
-                mode='subscription',
+            checkout = billing.checkout_session(
+                request.user,
+                tier,
                 success_url=request.build_absolute_uri('/subscription/success/'),
                 cancel_url=request.build_absolute_uri('/subscription/'),
-                client_reference_id=str(request.user.id),
-                metadata={
-                    'tier': tier,
-                }
             )
-            
-            return JsonResponse({'sessionId': checkout_session.id})
-        except Exception as e:
+            return JsonResponse({'sessionId': checkout.id})
+        except stripe.error.StripeError as e:
             return JsonResponse({'error': str(e)}, status=400)
     
     return JsonResponse({'error': 'Invalid request'}, status=400)
@@ -304,12 +588,12 @@ def subscription_success(request):
 
 @csrf_exempt
 def stripe_webhook(request):
-    """Handle Stripe webhooks"""
+    """Handle Stripe webhooks: verify, store and acknowledge; events are applied in the background"""
     payload = request.body
     sig_header = request.META.get('HTTP_STRIPE_SIGNATURE')
     
     try:
-        event = stripe.Webhook.construct_event(
+        stripe.Webhook.construct_event(
             payload, sig_header, settings.STRIPE_WEBHOOK_SECRET
         )
     except ValueError:
@@ -317,24 +601,10 @@ def stripe_webhook(request):
     except stripe.error.SignatureVerificationError:
         return JsonResponse({'error': 'Invalid signature'}, status=400)
     
-    # Handle the event
-    if event['type'] == 'checkout.session.completed':
-        session = event['data']['object']
-        user_id = session.get('client_reference_id')
-        tier = session.get('metadata', {}).get('tier')
-        
-        if user_id:
-            try:
-                from django.contrib.auth.models import User
-                user = User.objects.get(id=user_id)
-                profile = user.profile
-                profile.subscription_tier = tier
-                profile.subscription_active = True
-                profile.stripe_customer_id = session.get('customer')
-                profile.stripe_subscription_id = session.get('subscription')
-                profile.save()
-            except User.DoesNotExist:
-                pass
+    # Stored once per event id, so Stripe's redeliveries are no-ops
+    webhooks.store_event(json.loads(payload))
+    if settings.STRIPE_WEBHOOK_PROCESSING == webhooks.BACKGROUND:
+        webhooks.processor.notify()
     
     return JsonResponse({'status': 'success'})
 
@@ -0,0 +1,223 @@
+import base64
+import binascii
+import json
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+from django.utils.dateparse import parse_datetime
+
+from . import taste
+from .entitlements import get_entitlement
+from .models import Movie, Watchlist
+
+# Columns needed to render a watchlist card (no plot or other heavy text)
+LIST_FIELDS = [
+    'id', 'added_at', 'watched', 'notes', 'movie_id',
+    'movie__id', 'movie__title', 'movie__year', 'movie__genre', 'movie__rating', 'movie__poster_url',
+    'movie__version',
+]
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class InvalidLimit(ValueError):
+    pass
+
+
+def encode_cursor(item):
+    """Opaque cursor pointing just after ``item`` in (-added_at, -id) order"""
+    raw = json.dumps([item.added_at.isoformat(), item.id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        added_at, item_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        added_at = parse_datetime(added_at)
+    except (ValueError, TypeError, binascii.Error, UnicodeError):
+        raise InvalidCursor(cursor)
+    if added_at is None or not isinstance(item_id, int):
+        raise InvalidCursor(cursor)
+    return added_at, item_id
+
+
+def parse_watched(value):
+    """'1'/'true'/'watched' -> True, '0'/'false'/'unwatched' -> False, else None"""
+    value = (value or '').lower()
+    if value in ('1', 'true', 'watched'):
+        return True
+    if value in ('0', 'false', 'unwatched'):
+        return False
+    return None
+
+
+def parse_limit(value):
+    """Page size from a query parameter, clamped to 1..WATCHLIST_MAX_PAGE_SIZE; None if not given"""
+    if not value:
+        return None
+    try:
+        limit = int(value)
+    except ValueError:
+        raise InvalidLimit(value)
+    return max(1, min(limit, settings.WATCHLIST_MAX_PAGE_SIZE))
+
+
+def watchlist_page(user, cursor=None, watched=None, limit=None):
+    """
+    One keyset page of ``user``'s watchlist, newest first.
+
+    Returns ``(items, next_cursor)``; ``next_cursor`` is None on the last
+    page. The (user, [watched,] added_at, id) indexes serve both the filter
+    and the ordering, so page N costs the same as page 1.
+    """
+    limit = max(1, min(limit or settings.WATCHLIST_PAGE_SIZE, settings.WATCHLIST_MAX_PAGE_SIZE))
+    items = (
+        Watchlist.objects
+        .filter(user=user)
+        .select_related('movie')
+        .only(*LIST_FIELDS)
+        .order_by('-added_at', '-id')
+    )
+    if watched is not None:
+        items = items.filter(watched=watched)
+    if cursor:
+        added_at, item_id = decode_cursor(cursor)
+        items = items.filter(Q(added_at__lt=added_at) | Q(added_at=added_at, id__lt=item_id))
+
+    # Fetch one extra row to know whether another page exists
+    items = list(items[:limit + 1])
+    next_cursor = encode_cursor(items[limit - 1]) if len(items) > limit else None
+    return items[:limit], next_cursor
+
+
+def watchlist_counts(user):
+    """Total / watched / to-watch counts in a single aggregate query"""
+    counts = Watchlist.objects.filter(user=user).aggregate(
+        total=Count('id'),
+        watched=Count('id', filter=Q(watched=True)),
+    )
+    counts['unwatched'] = counts['total'] - counts['watched']
+    return counts
+
+
+class InvalidOperations(ValueError):
+    pass
+
+
+def _ids(values, name):
+    if not isinstance(values, list) or not all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        raise InvalidOperations(f'"{name}" must be a list of integer ids')
+    return list(dict.fromkeys(values))
+
+
+def _updates(values):
+    if not isinstance(values, list):
+        raise InvalidOperations('"update" must be a list of objects')
+    updates = {}
+    for value in values:
+        if not isinstance(value, dict) or not isinstance(value.get('id'), int):
+            raise InvalidOperations('each update needs an integer "id"')
+        if 'watched' in value and not isinstance(value['watched'], bool):
+            raise InvalidOperations('"watched" must be true or false')
+        if 'notes' in value and not isinstance(value['notes'], str):
+            raise InvalidOperations('"notes" must be a string')
+        updates.setdefault(value['id'], {}).update(
+            {field: value[field] for field in ('watched', 'notes') if field in value}
+        )
+    return updates
+
+
+def apply_bulk_operations(user, operations):
+    """
+    Apply add / remove / update operations to ``user``'s watchlist at once.
+
+    ``operations`` looks like::
+
+        {"add": [movie_id, ...],
+         "remove": [watchlist_id, ...],
+         "update": [{"id": watchlist_id, "watched": true, "notes": "..."}, ...]}
+
+    Everything runs in one transaction with a fixed number of queries per
+    operation type (bulk_create / one filtered delete / bulk_update), and
+    the result reports a status for every requested item ("limit_reached"
+    for adds past the plan's watchlist size). The user's taste profile gets
+    one combined update after the commit.
+    """
+    with transaction.atomic(), taste.signals_suppressed():
+        results, profile_changes = _apply_bulk_operations(user, operations)
+        taste.record_watchlist_changes(user.pk, profile_changes)
+    return results
+
+
+def _apply_bulk_operations(user, operations):
+    if not isinstance(operations, dict):
+        raise InvalidOperations('expected a JSON object')
+    add = _ids(operations.get('add', []), 'add')
+    remove = _ids(operations.get('remove', []), 'remove')
+    updates = _updates(operations.get('update', []))
+    if len(add) + len(remove) + len(updates) > settings.WATCHLIST_BULK_MAX_OPERATIONS:
+        raise InvalidOperations(f'at most {settings.WATCHLIST_BULK_MAX_OPERATIONS} operations per request')
+
+    results = {'add': [], 'remove': [], 'update': []}
+    profile_changes = Counter()
+
+    if add:
+        movie_ids = set(Movie.objects.filter(id__in=add).values_list('id', flat=True))
+        existing = set(
+            Watchlist.objects.filter(user=user, movie_id__in=movie_ids).values_list('movie_id', flat=True)
+        )
+        limit = get_entitlement(user).effective_plan.max_watchlist
+        room = None if limit is None else limit - Watchlist.objects.filter(user=user).count()
+        added = []
+        for movie_id in add:
+            if movie_id not in movie_ids:
+                status = 'not_found'
+            elif movie_id in existing:
+                status = 'exists'
+            elif room is not None and len(added) >= room:
+                status = 'limit_reached'
+            else:
+                status = 'added'
+                added.append(Watchlist(user=user, movie_id=movie_id))
+                profile_changes[movie_id] += taste.ADDED_WEIGHT
+            results['add'].append({'movie_id': movie_id, 'status': status})
+        Watchlist.objects.bulk_create(added, ignore_conflicts=True)
+
+    if remove:
+        owned = Watchlist.objects.filter(user=user, id__in=remove)
+        removed = set()
+        for item_id, movie_id, watched in owned.values_list('id', 'movie_id', 'watched'):
+            removed.add(item_id)
+            profile_changes[movie_id] -= taste.ADDED_WEIGHT + (taste.WATCHED_WEIGHT if watched else 0.0)
+        # QuerySet.delete() would load every row to send post_delete; nothing
+        # references Watchlist and the taste profile update is batched above
+        owned._raw_delete(owned.db)
+        results['remove'] = [
+            {'id': item_id, 'status': 'removed' if item_id in removed else 'not_found'}
+            for item_id in remove
+        ]
+
+    if updates:
+        items = (
+            Watchlist.objects
+            .filter(user=user, id__in=list(updates))
+            .only('id', 'movie_id', 'watched', 'notes')
+            .in_bulk()
+        )
+        for item_id, fields in updates.items():
+            item = items.get(item_id)
+            if item is None:
+                results['update'].append({'id': item_id, 'status': 'not_found'})
+                continue
+            if fields.get('watched', item.watched) != item.watched:
+                profile_changes[item.movie_id] += taste.WATCHED_WEIGHT if fields['watched'] else -taste.WATCHED_WEIGHT
+            for field, value in fields.items():
+                setattr(item, field, value)
+            results['update'].append({'id': item_id, 'status': 'updated'})
+        Watchlist.objects.bulk_update(items.values(), ['watched', 'notes'])
+
+    return results, profile_changes
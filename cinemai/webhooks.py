@@ -0,0 +1,342 @@
+"""
+Stripe webhook ingestion.
+
+The webhook view only verifies the signature and stores the raw event
+(``StripeEvent``, unique on the Stripe event id, so retried deliveries are
+dropped) before answering 200. ``processor`` applies stored events off the
+request path:
+
+* events are grouped by Stripe customer and each customer's events are
+  applied one at a time, oldest first, in one transaction with a savepoint
+  per event;
+* up to ``STRIPE_WEBHOOK_WORKERS`` customers are processed concurrently
+  (one on SQLite, which allows a single writer);
+* an event is claimed by flipping it from pending inside that transaction,
+  so another worker process reaching the same customer backs off instead
+  of applying it twice or out of order;
+* a failing event is retried on later passes, holding back that
+  customer's newer events, until ``STRIPE_WEBHOOK_MAX_ATTEMPTS``.
+
+In ``'background'`` mode each web worker runs the processor in a thread,
+woken by new events and every ``STRIPE_WEBHOOK_POLL_INTERVAL`` seconds; in
+``'command'`` mode only ``manage.py process_stripe_events`` applies them.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import OperationalError, close_old_connections, connection, transaction
+from django.utils import timezone
+
+from . import billing, tiers
+from .models import StripeEvent, StripeEventStatus, UserProfile
+
+logger = logging.getLogger(__name__)
+
+BACKGROUND = 'background'
+COMMAND = 'command'
+
+# Subscription statuses that keep a subscription active
+ACTIVE_STATUSES = {'active', 'trialing'}
+
+
+class SkipEvent(Exception):
+    """The event can't or shouldn't be applied; it is marked skipped"""
+
+
+def _timestamp(value):
+    return datetime.fromtimestamp(value, dt_timezone.utc) if value else None
+
+
+def customer_for(event):
+    """The ordering key of an event: its Stripe customer, else the user it is for"""
+    obj = event['data']['object']
+    if obj.get('object') == 'customer':
+        return obj['id']
+    customer = obj.get('customer')
+    if isinstance(customer, dict):
+        customer = customer.get('id')
+    if customer:
+        return customer
+    user_id = obj.get('client_reference_id')
+    return f'user:{user_id}' if user_id else ''
+
+
+def store_event(event):
+    """Persist a verified event; redeliveries of a stored event are ignored"""
+    StripeEvent.objects.bulk_create([StripeEvent(
+        event_id=event['id'],
+        type=event['type'],
+        customer_id=customer_for(event),
+        created=_timestamp(event.get('created')) or timezone.now(),
+        payload=event,
+    )], ignore_conflicts=True)
+
+
+def _valid_tier(tier):
+    return tier if tier in tiers.PLANS else None
+
+
+def _subscription_tier(subscription):
+    tier = (subscription.get('metadata') or {}).get('tier')
+    if not tier:
+        items = (subscription.get('items') or {}).get('data') or []
+        price = items[0].get('price') or {} if items else {}
+        tier = (price.get('metadata') or {}).get('tier') or billing.tier_for_price(price.get('id'))
+    return _valid_tier(tier)
+
+
+def _period_end(subscription):
+    # Newer API versions moved current_period_end onto the subscription items
+    end = subscription.get('current_period_end')
+    if end is None:
+        items = (subscription.get('items') or {}).get('data') or []
+        end = items[0].get('current_period_end') if items else None
+    return _timestamp(end)
+
+
+NO_PROFILE = 'no profile for customer'
+
+
+def _profile_for_subscription(customer_id, subscription):
+    """
+    The profile a subscription belongs to: by customer, by subscription id,
+    else by the user id checkout put in its metadata -- subscription events
+    often arrive before checkout.session.completed has recorded either id.
+    """
+    profiles = UserProfile.objects.select_for_update()
+    profile = profiles.filter(stripe_customer_id=customer_id).first()
+    if profile is None and subscription.get('id'):
+        profile = profiles.filter(stripe_subscription_id=subscription['id']).first()
+    user_id = (subscription.get('metadata') or {}).get('user_id')
+    if profile is None and user_id:
+        profile = profiles.filter(user_id=user_id).first()
+        if profile is not None:
+            profile.stripe_customer_id = customer_id
+    if profile is None:
+        raise SkipEvent(f'{NO_PROFILE} {customer_id}')
+    return profile
+
+
+def handle_checkout_completed(event):
+    session = event['data']['object']
+    user_id = session.get('client_reference_id')
+    if not user_id:
+        raise SkipEvent('no client_reference_id')
+    profile = UserProfile.objects.select_for_update().filter(user_id=user_id).first()
+    if profile is None:
+        raise SkipEvent(f'no profile for user {user_id}')
+    tier = _valid_tier((session.get('metadata') or {}).get('tier'))
+    if tier:
+        profile.subscription_tier = tier
+    profile.subscription_active = True
+    profile.stripe_customer_id = session.get('customer')
+    profile.stripe_subscription_id = session.get('subscription')
+    profile.save()
+    if tier:
+        billing.forget_checkout(profile.user_id, tier)
+    # Subscription events that came first (without user metadata) and found
+    # no profile can be applied now; they sort before this one
+    StripeEvent.objects.filter(
+        customer_id=customer_for(event),
+        type__startswith='customer.subscription.',
+        status=StripeEventStatus.SKIPPED,
+        last_error__startswith=NO_PROFILE,
+    ).update(status=StripeEventStatus.PENDING, last_error='')
+
+
+def handle_subscription_changed(event):
+    subscription = event['data']['object']
+    customer_id = customer_for(event)
+    # Stripe may deliver an older state after a newer one: keep the newer
+    newer = StripeEvent.objects.filter(
+        customer_id=customer_id,
+        type__startswith='customer.subscription.',
+        status=StripeEventStatus.PROCESSED,
+        created__gt=_timestamp(event['created']),
+    )
+    if newer.exists():
+        raise SkipEvent('superseded by a newer subscription event')
+
+    profile = _profile_for_subscription(customer_id, subscription)
+    profile.stripe_subscription_id = subscription.get('id')
+    if event['type'] == 'customer.subscription.deleted':
+        profile.subscription_active = False
+        profile.subscription_end_date = (
+            _timestamp(subscription.get('ended_at')) or _timestamp(subscription.get('canceled_at'))
+            or timezone.now()
+        )
+    else:
+        profile.subscription_active = subscription.get('status') in ACTIVE_STATUSES
+        profile.subscription_end_date = _timestamp(subscription.get('cancel_at')) or _period_end(subscription)
+        profile.subscription_tier = _subscription_tier(subscription) or profile.subscription_tier
+    profile.save()
+
+
+HANDLERS = {
+    'checkout.session.completed': handle_checkout_completed,
+    'customer.subscription.created': handle_subscription_changed,
+    'customer.subscription.updated': handle_subscription_changed,
+    'customer.subscription.deleted': handle_subscription_changed,
+}
+
+
+def _finish(event, status, error=''):
+    StripeEvent.objects.filter(pk=event.pk).update(status=status, last_error=error, processed_at=timezone.now())
+
+
+def _apply(event):
+    """Apply one event inside the caller's transaction; False if another worker has it"""
+    claimed = StripeEvent.objects.filter(pk=event.pk, status=StripeEventStatus.PENDING).update(
+        status=StripeEventStatus.PROCESSED, processed_at=timezone.now(),
+    )
+    if not claimed:
+        return False
+    handler = HANDLERS.get(event.type)
+    if handler is None:
+        _finish(event, StripeEventStatus.SKIPPED, 'unhandled event type')
+        return True
+    try:
+        with transaction.atomic():
+            handler(event.payload)
+    except SkipEvent as skip:
+        _finish(event, StripeEventStatus.SKIPPED, str(skip))
+    return True
+
+
+def process_customer(customer_id):
+    """Apply a customer's pending events in order; returns how many were applied"""
+    done = 0
+    try:
+        with transaction.atomic():
+            pending = StripeEvent.objects.filter(customer_id=customer_id, status=StripeEventStatus.PENDING)
+            for event in pending.order_by('created', 'id'):
+                try:
+                    with transaction.atomic():
+                        if not _apply(event):
+                            break
+                except OperationalError:
+                    raise
+                except Exception as exc:
+                    # Retry later; newer events for this customer must wait for it
+                    _failed_attempt(event, exc)
+                    if event.attempts + 1 < settings.STRIPE_WEBHOOK_MAX_ATTEMPTS:
+                        break
+                    continue
+                done += 1
+    except OperationalError:
+        # Usually another worker holding this customer's rows; try again later
+        logger.info('Stripe events for %s left for a later pass', customer_id, exc_info=True)
+    return done
+
+
+def _failed_attempt(event, exc):
+    logger.exception('Stripe event %s (%s) failed', event.event_id, event.type)
+    attempts = event.attempts + 1
+    status = StripeEventStatus.FAILED if attempts >= settings.STRIPE_WEBHOOK_MAX_ATTEMPTS else StripeEventStatus.PENDING
+    StripeEvent.objects.filter(pk=event.pk).update(attempts=attempts, status=status, last_error=str(exc)[:2000])
+
+
+def worker_count(workers=None):
+    """Customers to process concurrently; SQLite takes one writer at a time anyway"""
+    if connection.vendor == 'sqlite':
+        return 1
+    return workers or settings.STRIPE_WEBHOOK_WORKERS
+
+
+def pending_customers():
+    return list(
+        StripeEvent.objects.filter(status=StripeEventStatus.PENDING)
+        .order_by().values_list('customer_id', flat=True).distinct()
+    )
+
+
+class WebhookProcessor:
+    """Applies stored Stripe events in the background, per customer in order"""
+
+    def __init__(self, workers=None, poll_interval=None):
+        self.workers = workers
+        self.poll_interval = poll_interval or settings.STRIPE_WEBHOOK_POLL_INTERVAL
+        self._wakeup = threading.Event()
+        self._inflight = set()
+        self._inflight_lock = threading.Lock()
+        self._executor = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def notify(self):
+        """Wake the processor: new events were stored"""
+        self._ensure_thread()
+        self._wakeup.set()
+
+    def _ensure_thread(self):
+        # Workers forked from a preloaded master must start their own thread
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            self._inflight = set()
+            self._executor = ThreadPoolExecutor(worker_count(self.workers), thread_name_prefix='stripe-events')
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='stripe-event-dispatcher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            try:
+                close_old_connections()
+                self.dispatch()
+            except Exception:
+                logger.exception('Stripe event dispatch failed')
+
+    def dispatch(self):
+        """Hand each customer with pending events to the pool, unless already in progress"""
+        for customer_id in pending_customers():
+            with self._inflight_lock:
+                if customer_id in self._inflight:
+                    continue
+                self._inflight.add(customer_id)
+            self._executor.submit(self._process, customer_id)
+
+    def _process(self, customer_id):
+        try:
+            if process_customer(customer_id):
+                # Events may have arrived for it meanwhile
+                self._wakeup.set()
+        finally:
+            with self._inflight_lock:
+                self._inflight.discard(customer_id)
+            close_old_connections()
+
+
+processor = WebhookProcessor()
+
+
+def drain(workers=None):
+    """Apply everything pending now, from the calling process; returns events applied"""
+    total = 0
+    stalled = set()
+    with ThreadPoolExecutor(worker_count(workers)) as executor:
+        while True:
+            # Customers that made no progress wait for the next drain
+            customers = [customer_id for customer_id in pending_customers() if customer_id not in stalled]
+            if not customers:
+                return total
+            for customer_id, applied in zip(customers, executor.map(_process_and_close, customers)):
+                total += applied
+                if not applied:
+                    stalled.add(customer_id)
+
+
+def _process_and_close(customer_id):
+    try:
+        return process_customer(customer_id)
+    finally:
+        close_old_connections()
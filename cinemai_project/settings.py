@@ -11,9 +11,11 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
 import os
+import sys
 from pathlib import Path
 from decouple import config
 import dj_database_url
+from django.core.exceptions import ImproperlyConfigured
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -61,20 +63,68 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'cinemai.entitlements.context_processor',
             ],
         },
     },
 ]
 
+# Production compiles each template once per process. Django 4.2 already
+# defaults to the cached loader; pinned here so custom loaders can't drop it
+if not DEBUG:
+    TEMPLATES[0]['APP_DIRS'] = False
+    TEMPLATES[0]['OPTIONS']['loaders'] = [
+        ('django.template.loaders.cached.Loader', [
+            'django.template.loaders.filesystem.Loader',
+            'django.template.loaders.app_directories.Loader',
+        ]),
+    ]
+
 WSGI_APPLICATION = 'cinemai_project.wsgi.application'
+ASGI_APPLICATION = 'cinemai_project.asgi.application'
+
+# Serve search through the async view; only enable when running under ASGI
+ASYNC_SEARCH = config('ASYNC_SEARCH', default=False, cast=bool)
 
 # Database
 DATABASES = {
     'default': dj_database_url.config(
-        default=config('DATABASE_URL', default=f'sqlite:///{BASE_DIR / "db.sqlite3"}')
+        default=config('DATABASE_URL', default=f'sqlite:///{BASE_DIR / "db.sqlite3"}'),
+        # Reuse connections across requests (checked before reuse)
+        conn_max_age=config('DB_CONN_MAX_AGE', default=600, cast=int),
+        conn_health_checks=True,
     )
 }
 
+# Connection tuning, see cinemai.dbtuning
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # Stock SQLite backend plus BEGIN IMMEDIATE and the pragmas below
+    DATABASES['default']['ENGINE'] = 'cinemai.dbtuning'
+elif DATABASES['default']['ENGINE'] == 'django.db.backends.postgresql':
+    # Server-side cursors stream .iterator() results; turn them off behind
+    # a transaction-pooling pgbouncer
+    DATABASES['default']['DISABLE_SERVER_SIDE_CURSORS'] = not config('DB_SERVER_SIDE_CURSORS', default=True, cast=bool)
+
+# Postgres statement_timeout (milliseconds, 0 for none), set on connections
+# of web processes and of the management commands listed below (workers);
+# migrate and other one-off commands run without it
+DB_STATEMENT_TIMEOUT = config('DB_STATEMENT_TIMEOUT', default=30000, cast=int)
+DB_STATEMENT_TIMEOUT_COMMANDS = config(
+    'DB_STATEMENT_TIMEOUT_COMMANDS', default='runserver,process_stripe_events,enrich_movies,prune_search_history',
+).split(',')
+
+# Run on every new connection of the tuned SQLite backend
+SQLITE_PRAGMAS = {
+    # Milliseconds a writer waits for the lock before "database is locked"
+    'busy_timeout': config('SQLITE_BUSY_TIMEOUT', default=5000, cast=int),
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': config('SQLITE_MMAP_SIZE', default=256 * 1024 * 1024, cast=int),
+    # Negative: KiB rather than pages
+    'cache_size': -config('SQLITE_CACHE_SIZE_KB', default=64 * 1024, cast=int),
+    'temp_store': 'MEMORY',
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -114,9 +164,200 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 STRIPE_PUBLIC_KEY = config('STRIPE_PUBLIC_KEY', default='')
 STRIPE_SECRET_KEY = config('STRIPE_SECRET_KEY', default='')
 STRIPE_WEBHOOK_SECRET = config('STRIPE_WEBHOOK_SECRET', default='')
+# Webhook events are stored, then applied by cinemai.webhooks: 'background'
+# (a thread in each web worker) or 'command' (manage.py process_stripe_events)
+STRIPE_WEBHOOK_PROCESSING = config('STRIPE_WEBHOOK_PROCESSING', default='background')
+STRIPE_WEBHOOK_WORKERS = config('STRIPE_WEBHOOK_WORKERS', default=4, cast=int)
+STRIPE_WEBHOOK_POLL_INTERVAL = config('STRIPE_WEBHOOK_POLL_INTERVAL', default=30, cast=float)
+STRIPE_WEBHOOK_MAX_ATTEMPTS = config('STRIPE_WEBHOOK_MAX_ATTEMPTS', default=5, cast=int)
+# Stripe API client (cinemai.billing); STRIPE_API_BASE points at cinemai.fake_stripe in tests
+STRIPE_API_BASE = config('STRIPE_API_BASE', default='')
+STRIPE_CONNECT_TIMEOUT = config('STRIPE_CONNECT_TIMEOUT', default=3, cast=float)
+STRIPE_READ_TIMEOUT = config('STRIPE_READ_TIMEOUT', default=10, cast=float)
+STRIPE_MAX_NETWORK_RETRIES = config('STRIPE_MAX_NETWORK_RETRIES', default=2, cast=int)
+STRIPE_POOL_SIZE = config('STRIPE_POOL_SIZE', default=10, cast=int)
+STRIPE_CURRENCY = config('STRIPE_CURRENCY', default='usd')
+# Price ids per tier, as printed by `manage.py sync_stripe_prices`; looked up when empty
+STRIPE_PRICE_IDS = {
+    tier: config(f'STRIPE_PRICE_{tier}', default='') for tier in ('BASIC', 'STANDARD', 'PRO')
+}
+# Checkout sessions are reused per user and tier for up to this many seconds
+STRIPE_CHECKOUT_SESSION_TTL = config('STRIPE_CHECKOUT_SESSION_TTL', default=3600, cast=int)
 
 # OpenAI Configuration
 OPENAI_API_KEY = config('OPENAI_API_KEY', default='')
+# Empty for api.openai.com; point at cinemai.fake_llm in tests
+OPENAI_BASE_URL = config('OPENAI_BASE_URL', default='')
+LLM_MODEL = config('LLM_MODEL', default='gpt-3.5-turbo')
+
+# LLM gateway (cinemai.llm): timeouts in seconds, per worker process
+LLM_CONNECT_TIMEOUT = config('LLM_CONNECT_TIMEOUT', default=3, cast=float)
+LLM_READ_TIMEOUT = config('LLM_READ_TIMEOUT', default=20, cast=float)
+LLM_TOTAL_TIMEOUT = config('LLM_TOTAL_TIMEOUT', default=30, cast=float)
+LLM_MAX_RETRIES = config('LLM_MAX_RETRIES', default=2, cast=int)
+LLM_RETRY_BASE_DELAY = config('LLM_RETRY_BASE_DELAY', default=0.5, cast=float)
+LLM_RETRY_MAX_DELAY = config('LLM_RETRY_MAX_DELAY', default=4, cast=float)
+LLM_MAX_CONCURRENCY = config('LLM_MAX_CONCURRENCY', default=8, cast=int)
+LLM_QUEUE_TIMEOUT = config('LLM_QUEUE_TIMEOUT', default=1, cast=float)
+LLM_KEEPALIVE_EXPIRY = config('LLM_KEEPALIVE_EXPIRY', default=30, cast=float)
+LLM_BREAKER_ERROR_RATE = config('LLM_BREAKER_ERROR_RATE', default=0.5, cast=float)
+LLM_BREAKER_MIN_REQUESTS = config('LLM_BREAKER_MIN_REQUESTS', default=10, cast=int)
+LLM_BREAKER_WINDOW = config('LLM_BREAKER_WINDOW', default=60, cast=float)
+LLM_BREAKER_COOLDOWN = config('LLM_BREAKER_COOLDOWN', default=30, cast=float)
+# Micro-batching: recommendation prompts arriving within this many seconds
+# (up to LLM_BATCH_MAX_SIZE of them) share one completion; 0 disables it.
+# Sync views batch on a thread pool with the sync client; the async search
+# view (ASYNC_SEARCH) batches on its event loop with the async client
+LLM_BATCH_WINDOW = config('LLM_BATCH_WINDOW', default=0.025, cast=float)
+LLM_BATCH_MAX_SIZE = config('LLM_BATCH_MAX_SIZE', default=8, cast=int)
+# Per-tier LLM search limits and token quotas are part of each plan in cinemai.tiers
+
+# Movie search: dotted path to a backend class, or empty to pick by database
+MOVIE_SEARCH_BACKEND = config('MOVIE_SEARCH_BACKEND', default='')
+SEARCH_RESULTS_PER_PAGE = config('SEARCH_RESULTS_PER_PAGE', default=20, cast=int)
+
+# Minimum trigram similarity for an LLM title to reuse an existing Movie row
+TITLE_MATCH_THRESHOLD = config('TITLE_MATCH_THRESHOLD', default=0.8, cast=float)
+
+# Local recommendation engine (manage.py build_recommendation_index).
+# 'llm': LLM first, local index only without an API key; 'local': local index
+# first, LLM as fallback; 'rerank': LLM results re-ordered by the local index
+RECOMMENDER_MODE = config('RECOMMENDER_MODE', default='llm')
+RECOMMENDER_INDEX_DIR = config('RECOMMENDER_INDEX_DIR', default=str(BASE_DIR / '.cache' / 'recommender'))
+RECOMMENDER_DIMENSIONS = config('RECOMMENDER_DIMENSIONS', default=2048, cast=int)
+RECOMMENDER_RESULTS = config('RECOMMENDER_RESULTS', default=10, cast=int)
+RECOMMENDER_MIN_SCORE = config('RECOMMENDER_MIN_SCORE', default=0.05, cast=float)
+
+# Personalized ranking: how much the user's taste profile (0..1) outweighs
+# the original result order (cached per CACHE_NAMESPACES['taste'])
+TASTE_WEIGHT = config('TASTE_WEIGHT', default=0.3, cast=float)
+
+# Watchlist keyset pagination
+WATCHLIST_PAGE_SIZE = config('WATCHLIST_PAGE_SIZE', default=24, cast=int)
+WATCHLIST_MAX_PAGE_SIZE = config('WATCHLIST_MAX_PAGE_SIZE', default=100, cast=int)
+WATCHLIST_BULK_MAX_OPERATIONS = config('WATCHLIST_BULK_MAX_OPERATIONS', default=1000, cast=int)
+
+# Search history: 'buffered' batches writes off the request path (best effort),
+# 'sync' writes each search immediately
+SEARCH_HISTORY_MODE = config('SEARCH_HISTORY_MODE', default='buffered')
+SEARCH_HISTORY_BATCH_SIZE = config('SEARCH_HISTORY_BATCH_SIZE', default=100, cast=int)
+SEARCH_HISTORY_FLUSH_INTERVAL = config('SEARCH_HISTORY_FLUSH_INTERVAL', default=5, cast=float)
+# Retention (manage.py prune_search_history): raw rows older than this are
+# deleted once rolled up into SearchRollup
+SEARCH_HISTORY_RETENTION_DAYS = config('SEARCH_HISTORY_RETENTION_DAYS', default=90, cast=int)
+SEARCH_HISTORY_RETENTION_BATCH_SIZE = config('SEARCH_HISTORY_RETENTION_BATCH_SIZE', default=5000, cast=int)
+# Raw rows are rolled up only once they are this many seconds old -- far
+# longer than a buffered flush takes to commit -- so no row can still appear
+# behind the rollup checkpoint
+SEARCH_HISTORY_ROLLUP_LAG = config(
+    'SEARCH_HISTORY_ROLLUP_LAG', default=max(300, SEARCH_HISTORY_FLUSH_INTERVAL * 10), cast=float,
+)
+
+# Popular searches / typeahead
+POPULARITY_HALF_LIFE_HOURS = config('POPULARITY_HALF_LIFE_HOURS', default=72, cast=float)
+SUGGESTIONS_LIMIT = config('SUGGESTIONS_LIMIT', default=8, cast=int)
+SUGGESTIONS_INDEX_SIZE = config('SUGGESTIONS_INDEX_SIZE', default=5000, cast=int)
+SUGGESTIONS_REFRESH_INTERVAL = config('SUGGESTIONS_REFRESH_INTERVAL', default=60, cast=float)
+
+# Movie metadata enrichment (manage.py enrich_movies)
+MOVIE_METADATA_PROVIDER = config('MOVIE_METADATA_PROVIDER', default='cinemai.enrichment.OMDbProvider')
+MOVIE_METADATA_FIXTURE = config('MOVIE_METADATA_FIXTURE', default='')
+OMDB_API_KEY = config('OMDB_API_KEY', default='')
+OMDB_API_URL = config('OMDB_API_URL', default='https://www.omdbapi.com/')
+OMDB_TIMEOUT = config('OMDB_TIMEOUT', default=5, cast=float)
+OMDB_RATE_LIMIT = config('OMDB_RATE_LIMIT', default=10, cast=float)  # requests per second
+ENRICHMENT_BATCH_SIZE = config('ENRICHMENT_BATCH_SIZE', default=100, cast=int)
+ENRICHMENT_WORKERS = config('ENRICHMENT_WORKERS', default=8, cast=int)
+
+# Caches. Every alias but 'ratelimit' uses the backend picked by CACHE_BACKEND:
+# 'redis' (REDIS_URL), 'file' (a directory per alias under CACHE_DIR, shared by
+# the workers of one host) or 'locmem' (one process only). manage.py test
+# always uses locmem and database counters, so tests never see (or fill) the
+# caches of a dev server
+TESTING = sys.argv[1:2] == ['test']
+REDIS_URL = '' if TESTING else config('REDIS_URL', default='')
+CACHE_BACKEND = 'locmem' if TESTING else config('CACHE_BACKEND', default='redis' if REDIS_URL else 'file')
+CACHE_DIR = config('CACHE_DIR', default=str(BASE_DIR / '.cache'))
+
+
+def _cache(alias, max_entries, location=None):
+    if CACHE_BACKEND == 'redis':
+        # One Redis, one key prefix per alias (clear() still flushes the db)
+        return {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': REDIS_URL, 'KEY_PREFIX': alias}
+    if CACHE_BACKEND == 'file':
+        return {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': location or str(Path(CACHE_DIR) / alias),
+            'OPTIONS': {'MAX_ENTRIES': max_entries},
+        }
+    if CACHE_BACKEND == 'locmem':
+        return {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': alias,
+            'OPTIONS': {'MAX_ENTRIES': max_entries},
+        }
+    raise ImproperlyConfigured(f"CACHE_BACKEND must be 'redis', 'file' or 'locmem', not {CACHE_BACKEND!r}")
+
+
+CACHES = {
+    # Sessions, entitlements, taste profiles, checkouts, anonymous pages, cache stats
+    'default': _cache('default', config('DEFAULT_CACHE_MAX_ENTRIES', default=20000, cast=int)),
+    # Shared between gunicorn workers so a recommendation is only paid for once
+    'recommendations': _cache(
+        'recommendations',
+        config('RECOMMENDATION_CACHE_MAX_ENTRIES', default=10000, cast=int),
+        location=config('RECOMMENDATION_CACHE_DIR', default='') or None,
+    ),
+    # Rendered movie cards; keys include Movie.version
+    'template_fragments': _cache('template_fragments', config('FRAGMENT_CACHE_MAX_ENTRIES', default=20000, cast=int)),
+    # LLM rate limit buckets and token counters; must be shared with atomic
+    # incr for the limits to hold across gunicorn workers (locmem is per
+    # process and the file backend's incr isn't atomic), so without Redis
+    # they live in the database, see cinemai.counters
+    'ratelimit': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+        'KEY_PREFIX': 'ratelimit',
+    } if REDIS_URL else {
+        'BACKEND': 'cinemai.counters.DatabaseCounterCache',
+    },
+}
+
+# Key version and TTL (seconds) per cache namespace, see cinemai.caching.
+# Bumping a version drops every entry of that namespace at once
+CACHE_NAMESPACES = {
+    'recommendations': {
+        'version': config('RECOMMENDATION_CACHE_VERSION', default=2, cast=int),
+        'timeout': config('RECOMMENDATION_CACHE_TIMEOUT', default=3600, cast=int),
+    },
+    # Subscription snapshots (dropped on profile save)
+    'profile': {
+        'version': config('PROFILE_CACHE_VERSION', default=1, cast=int),
+        'timeout': config('ENTITLEMENT_CACHE_TIMEOUT', default=300, cast=int),
+    },
+    'taste': {
+        'version': config('TASTE_PROFILE_CACHE_VERSION', default=1, cast=int),
+        'timeout': config('TASTE_PROFILE_CACHE_TIMEOUT', default=300, cast=int),
+    },
+    # Rendered movie cards
+    'movie': {
+        'version': config('MOVIE_CACHE_VERSION', default=1, cast=int),
+        'timeout': config('MOVIE_CACHE_TIMEOUT', default=86400, cast=int),
+    },
+}
+# Seconds between adding a process's hit/miss counts to the shared counters
+CACHE_STATS_FLUSH_INTERVAL = config('CACHE_STATS_FLUSH_INTERVAL', default=10, cast=float)
+
+# Sessions: read from the cache, written through to the database
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+SESSION_CACHE_ALIAS = 'default'
+
+# Seconds anonymous visitors get the home page from the cache; 0 disables it
+ANONYMOUS_PAGE_CACHE_TIMEOUT = config('ANONYMOUS_PAGE_CACHE_TIMEOUT', default=300, cast=int)
+
+# Recommendation cache tuning
+RECOMMENDATION_CACHE_LOCAL_ENTRIES = config('RECOMMENDATION_CACHE_LOCAL_ENTRIES', default=512, cast=int)
+RECOMMENDATION_CACHE_LOCK_TIMEOUT = config('RECOMMENDATION_CACHE_LOCK_TIMEOUT', default=30, cast=int)
 
 # Email Configuration (for password reset)
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'  # Change for production
@@ -126,6 +367,14 @@ EMAIL_USE_TLS = config('EMAIL_USE_TLS', default=True, cast=bool)
 EMAIL_HOST_USER = config('EMAIL_HOST_USER', default='')
 EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
 
+# Load the session user's profile in the same query as the user. ModelBackend
+# stays listed: sessions created before ProfileBackend name it, and
+# django.contrib.auth.get_user logs out sessions whose backend isn't listed
+AUTHENTICATION_BACKENDS = [
+    'cinemai.entitlements.ProfileBackend',
+    'django.contrib.auth.backends.ModelBackend',
+]
+
 # Login/Logout URLs
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'home'
@@ -0,0 +1,152 @@
+/**
+ * CinemAI - Search Page JavaScript
+ * Streams recommendations and renders each movie card as soon as it arrives
+ */
+
+document.addEventListener('DOMContentLoaded', function() {
+    const form = document.getElementById('search-form');
+    const results = document.getElementById('search-results');
+    const status = document.getElementById('search-status');
+
+    if (!form || !window.fetch) {
+        return;
+    }
+
+    setupSuggestions();
+
+    // Without streaming support fall back to the normal form POST
+    if (!window.TextDecoder || !window.ReadableStream) {
+        return;
+    }
+
+    form.addEventListener('submit', async (e) => {
+        // Pagination buttons submit the form normally
+        if (e.submitter && e.submitter.name === 'page') {
+            return;
+        }
+        e.preventDefault();
+
+        const submitBtn = form.querySelector('button[type="submit"]');
+        const originalText = submitBtn.innerHTML;
+        submitBtn.disabled = true;
+        submitBtn.innerHTML = '<span class="spinner-border spinner-border-sm"></span> Searching...';
+
+        results.innerHTML = '';
+        status.textContent = 'Finding movies for you...';
+        let count = 0;
+
+        try {
+            const response = await fetch(form.dataset.streamUrl, {
+                method: 'POST',
+                body: new FormData(form),
+                headers: {'Accept': 'application/x-ndjson'}
+            });
+
+            if (!response.ok || !response.body) {
+                throw new Error('Search failed');
+            }
+
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+
+            while (true) {
+                const {value, done} = await reader.read();
+                if (done) {
+                    break;
+                }
+                buffer += decoder.decode(value, {stream: true});
+
+                // Each complete line is one JSON event
+                const lines = buffer.split('\n');
+                buffer = lines.pop();
+                for (const line of lines) {
+                    if (handleEvent(line)) {
+                        count++;
+                    }
+                }
+            }
+            if (handleEvent(buffer)) {
+                count++;
+            }
+
+            status.textContent = count ? `${count} movies found` : 'No movies found';
+        } catch (error) {
+            console.error('Search error:', error);
+            status.textContent = 'An error occurred. Please try again.';
+        } finally {
+            submitBtn.disabled = false;
+            submitBtn.innerHTML = originalText;
+        }
+    });
+
+    /**
+     * Render a single NDJSON event, returning true when a card was added
+     */
+    function handleEvent(line) {
+        if (!line.trim()) {
+            return false;
+        }
+        const event = JSON.parse(line);
+        if (event.type === 'movie') {
+            results.insertAdjacentHTML('beforeend', event.html);
+            return true;
+        }
+        if (event.type === 'error') {
+            status.textContent = event.message;
+        }
+        return false;
+    }
+
+    /**
+     * Typeahead suggestions and popular-search chips
+     */
+    function setupSuggestions() {
+        const input = form.querySelector('input[name="search_query"]');
+        const datalist = document.getElementById('search-suggestions');
+        const popular = document.getElementById('popular-searches');
+        let timer = null;
+
+        async function fetchSuggestions(prefix) {
+            const params = new URLSearchParams({q: prefix});
+            const response = await fetch(`${form.dataset.suggestUrl}?${params}`, {
+                headers: {'Accept': 'application/json'}
+            });
+            return response.ok ? (await response.json()).suggestions : [];
+        }
+
+        input.addEventListener('input', () => {
+            clearTimeout(timer);
+            const prefix = input.value.trim();
+            if (!prefix) {
+                return;
+            }
+            timer = setTimeout(async () => {
+                const suggestions = await fetchSuggestions(prefix);
+                datalist.innerHTML = '';
+                suggestions.forEach(text => {
+                    const option = document.createElement('option');
+                    option.value = text;
+                    datalist.appendChild(option);
+                });
+            }, 150);
+        });
+
+        fetchSuggestions('').then(suggestions => {
+            suggestions.forEach(text => {
+                const chip = document.createElement('button');
+                chip.type = 'button';
+                chip.className = 'btn btn-outline-secondary btn-sm me-2 mb-2';
+                chip.textContent = text;
+                chip.addEventListener('click', () => {
+                    input.value = text;
+                    form.requestSubmit();
+                });
+                popular.appendChild(chip);
+            });
+            if (suggestions.length) {
+                popular.classList.remove('d-none');
+            }
+        });
+    }
+});
@@ -0,0 +1,63 @@
+/**
+ * CinemAI - Watchlist Page JavaScript
+ * Infinite scroll over the keyset-paginated watchlist API
+ */
+
+document.addEventListener('DOMContentLoaded', function() {
+    const more = document.getElementById('watchlist-more');
+    const items = document.getElementById('watchlist-items');
+
+    // Without IntersectionObserver the "Load more" link still pages normally
+    if (!more || !items || !window.fetch || !window.IntersectionObserver) {
+        return;
+    }
+
+    let loading = false;
+
+    async function loadMore() {
+        if (loading || !more.dataset.cursor) {
+            return;
+        }
+        loading = true;
+
+        const params = new URLSearchParams({cursor: more.dataset.cursor});
+        if (more.dataset.watched) {
+            params.set('watched', more.dataset.watched);
+        }
+
+        try {
+            const response = await fetch(`${more.dataset.apiUrl}?${params}`, {
+                headers: {'Accept': 'application/json'}
+            });
+            if (!response.ok) {
+                throw new Error('Could not load watchlist');
+            }
+            const data = await response.json();
+
+            data.items.forEach(item => items.insertAdjacentHTML('beforeend', item.html));
+
+            if (data.next_cursor) {
+                more.dataset.cursor = data.next_cursor;
+            } else {
+                observer.disconnect();
+                more.remove();
+            }
+        } catch (error) {
+            console.error('Watchlist error:', error);
+        } finally {
+            loading = false;
+        }
+    }
+
+    const observer = new IntersectionObserver(entries => {
+        if (entries.some(entry => entry.isIntersecting)) {
+            loadMore();
+        }
+    }, {rootMargin: '400px'});
+    observer.observe(more);
+
+    more.addEventListener('click', e => {
+        e.preventDefault();
+        loadMore();
+    });
+});